@@ -2,10 +2,16 @@
 # Apply migrations
 python ./manage.py migrate
 
+# Hash and compress the static files served by WhiteNoise
+python ./manage.py collectstatic --noinput
+
 # Apply fixtures
 python ./manage.py loaddata data/users.json
 python ./manage.py loaddata data/polls-v4.json
 python ./manage.py loaddata data/votes-v4.json
+# Fixtures bypass the views, so count their votes into the tallies
+python ./manage.py rebuild_vote_counts
 
-# Run the server
-python ./manage.py runserver 0.0.0.0:8000
\ No newline at end of file
+# Run the server, ASGI workers serving the async views
+export ASYNC_VIEWS=True
+exec gunicorn -c gunicorn.conf.py mysite.asgi:application
\ No newline at end of file
@@ -0,0 +1,22 @@
+"""
+Gunicorn configuration of KU Polls.
+
+ASGI, with ASYNC_VIEWS=True (default worker class):
+    gunicorn -c gunicorn.conf.py mysite.asgi:application
+WSGI, for comparison:
+    GUNICORN_WORKER_CLASS=gthread gunicorn -c gunicorn.conf.py mysite.wsgi:application
+"""
+import multiprocessing
+from decouple import config as env
+
+bind = env("GUNICORN_BIND", default="0.0.0.0:8000")
+# each worker takes about 45 MB and runs its own lifecycle scheduler, history writer and
+# ingest worker, so the default stays small: set GUNICORN_WORKERS to the memory available
+workers = env("GUNICORN_WORKERS", default=min(multiprocessing.cpu_count() * 2 + 1, 4), cast=int)
+worker_class = env("GUNICORN_WORKER_CLASS", default="uvicorn_worker.UvicornWorker")
+# threads of a gthread (WSGI) worker, ignored by the ASGI worker
+threads = env("GUNICORN_THREADS", default=4, cast=int)
+timeout = env("GUNICORN_TIMEOUT", default=30, cast=int)
+graceful_timeout = 30
+keepalive = 5
+accesslog = env("GUNICORN_ACCESS_LOG", default=None)
@@ -16,6 +16,7 @@ Including another URLconf
 """
 
 from django.contrib import admin
+from django.contrib.staticfiles.urls import staticfiles_urlpatterns
 from django.urls import path, include
 from django.views.generic.base import RedirectView
 
@@ -25,3 +26,6 @@ urlpatterns = [
     path('accounts/', include('django.contrib.auth.urls')),
     path('polls/', include("polls.urls"))
 ]
+
+# runserver serves the static files by itself, gunicorn needs them routed (DEBUG only)
+urlpatterns += staticfiles_urlpatterns()
@@ -0,0 +1,158 @@
+"""
+Provide the JSON read API of the polls application.
+
+Every response has a strong ETag made of a hash of its body, the same in
+every process and for the management commands, so a request with a matching
+If-None-Match is answered 304 Not Modified without the body. The question
+results are read from the results cache. Cache-Control lets the clients and a
+CDN keep a response API_CACHE_MAX_AGE seconds, then revalidate.
+"""
+import functools
+import time
+from django.conf import settings
+from django.http import JsonResponse
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control, set_response_etag
+from django.views.decorators.http import require_GET
+from polls.cache import get_results
+from polls.history import BUCKET_SIZES, results_over_time
+from polls.metrics import query_budget
+from polls.models import Question
+from polls.views import IndexView, decode_cursor, encode_cursor
+
+
+def api_cache_control(view):
+    """Add the Cache-Control of the API to the responses of a view, 304 included."""
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        response = view(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            patch_cache_control(response, public=True, max_age=settings.API_CACHE_MAX_AGE)
+        return response
+    return wrapper
+
+
+def content_etag(view):
+    """Tag the responses of a view with a hash of their body, 304 when the client has it."""
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        response = view(request, *args, **kwargs)
+        if response.status_code != 200:
+            return response
+        set_response_etag(response)
+        return get_conditional_response(request, etag=response["ETag"], response=response)
+    return wrapper
+
+
+def error(message, status):
+    """Return a JSON error response."""
+    return JsonResponse({"error": message}, status=status)
+
+
+def question_data(question):
+    """Return the fields of a question shown by the API."""
+    return {
+        "id": question.id,
+        "question_text": question.question_text,
+        "pub_date": question.pub_date.isoformat(),
+        "end_date": question.end_date.isoformat() if question.end_date else None,
+        "status": question.status,
+        "url": reverse("polls:api_question", args=[question.id]),
+        "results_url": reverse("polls:api_results", args=[question.id]),
+        "timeline_url": reverse("polls:api_timeline", args=[question.id]),
+    }
+
+
+@query_budget(1)
+@require_GET
+@api_cache_control
+@content_etag
+def question_list(request):
+    """Return a page of the published questions, newest first, filtered by ?status=."""
+    status = request.GET.get("status", "all")
+    if status not in IndexView.statuses:
+        return error("Unknown status", 400)
+    questions = getattr(Question.objects, IndexView.statuses[status])()
+    if cursor := request.GET.get("after"):
+        try:
+            questions = questions.after(*decode_cursor(cursor))
+        except ValueError:
+            return error("Invalid cursor", 400)
+    page_size = settings.INDEX_PAGE_SIZE
+    # one more question tells whether there is a next page
+    questions = list(questions[:page_size + 1])
+    next_url = None
+    if len(questions) > page_size:
+        next_url = (f"{reverse('polls:api_questions')}?status={status}"
+                    f"&after={encode_cursor(questions[page_size - 1])}")
+    return JsonResponse({"questions": [question_data(question)
+                                       for question in questions[:page_size]],
+                         "next": next_url})
+
+
+@query_budget(2)
+@require_GET
+@api_cache_control
+@content_etag
+def question_detail(request, question_id):
+    """Return a published question with its choices."""
+    question = Question.objects.published().filter(pk=question_id).first()
+    if question is None:
+        return error("Question not found", 404)
+    data = question_data(question)
+    data["can_vote"] = question.can_vote()
+    data["choices"] = [{"id": choice_id, "choice_text": choice_text} for choice_id, choice_text
+                       in question.choice_set.order_by("id").values_list("id", "choice_text")]
+    return JsonResponse(data)
+
+
+def published_results(question_id):
+    """Return the cached results of a published question, None if there is none."""
+    if not Question.objects.published().filter(pk=question_id).exists():
+        return None
+    return get_results(question_id)
+
+
+@query_budget(3)
+@require_GET
+@api_cache_control
+@content_etag
+def question_results(request, question_id):
+    """Return the votes and percentage of every choice of a published question."""
+    results = published_results(question_id)
+    if results is None:
+        return error("Question not found", 404)
+    return JsonResponse(results)
+
+
+@query_budget(4)
+@require_GET
+@api_cache_control
+@content_etag
+def question_timeline(request, question_id):
+    """
+    Return the votes of every choice of a question over time, per ?resolution=minute or hour.
+
+    ?since= is a Unix time, by default the last day for minutes and the whole poll for hours.
+    """
+    resolution = request.GET.get("resolution", "hour")
+    if resolution not in BUCKET_SIZES:
+        return error("Unknown resolution", 400)
+    since = request.GET.get("since")
+    if since is None:
+        since = int(time.time()) - 86400 if resolution == "minute" else None
+    else:
+        try:
+            since = int(since)
+        except ValueError:
+            return error("Invalid since", 400)
+    results = published_results(question_id)
+    if results is None:
+        return error("Question not found", 404)
+    return JsonResponse({
+        "id": question_id,
+        "resolution": resolution,
+        "choices": [{"id": choice["id"], "choice_text": choice["choice_text"]}
+                    for choice in results["results"]],
+        "buckets": results_over_time(question_id, results, resolution, since),
+    })
@@ -3,3 +3,17 @@ from django.apps import AppConfig
 class PollsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'polls'
+
+    def ready(self):
+        # connect the signal receivers invalidating the results cache
+        from polls import cache  # noqa: F401
+        # and the receiver counting the queries of the request metrics
+        from polls import metrics  # noqa: F401
+        # and the receivers storing the status of the questions and starting the scheduler
+        from polls import lifecycle  # noqa: F401
+        # and the receiver dropping the cached users
+        from polls import auth  # noqa: F401
+        # and the receivers purging the pages cached by the reverse proxy
+        from polls import proxy  # noqa: F401
+        # and the receiver buffering the vote history
+        from polls import history  # noqa: F401
@@ -0,0 +1,184 @@
+"""
+Provide async versions of the poll views, used with ASYNC_VIEWS under ASGI.
+
+The queries use the async ORM. Code without an async API (template rendering,
+which reads the session user, the vote upserts and the results cache) runs in
+a worker thread through sync_to_async.
+"""
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import messages
+from django.contrib.auth.decorators import login_required
+from django.http import Http404, HttpResponse, HttpResponseRedirect, StreamingHttpResponse
+from django.shortcuts import render
+from django.urls import reverse
+from django.views import View
+from polls.cache import get_results
+from polls.ingest import current_choice_id, enqueue_vote, queue_enabled
+from polls.metrics import query_budget
+from polls.models import Choice, Question, cast_vote, withdraw_vote
+from polls.streaming import event_stream, get_broadcaster, is_live, sse_event
+from polls.ratelimit import rate_limit
+from polls.views import get_client_ip, logger
+
+arender = sync_to_async(render)
+
+
+@query_budget(6)
+async def detail(request, question_id):
+    """Display the choice for a poll and allow voting."""
+    question = await Question.objects.with_results().filter(pk=question_id).afirst()
+    # Check if the question exists and is published or not
+    if question is None or not question.is_published():
+        messages.error(request, "Question not found")
+        logger.error("Non-existent question %s", question_id,
+                     extra={"event": "question_not_found", "question_id": question_id})
+        return HttpResponseRedirect(reverse('polls:index'))
+    # Check if the question is still in vote session
+    if not question.can_vote():
+        messages.error(request, "Section closed for voting")
+        logger.error("Someone try to vote closed question %s", question_id,
+                     extra={"event": "voting_closed", "question_id": question_id})
+        return HttpResponseRedirect(reverse('polls:index'))
+
+    # Get user's vote
+    current_user = await request.auser()
+    choice = None
+    if current_user.is_authenticated:
+        choice_id = await sync_to_async(current_choice_id)(current_user, question)
+        choice = next((c for c in question.results if c.id == choice_id), None)
+    context = {'question': question, "selected_choice": choice}
+    return await arender(request, 'polls/detail.html', context=context)
+
+
+class ResultsView(View):
+    """Result page, contain result vote from user for question."""
+
+    query_budget = 4
+
+    async def get(self, request, pk):
+        """Render the cached results of the question."""
+        results = await sync_to_async(get_results)(pk)
+        if results is None:
+            raise Http404("Question not found")
+        return await arender(request, "polls/results.html", {
+            "question": results, "live_results": settings.ASYNC_VIEWS and is_live(results)})
+
+
+@query_budget(3)
+async def results_stream(request, pk):
+    """
+    Stream the results of a question as Server-Sent Events.
+
+    The first event has the whole results, the next ones only the changed
+    tallies, at most one per RESULTS_STREAM_INTERVAL. Under WSGI the connection
+    can not be held, so one results event is sent and the browser reconnects
+    after the interval, the results page only opens the stream under ASGI.
+    A closed question has no stream, 204 tells the browser not to reconnect.
+    """
+    if not settings.ASYNC_VIEWS:
+        results = await sync_to_async(get_results)(pk)
+        if results is None:
+            raise Http404("Question not found")
+        if not is_live(results):
+            return HttpResponse(status=204)
+        retry = int(settings.RESULTS_STREAM_INTERVAL * 1000)
+        return HttpResponse(f"retry: {retry}\n" + sse_event("results", results),
+                            content_type="text/event-stream")
+    broadcaster = get_broadcaster(pk)
+    subscriber, results = await broadcaster.subscribe()
+    if results is None or not is_live(results):
+        broadcaster.unsubscribe(subscriber)
+        if results is None:
+            raise Http404("Question not found")
+        return HttpResponse(status=204)
+    response = StreamingHttpResponse(event_stream(results, subscriber, broadcaster),
+                                     content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    # ask nginx not to buffer the stream
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+# a vote change on sharded counters sends the most queries
+@query_budget(16)
+@rate_limit("vote", get_client_ip)
+@login_required
+async def vote(request, question_id):
+    """
+    Handle when the user click vote.
+
+    If user does not select any choice, send back detail page with error message.
+    Otherwise, add votes for that choice and send back results page.
+    """
+    # the selected choice and its question are loaded by one query
+    try:
+        selected_choice = await Choice.objects.select_related("question").aget(
+            pk=request.POST["choice"], question_id=question_id)
+        question = selected_choice.question
+    except (KeyError, ValueError, Choice.DoesNotExist):
+        selected_choice = None
+        question = await Question.objects.filter(pk=question_id).afirst()
+        if question is None:
+            raise Http404("Question not found")
+    if not question.can_vote():
+        messages.error(request, "Section closed for voting")
+        logger.error("User try to vote for closed question %s", question_id,
+                     extra={"event": "voting_closed", "question_id": question_id})
+        return HttpResponseRedirect(reverse('polls:index'))
+    if selected_choice is None:
+        messages.error(request, "You did not select a choice.")
+        logger.error("User did not select the choice to vote.", extra={"event": "no_choice"})
+        return HttpResponseRedirect(reverse('polls:detail', args=(question.id,)))
+
+    # Reference to the current user
+    this_user = await request.auser()
+    if queue_enabled():
+        # written later by the ingest worker, detail() reads it back meanwhile
+        await sync_to_async(enqueue_vote)(this_user, question, selected_choice)
+        messages.success(request, f'Your vote for {selected_choice.choice_text} was recorded')
+    elif await sync_to_async(cast_vote)(this_user, question, selected_choice) is None:
+        messages.success(request, f'You voted for {selected_choice.choice_text}')
+    else:
+        messages.success(request, f'Your vote was changed to {selected_choice.choice_text}')
+
+    logger.info("User %s submitted a vote for choice %s on question %s",
+                this_user.username, selected_choice.id, question.id,
+                extra={"event": "vote", "user": this_user.username,
+                       "question_id": question.id, "choice_id": selected_choice.id})
+    return HttpResponseRedirect(reverse("polls:results", args=(question.id,)))
+
+
+@query_budget(10)
+async def delete_vote(request, question_id):
+    """Handle when user delete the choice."""
+    this_user = await request.auser()
+    question = await Question.objects.filter(pk=question_id).afirst()
+    if question is None:
+        messages.error(request, "Question not found")
+        logger.error("Non-existent question %s", question_id,
+                     extra={"event": "question_not_found", "question_id": question_id})
+        return HttpResponseRedirect(reverse('polls:index'))
+    if not question.can_vote():
+        # the results of a closed question are final
+        messages.error(request, "Section closed for voting")
+        logger.error("User try to delete a vote of closed question %s", question_id,
+                     extra={"event": "voting_closed", "question_id": question_id})
+        return HttpResponseRedirect(reverse('polls:index'))
+    if queue_enabled():
+        has_vote = (this_user.is_authenticated
+                    and await sync_to_async(current_choice_id)(this_user, question))
+        if has_vote:
+            await sync_to_async(enqueue_vote)(this_user, question, None)
+    else:
+        has_vote = await sync_to_async(withdraw_vote)(this_user, question) is not None
+    if not has_vote:
+        messages.error(request, "You have not voted for this question")
+        logger.error("User try to delete non-existent vote for question %s", question_id,
+                     extra={"event": "no_vote", "question_id": question_id})
+        return HttpResponseRedirect(reverse('polls:detail', args=(question_id,)))
+    messages.success(request, "Your vote was deleted.")
+    logger.info("User %s deleted their vote for question %s", this_user.username, question_id,
+                extra={"event": "vote_deleted", "user": this_user.username,
+                       "question_id": question_id})
+    return HttpResponseRedirect(reverse('polls:results', args=(question_id,)))
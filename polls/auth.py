@@ -0,0 +1,42 @@
+"""
+Provide the authentication backend of the polls application.
+
+AuthenticationMiddleware loads the user of the session on every request.
+CachedModelBackend keeps the users in the sessions cache, so with a cached or
+signed cookie session a voter is served without reading the database for
+them. The cached user is dropped when the user is saved or deleted.
+"""
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+
+def _user_key(user_id):
+    return f"auth:user:{user_id}"
+
+
+class CachedModelBackend(ModelBackend):
+    """ModelBackend reading the user of a session from the sessions cache."""
+
+    def get_user(self, user_id):
+        """Return the active user of the id, from the cache if it is there."""
+        cache = caches[settings.SESSION_CACHE_ALIAS]
+        user = cache.get(_user_key(user_id))
+        if user is None:
+            user = super().get_user(user_id)
+            if user is not None:
+                cache.set(_user_key(user_id), user, settings.AUTH_USER_CACHE_TIMEOUT)
+        return user
+
+
+@receiver([post_save, post_delete], sender=User)
+def user_changed(sender, instance, **kwargs):
+    """Drop the cached user when it is saved or deleted, now and when the transaction commits."""
+    def drop():
+        caches[settings.SESSION_CACHE_ALIAS].delete(_user_key(instance.pk))
+    drop()
+    transaction.on_commit(drop)
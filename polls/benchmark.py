@@ -0,0 +1,280 @@
+"""
+Provide the benchmark suite of the polls request paths.
+
+The data is generated from the fixtures in data/: every question of
+polls-v4.json (with its choices) and every user of users.json is copied as
+many times as asked. The flows are driven through the Django test client by
+concurrent threads, so no server is needed, and each request is timed and
+its SQL queries counted.
+"""
+import datetime
+import json
+import random
+import statistics
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import close_old_connections, connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from polls.models import Choice, Question, Vote
+
+FLOWS = ("index", "detail", "results", "vote", "vote_change", "login", "signup")
+# the flows hashing a password, much slower than the other ones
+AUTH_FLOWS = ("login", "signup")
+
+# password of every generated user, and of the users created by the signup flow
+PASSWORD = "benchmark-password-4821"
+
+
+def percentile(latencies, percent):
+    """Return the percent percentile of sorted latencies."""
+    if not latencies:
+        return 0.0
+    index = min(len(latencies) - 1, int(len(latencies) * percent / 100))
+    return latencies[index]
+
+
+def load_fixture(name):
+    """Return the objects of a fixture in data/ grouped by model."""
+    objects = {}
+    with open(Path(settings.BASE_DIR) / "data" / name) as file:
+        for obj in json.load(file):
+            objects.setdefault(obj["model"], []).append(obj)
+    return objects
+
+
+def seed(questions, users):
+    """
+    Create questions and users from the fixture templates, return the open questions.
+
+    A template question without end_date stays open, the other ones are closed.
+    """
+    polls = load_fixture("polls-v4.json")
+    templates = polls["polls.question"]
+    template_choices = {}
+    for choice in polls["polls.choice"]:
+        template_choices.setdefault(choice["fields"]["question"], []).append(choice)
+    now = timezone.now()
+
+    with transaction.atomic():
+        created = Question.objects.bulk_create(
+            Question(
+                question_text=f"{template['fields']['question_text']} #{n}",
+                pub_date=now - datetime.timedelta(days=1, minutes=n),
+                end_date=(None if template["fields"]["end_date"] is None
+                          else now - datetime.timedelta(hours=1)),
+                status=(Question.Status.OPEN if template["fields"]["end_date"] is None
+                        else Question.Status.CLOSED),
+            )
+            for n, template in ((n, templates[n % len(templates)]) for n in range(questions))
+        )
+        # bulk_create only returns the ids on PostgreSQL and SQLite 3.35+
+        Choice.objects.bulk_create(
+            Choice(question_id=question.id, choice_text=choice["fields"]["choice_text"])
+            for n, question in enumerate(created)
+            for choice in template_choices.get(templates[n % len(templates)]["pk"], [])
+        )
+        user_templates = load_fixture("users.json")["auth.user"]
+        # one hash for every user, hashing each password would take longer than the benchmark
+        password = make_password(PASSWORD)
+        User.objects.bulk_create(
+            User(username=f"{user_templates[n % len(user_templates)]['fields']['username']}_{n}",
+                 password=password)
+            for n in range(users)
+        )
+    return [question for question in created if question.end_date is None]
+
+
+def seed_votes(voters, rng):
+    """Let every voter vote a random choice of each question and store the tallies."""
+    choices = {}
+    for choice_id, question_id in Choice.objects.values_list("id", "question_id"):
+        choices.setdefault(question_id, []).append(choice_id)
+    votes = [
+        Vote(user=user, question_id=question_id, choice_id=rng.choice(choice_ids))
+        for user in voters
+        for question_id, choice_ids in choices.items()
+    ]
+    with transaction.atomic():
+        Vote.objects.bulk_create(votes, batch_size=500)
+        choice_counts = Counter(vote.choice_id for vote in votes)
+        question_counts = Counter(vote.question_id for vote in votes)
+        Choice.objects.bulk_update(
+            [Choice(id=choice_id, vote_count=count) for choice_id, count in choice_counts.items()],
+            ["vote_count"], batch_size=500)
+        Question.objects.bulk_update(
+            [Question(id=question_id, total_votes=count)
+             for question_id, count in question_counts.items()],
+            ["total_votes"], batch_size=500)
+    return len(votes)
+
+
+class Benchmark:
+    """
+    Run the flows of the polls pages with concurrent clients.
+
+    Each client is a thread with its own test client, logged in as its own user.
+    A flow sends `requests` requests split between the clients:
+
+    - index: the first index page
+    - detail: the detail page of a random open question
+    - results: the results page of a random open question
+    - vote: a first vote for the next open question of the client
+    - vote_change: a vote for another choice on the questions voted by `vote`
+    - login: a login of a random generated user, which checks its password hash
+    - signup: the registration of a new user, which hashes its password
+
+    After each request the connection is closed or kept like a server does, by
+    CONN_MAX_AGE, so the flows measure the connection setup too.
+    The votes are new only while a client has more open questions than requests.
+    The login and signup flows leave the client logged in as another user, so
+    they run last.
+    """
+
+    def __init__(self, clients, open_questions):
+        """Create a benchmark of the logged in clients over the open questions."""
+        self.clients = clients
+        self.questions = open_questions
+        self.usernames = list(User.objects.order_by("id").values_list("username", flat=True))
+        self.choices = {}
+        for choice_id, question_id in Choice.objects.filter(
+                question__in=open_questions).values_list("id", "question_id"):
+            self.choices.setdefault(question_id, []).append(choice_id)
+
+    def requests_of(self, flow, client_index, count):
+        """Return the (method, path, data) of the requests a client sends in a flow."""
+        rng = random.Random(f"{flow}-{client_index}")
+        requests = []
+        for n in range(count):
+            question = self.questions[n % len(self.questions)]
+            choices = self.choices[question.id]
+            if flow == "index":
+                requests.append(("get", reverse("polls:index"), None))
+            elif flow in ("detail", "results"):
+                question = rng.choice(self.questions)
+                requests.append(("get", reverse(f"polls:{flow}", args=[question.id]), None))
+            elif flow == "login":
+                requests.append(("post", reverse("login"),
+                                 {"username": rng.choice(self.usernames), "password": PASSWORD}))
+            elif flow == "signup":
+                username = f"signup_{client_index}_{n}_{rng.randrange(10 ** 9)}"
+                requests.append(("post", reverse("polls:signup"), {
+                    "username": username, "password1": PASSWORD, "password2": PASSWORD}))
+            else:
+                # the vote flow voted the first choice, vote_change moves to the next one
+                choice_id = choices[0] if flow == "vote" else choices[1 % len(choices)]
+                requests.append(("post", reverse("polls:vote", args=[question.id]),
+                                 {"choice": choice_id}))
+        return requests
+
+    def run(self, flow, requests):
+        """Send the requests of a flow from every client, return its statistics."""
+        per_client = [requests // len(self.clients)] * len(self.clients)
+        for n in range(requests % len(self.clients)):
+            per_client[n] += 1
+        plans = [self.requests_of(flow, n, count) for n, count in enumerate(per_client)]
+        samples, errors = [], []
+        lock = threading.Lock()
+        start = threading.Barrier(len(self.clients) + 1)
+
+        def send(client, plan):
+            own, failed = [], 0
+            start.wait()
+            try:
+                for method, path, data in plan:
+                    # the time includes opening the connection when it was closed
+                    began = time.perf_counter()
+                    size = 0
+                    with CaptureQueriesContext(connection) as queries:
+                        try:
+                            response = getattr(client, method)(path, data)
+                            failed += is_error(flow, response)
+                            size = len(response.content)
+                        except Exception:
+                            failed += 1
+                    elapsed = time.perf_counter() - began
+                    own.append((elapsed * 1000, len(queries), size))
+                    # what the server does after each request, the test client does not
+                    close_old_connections()
+            finally:
+                connection.close()
+                with lock:
+                    samples.extend(own)
+                    errors.append(failed)
+
+        threads = [threading.Thread(target=send, args=(client, plan))
+                   for client, plan in zip(self.clients, plans)]
+        for thread in threads:
+            thread.start()
+        start.wait()
+        began = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - began
+
+        latencies = sorted(latency for latency, _, _ in samples)
+        return {
+            "requests": len(samples),
+            "rps": len(samples) / elapsed,
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "mean": statistics.fmean(latencies) if latencies else 0.0,
+            "queries": statistics.fmean(n for _, n, _ in samples) if samples else 0.0,
+            "bytes": statistics.fmean(size for _, _, size in samples) if samples else 0.0,
+            "errors": sum(errors),
+        }
+
+
+def is_error(flow, response):
+    """Return True if the response to a request of a flow is an error."""
+    if flow == "login":
+        # a wrong password shows the form again
+        return response.status_code != 302
+    if flow == "signup":
+        # a rejected form redirects back to the signup page
+        return response.status_code != 302 or response.url != reverse("polls:index")
+    return response.status_code >= 400
+
+
+def login_clients(users):
+    """Return a test client logged in as each user."""
+    clients = []
+    for user in users:
+        client = Client(raise_request_exception=False)
+        client.force_login(user)
+        clients.append(client)
+    return clients
+
+
+def compare(results, baseline, tolerance):
+    """
+    Return the regressions of results against a baseline, as messages.
+
+    The req/s may drop and the median latency grow by the tolerance ratio,
+    the tail latencies are too noisy to compare between runs. The
+    queries per request only vary with the cache misses, so half a query more
+    per request is a regression.
+    """
+    regressions = []
+    for flow, stats in results.items():
+        base = baseline.get(flow)
+        if base is None:
+            continue
+        if stats["rps"] < base["rps"] * (1 - tolerance):
+            regressions.append(f"{flow}: {stats['rps']:.1f} req/s, baseline {base['rps']:.1f}")
+        if stats["p50"] > base["p50"] * (1 + tolerance):
+            regressions.append(f"{flow}: p50 {stats['p50']:.1f} ms, baseline {base['p50']:.1f}")
+        if stats["queries"] > base["queries"] + 0.5:
+            regressions.append(f"{flow}: {stats['queries']:.2f} queries/request, "
+                               f"baseline {base['queries']:.2f}")
+        if stats["errors"] > base.get("errors", 0):
+            regressions.append(f"{flow}: {stats['errors']} errors")
+    return regressions
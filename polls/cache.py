@@ -0,0 +1,224 @@
+"""Provide the caches of the poll results and the index page."""
+import math
+import threading
+import time
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Min, Q, prefetch_related_objects
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from polls.models import (Choice, Question, ResultsSnapshot, Vote, restore_votes,
+                          results_prefetch)
+from polls.signals import question_status_changed, vote_changed
+
+RESULTS_CACHE = "results"
+INDEX_CACHE = "default"
+INDEX_VERSION_KEY = "index:version"
+
+_stats_lock = threading.Lock()
+_stats = {
+    "results_hits": 0, "results_misses": 0, "results_invalidations": 0,
+    "index_hits": 0, "index_misses": 0,
+}
+
+
+def _count(name):
+    """Add one to a cache statistic of this process."""
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def cache_stats():
+    """Return the hits, misses and invalidations of the polls caches in this process."""
+    with _stats_lock:
+        return dict(_stats)
+
+
+def _version_key(question_id):
+    return f"results:version:{question_id}"
+
+
+def _current_version(cache, key):
+    """
+    Return the version stored at key.
+
+    A missing version (new or evicted) starts from the current time, so it can
+    never match an entry cached under an earlier version.
+    """
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def _bump_version(cache, key):
+    """Move the version stored at key, the entries of the old version become unreachable."""
+    try:
+        cache.incr(key)
+    except ValueError:
+        # no version yet, the next read starts a new one
+        pass
+
+
+def results_version(question_id):
+    """Return the current version of the results of a question."""
+    return _current_version(caches[RESULTS_CACHE], _version_key(question_id))
+
+
+def results_payload(question):
+    """Return the results of a question loaded with its results as a plain dict."""
+    return {
+        "id": question.id,
+        "question_text": question.question_text,
+        "status": question.status,
+        "total_votes": sum(choice.votes for choice in question.results),
+        "results": [
+            {
+                "id": choice.id,
+                "choice_text": choice.choice_text,
+                "votes": choice.votes,
+                "percentage": choice.percentage,
+            }
+            for choice in question.results
+        ],
+    }
+
+
+def build_results(question_id):
+    """
+    Return the results of a question as a plain dict, None if it does not exist.
+
+    The results of a frozen question are its snapshot, its choices are not read.
+    """
+    question = Question.objects.select_related("snapshot").filter(pk=question_id).first()
+    if question is None:
+        return None
+    snapshot = getattr(question, "snapshot", None)
+    if snapshot is not None:
+        return snapshot.payload
+    prefetch_related_objects([question], results_prefetch())
+    return results_payload(question)
+
+
+def get_results(question_id):
+    """
+    Return the results of a question from the cache, build them on a miss.
+
+    The results are cached under the question id and its version, so a new
+    version makes the old entry unreachable until it expires or is evicted.
+    """
+    cache = caches[RESULTS_CACHE]
+    key = f"results:{question_id}:{results_version(question_id)}"
+    results = cache.get(key)
+    if results is not None:
+        _count("results_hits")
+        return results
+    _count("results_misses")
+    results = build_results(question_id)
+    if results is not None:
+        cache.set(key, results)
+    return results
+
+
+def invalidate_results(question_id):
+    """
+    Move the results of a question to a new version.
+
+    The version is moved at once and again when the transaction commits, so a
+    reader cannot cache the data of before the commit under the last version.
+    """
+    def bump():
+        _bump_version(caches[RESULTS_CACHE], _version_key(question_id))
+        _count("results_invalidations")
+    bump()
+    transaction.on_commit(bump)
+
+
+def index_version():
+    """Return the current version of the question lists, moved when any question changes."""
+    return _current_version(caches[INDEX_CACHE], INDEX_VERSION_KEY)
+
+
+def next_boundary(now):
+    """Return the nearest pub_date or end_date after now, None if there is none."""
+    boundaries = Question.objects.aggregate(
+        opens=Min("pub_date", filter=Q(pub_date__gt=now)),
+        closes=Min("end_date", filter=Q(end_date__gt=now)),
+    )
+    upcoming = [date for date in boundaries.values() if date is not None]
+    return min(upcoming, default=None)
+
+
+def get_index_fragment(variant, render):
+    """
+    Return a question list of the index page, render() it on a miss.
+
+    variant names the filter and page of the list. The fragments are dropped
+    when a question is edited, opens or closes. They also expire when the next
+    question opens or closes, for the processes the lifecycle events do not
+    reach, or after INDEX_CACHE_TIMEOUT seconds, whichever comes first.
+    """
+    cache = caches[INDEX_CACHE]
+    key = f"index:{index_version()}:{variant}"
+    fragment = cache.get(key)
+    if fragment is not None:
+        _count("index_hits")
+        return fragment
+    _count("index_misses")
+    now = timezone.now()
+    fragment = render()
+    timeout = settings.INDEX_CACHE_TIMEOUT
+    boundary = next_boundary(now)
+    if boundary is not None:
+        timeout = min(timeout, max(1, math.ceil((boundary - now).total_seconds())))
+    cache.set(key, fragment, timeout)
+    return fragment
+
+
+def invalidate_index():
+    """Drop every question list of the index page, at once and when the transaction commits."""
+    def bump():
+        _bump_version(caches[INDEX_CACHE], INDEX_VERSION_KEY)
+    bump()
+    transaction.on_commit(bump)
+
+
+@receiver([post_save, post_delete], sender=Vote)
+def vote_saved(sender, instance, **kwargs):
+    """Invalidate the results when a vote is saved or deleted."""
+    invalidate_results(instance.question_id)
+
+
+@receiver(vote_changed)
+def vote_cast(sender, question_id, **kwargs):
+    """Invalidate the results when a vote is cast, changed or withdrawn."""
+    invalidate_results(question_id)
+
+
+@receiver([post_save, post_delete], sender=Choice)
+def choice_changed(sender, instance, **kwargs):
+    """Invalidate the results when a choice is added, edited or removed."""
+    invalidate_results(instance.question_id)
+
+
+@receiver([post_save, post_delete], sender=Question)
+def question_changed(sender, instance, **kwargs):
+    """Invalidate the results and the index page when a question is edited or removed."""
+    if kwargs.get("created") is False and instance.status != Question.Status.CLOSED:
+        # the results of a reopened question can change again, from all its votes
+        with transaction.atomic():
+            if ResultsSnapshot.objects.filter(question=instance, votes_archived=True).exists():
+                restore_votes(instance)
+            ResultsSnapshot.objects.filter(question=instance).delete()
+    invalidate_results(instance.id)
+    invalidate_index()
+
+
+@receiver(question_status_changed)
+def question_status_moved(sender, question_id, **kwargs):
+    """Invalidate the results and the index page when a question opens or closes."""
+    invalidate_results(question_id)
+    invalidate_index()
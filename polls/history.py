@@ -0,0 +1,195 @@
+"""
+Provide the vote history of the polls application.
+
+Every committed vote change, sent as vote_changed by cast_vote, withdraw_vote
+or the ingest worker, is appended to a buffer in memory instead of the
+database, so the vote request sends no extra query. A background thread
+writes the buffer to the VoteEvent table every VOTE_HISTORY_FLUSH_INTERVAL
+seconds, VOTE_HISTORY_BATCH_SIZE rows per INSERT, and at exit. The events of
+a process killed before its flush are lost, the votes themselves are not.
+
+The same transaction adds the events to the per-minute and per-hour
+VoteBucket of their choices, one upsert per changed bucket, so the results
+over time are read from the buckets without scanning the votes.
+"""
+import atexit
+import logging
+import threading
+import time
+from collections import Counter
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.dispatch import receiver
+from polls.models import VoteBucket, VoteEvent
+from polls.signals import vote_changed
+
+logger = logging.getLogger("polls")
+
+# resolution => seconds of a VoteBucket
+BUCKET_SIZES = {"minute": 60, "hour": 3600}
+
+
+def bucket_deltas(events):
+    """Return the {(question_id, choice_id, size, start): net votes} of events, zeros left out."""
+    deltas = Counter()
+    for when, question_id, _, choice_id, old_choice_id in events:
+        for size in BUCKET_SIZES.values():
+            start = when - when % size
+            if choice_id is not None:
+                deltas[question_id, choice_id, size, start] += 1
+            if old_choice_id is not None:
+                deltas[question_id, old_choice_id, size, start] -= 1
+    return {key: delta for key, delta in deltas.items() if delta}
+
+
+def add_to_buckets(deltas):
+    """Add the net votes of bucket_deltas() to their buckets, created when missing."""
+    if not deltas:
+        return
+    table = connection.ops.quote_name(VoteBucket._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f"INSERT INTO {table} (question_id, choice_id, size, start, votes) "
+            f"VALUES (%s, %s, %s, %s, %s) ON CONFLICT (choice_id, size, start) "
+            f"DO UPDATE SET votes = {table}.votes + excluded.votes",
+            [(*key, delta) for key, delta in deltas.items()])
+
+
+class EventBuffer:
+    """Vote events of this process waiting to be written."""
+
+    def __init__(self):
+        """Create an empty buffer."""
+        self.events = []
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        """Return the number of waiting events."""
+        with self.lock:
+            return len(self.events)
+
+    def append(self, event):
+        """Add a (time, question_id, user_id, choice_id, old_choice_id) event."""
+        with self.lock:
+            self.events.append(event)
+
+    def flush(self):
+        """Write every waiting event, return how many were written."""
+        with self.lock:
+            events, self.events = self.events, []
+        if not events:
+            return 0
+        try:
+            with transaction.atomic():
+                VoteEvent.objects.bulk_create(
+                    [VoteEvent(time=when, question_id=question_id, user_id=user_id,
+                               choice_id=choice_id, old_choice_id=old_choice_id)
+                     for when, question_id, user_id, choice_id, old_choice_id in events],
+                    batch_size=settings.VOTE_HISTORY_BATCH_SIZE)
+                add_to_buckets(bucket_deltas(events))
+        except Exception:
+            # written again by the next flush, before the newer events
+            with self.lock:
+                self.events[:0] = events
+            raise
+        return len(events)
+
+
+class HistoryWriter(threading.Thread):
+    """Background thread flushing the buffer every VOTE_HISTORY_FLUSH_INTERVAL seconds."""
+
+    def __init__(self, buffer):
+        """Create the writer of a buffer."""
+        super().__init__(name="vote-history", daemon=True)
+        self.buffer = buffer
+
+    def run(self):
+        """Flush the buffer until the process exits."""
+        while True:
+            time.sleep(settings.VOTE_HISTORY_FLUSH_INTERVAL)
+            try:
+                self.buffer.flush()
+            except Exception:
+                logger.exception("Failed to write the vote history, retrying",
+                                 extra={"event": "history_failed"})
+            finally:
+                close_old_connections()
+
+
+_buffer = EventBuffer()
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_buffer():
+    """Return the event buffer of this process."""
+    return _buffer
+
+
+def flush_history():
+    """Write the buffered events of this process now, return how many were written."""
+    return _buffer.flush()
+
+
+def start_writer():
+    """Start the writer of this process on its first event, if enabled."""
+    global _writer
+    with _writer_lock:
+        if settings.VOTE_HISTORY_WORKER and _writer is None:
+            _writer = HistoryWriter(_buffer)
+            _writer.start()
+            atexit.register(flush_history)
+
+
+@receiver(vote_changed)
+def record_vote_change(sender, question_id, user_id, choice_id, old_choice_id, **kwargs):
+    """Buffer the change of a vote once its transaction commits."""
+    if not settings.VOTE_HISTORY:
+        return
+    event = (int(time.time()), question_id, user_id, choice_id, old_choice_id)
+
+    def append():
+        _buffer.append(event)
+        start_writer()
+    transaction.on_commit(append)
+
+
+def timeline(question_id, since=None, until=None):
+    """Return the events of a question in [since, until) Unix times, oldest first."""
+    events = VoteEvent.objects.filter(question_id=question_id)
+    if since is not None:
+        events = events.filter(time__gte=since)
+    if until is not None:
+        events = events.filter(time__lt=until)
+    return events.order_by("time", "id")
+
+
+def results_over_time(question_id, results, resolution, since=None):
+    """
+    Return the buckets of a question from since, with the votes of each choice of results.
+
+    Each bucket is {"start": Unix time, "votes": net votes per choice,
+    "totals": votes per choice at its end}, the choices in the order of
+    results. The totals are counted back from the current votes of results,
+    so only the returned buckets are read. Votes not in the history yet are
+    in the totals before the first bucket.
+    """
+    choice_ids = [choice["id"] for choice in results["results"]]
+    index = {choice_id: n for n, choice_id in enumerate(choice_ids)}
+    buckets = VoteBucket.objects.filter(question_id=question_id,
+                                        size=BUCKET_SIZES[resolution])
+    if since is not None:
+        buckets = buckets.filter(start__gte=since)
+    rows = {}
+    buckets = buckets.order_by("start").values_list("start", "choice_id", "votes")
+    for start, choice_id, votes in buckets:
+        if choice_id in index:
+            rows.setdefault(start, [0] * len(choice_ids))[index[choice_id]] += votes
+    totals = [choice["votes"] for choice in results["results"]]
+    for votes in rows.values():
+        totals = [total - vote for total, vote in zip(totals, votes)]
+    points = []
+    for start, votes in rows.items():
+        totals = [total + vote for total, vote in zip(totals, votes)]
+        points.append({"start": start, "votes": votes, "totals": totals})
+    return points
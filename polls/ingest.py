@@ -0,0 +1,317 @@
+"""
+Provide the queued vote ingestion of the polls application.
+
+With VOTE_INGESTION = "queue" the vote views only append the vote to a local
+SQLite journal. A background worker takes the journal in batches, keeps the
+last vote of each (user, question) and writes the batch with bulk statements.
+Until then the pending vote of a user is read back from the journal.
+
+Only one worker of all the processes sharing the journal writes at a time,
+it holds the writer lease of the journal, so the batches are written in the
+order they were queued and a vote is never overwritten by an older one.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import Counter
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.contrib.auth.models import User
+from polls.models import Choice, Question, Vote
+from polls.signals import vote_changed
+
+logger = logging.getLogger("polls")
+
+# seconds after which the writer lease of a worker that stopped renewing it is taken over,
+# with the entries it had claimed
+CLAIM_TIMEOUT = 60
+
+
+class VoteJournal:
+    """
+    Durable queue of votes in a SQLite file.
+
+    Every entry is the vote of a user for a question, choice_id None withdraws
+    the vote. Entries stay in the file until a worker has written them.
+    """
+
+    def __init__(self, path):
+        """Open the journal file, create its table if needed."""
+        self.path = str(path)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.path, check_same_thread=False,
+                                          isolation_level=None, timeout=30)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS entry (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                question_id INTEGER NOT NULL,
+                choice_id INTEGER,
+                claimed_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS entry_user_question ON entry (user_id, question_id, seq);
+            CREATE TABLE IF NOT EXISTS writer (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                owner TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            );
+        """)
+
+    def append(self, user_id, question_id, choice_id):
+        """Add the vote of a user at the end of the journal."""
+        with self.lock:
+            self.connection.execute(
+                "INSERT INTO entry (user_id, question_id, choice_id) VALUES (?, ?, ?)",
+                (user_id, question_id, choice_id))
+
+    def pending(self, user_id, question_id):
+        """Return (True, choice_id) of the newest queued vote of the user, (False, None) if none."""
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT choice_id FROM entry WHERE user_id = ? AND question_id = ? "
+                "ORDER BY seq DESC LIMIT 1", (user_id, question_id)).fetchone()
+        return (True, row[0]) if row else (False, None)
+
+    def acquire_writer(self, owner):
+        """
+        Take or renew the writer lease for CLAIM_TIMEOUT seconds.
+
+        Return False when another owner holds it. The entries claimed by an
+        expired owner are free again.
+        """
+        now = time.time()
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.connection.execute(
+                    "SELECT owner, expires_at FROM writer WHERE id = 1").fetchone()
+                if row is not None and row[0] != owner and row[1] > now:
+                    self.connection.execute("COMMIT")
+                    return False
+                if row is not None and row[0] != owner:
+                    self.connection.execute("UPDATE entry SET claimed_at = NULL")
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO writer (id, owner, expires_at) VALUES (1, ?, ?)",
+                    (owner, now + CLAIM_TIMEOUT))
+                self.connection.execute("COMMIT")
+            except sqlite3.Error:
+                self.connection.execute("ROLLBACK")
+                raise
+        return True
+
+    def release_writer(self, owner):
+        """Give up the writer lease of owner."""
+        with self.lock:
+            self.connection.execute("DELETE FROM writer WHERE id = 1 AND owner = ?", (owner,))
+
+    def claim(self, limit):
+        """Take the oldest free entries, return them as (seq, user_id, question_id, choice_id)."""
+        now = time.time()
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self.connection.execute(
+                    "SELECT seq, user_id, question_id, choice_id FROM entry "
+                    "WHERE claimed_at IS NULL ORDER BY seq LIMIT ?", (limit,)).fetchall()
+                self.connection.executemany("UPDATE entry SET claimed_at = ? WHERE seq = ?",
+                                            [(now, row[0]) for row in rows])
+                self.connection.execute("COMMIT")
+            except sqlite3.Error:
+                self.connection.execute("ROLLBACK")
+                raise
+        return rows
+
+    def ack(self, entries):
+        """Remove the written entries from the journal."""
+        with self.lock:
+            self.connection.executemany("DELETE FROM entry WHERE seq = ?",
+                                        [(entry[0],) for entry in entries])
+
+    def release(self, entries):
+        """Give back entries that could not be written, to be taken again."""
+        with self.lock:
+            self.connection.executemany("UPDATE entry SET claimed_at = NULL WHERE seq = ?",
+                                        [(entry[0],) for entry in entries])
+
+    def __len__(self):
+        """Return the number of queued entries."""
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM entry").fetchone()[0]
+
+
+def write_batch(entries):
+    """
+    Write a batch of journal entries to the Vote table in one transaction.
+
+    Only the last entry of each (user, question) counts. The existing votes
+    are read with one query, the new and changed votes written by one bulk
+    upsert, the withdrawn ones by one delete, and each changed tally by one update.
+    """
+    latest = {}
+    for _, user_id, question_id, choice_id in sorted(entries):
+        latest[(user_id, question_id)] = choice_id
+    # a vote of a user, question or choice removed since it was queued is dropped,
+    # it would fail the whole batch on a foreign key again and again
+    choice_ids = {choice_id for choice_id in latest.values() if choice_id is not None}
+    choice_questions = dict(Choice.objects.filter(pk__in=choice_ids)
+                            .values_list("id", "question_id"))
+    existing_users = set(User.objects.filter(pk__in={key[0] for key in latest})
+                         .values_list("id", flat=True))
+    existing_questions = set(Question.objects.filter(pk__in={key[1] for key in latest})
+                             .values_list("id", flat=True))
+    for (user_id, question_id), choice_id in list(latest.items()):
+        if (user_id not in existing_users or question_id not in existing_questions
+                or choice_id is not None and choice_questions.get(choice_id) != question_id):
+            logger.warning("Dropped queued vote of user %s for choice %s of question %s",
+                           user_id, choice_id, question_id,
+                           extra={"event": "vote_dropped", "question_id": question_id})
+            del latest[(user_id, question_id)]
+    if not latest:
+        return 0
+    keys = Q()
+    for user_id, question_id in latest:
+        keys |= Q(user_id=user_id, question_id=question_id)
+
+    with transaction.atomic():
+        current = {
+            (user_id, question_id): choice_id
+            for user_id, question_id, choice_id in Vote.objects.select_for_update().filter(keys)
+            .values_list("user_id", "question_id", "choice_id")
+        }
+        upserts, withdrawn, changes = [], Q(), []
+        # the time of the batch, the journal does not keep when a vote was queued
+        now = timezone.now()
+        choice_deltas, question_deltas = Counter(), Counter()
+        for (user_id, question_id), choice_id in latest.items():
+            old_choice_id = current.get((user_id, question_id))
+            if choice_id == old_choice_id:
+                continue
+            if choice_id is None:
+                withdrawn |= Q(user_id=user_id, question_id=question_id)
+            else:
+                upserts.append(Vote(user_id=user_id, question_id=question_id, choice_id=choice_id,
+                                    voted_at=now))
+                choice_deltas[choice_id] += 1
+            if old_choice_id is None:
+                question_deltas[question_id] += 1
+            else:
+                choice_deltas[old_choice_id] -= 1
+            if choice_id is None:
+                question_deltas[question_id] -= 1
+            changes.append((user_id, question_id, choice_id, old_choice_id))
+
+        if upserts:
+            Vote.objects.bulk_create(upserts, update_conflicts=True,
+                                     unique_fields=["user", "question"],
+                                     update_fields=["choice", "voted_at"])
+        if withdrawn:
+            Vote.objects.filter(withdrawn).delete()
+        for choice_id, delta in choice_deltas.items():
+            if delta:
+                Choice.objects.filter(pk=choice_id).update(vote_count=F("vote_count") + delta)
+        for question_id, delta in question_deltas.items():
+            if delta:
+                Question.objects.filter(pk=question_id).update(
+                    total_votes=F("total_votes") + delta)
+        for user_id, question_id, choice_id, old_choice_id in changes:
+            vote_changed.send(sender=Vote, question_id=question_id, user_id=user_id,
+                              choice_id=choice_id, old_choice_id=old_choice_id)
+    return len(changes)
+
+
+def flush_journal(journal=None, batch_size=None):
+    """
+    Write every queued vote in batches, return the number of changed votes.
+
+    Nothing is written while the worker of another process holds the writer lease.
+    """
+    if journal is None:
+        journal = get_journal()
+    batch_size = batch_size or settings.VOTE_BATCH_SIZE
+    owner = f"{os.getpid()}-{uuid.uuid4().hex}"
+    written = 0
+    try:
+        # renewed before every batch, a stuck writer loses it after CLAIM_TIMEOUT
+        while journal.acquire_writer(owner) and (entries := journal.claim(batch_size)):
+            try:
+                written += write_batch(entries)
+            except Exception:
+                journal.release(entries)
+                raise
+            journal.ack(entries)
+    finally:
+        journal.release_writer(owner)
+    return written
+
+
+class IngestWorker(threading.Thread):
+    """Background thread flushing the journal every VOTE_FLUSH_INTERVAL seconds."""
+
+    def __init__(self, journal):
+        """Create the worker of a journal."""
+        super().__init__(name="vote-ingest", daemon=True)
+        self.journal = journal
+        self.wakeup = threading.Event()
+
+    def run(self):
+        """Flush the journal until the process exits."""
+        while True:
+            self.wakeup.wait(settings.VOTE_FLUSH_INTERVAL)
+            self.wakeup.clear()
+            try:
+                flush_journal(self.journal)
+            except Exception:
+                logger.exception("Failed to write queued votes, retrying")
+
+
+_journal = None
+_worker = None
+_setup_lock = threading.Lock()
+
+
+def get_journal():
+    """Return the journal of this process."""
+    global _journal
+    with _setup_lock:
+        if _journal is None or _journal.path != str(settings.VOTE_JOURNAL_PATH):
+            os.makedirs(os.path.dirname(os.path.abspath(settings.VOTE_JOURNAL_PATH)),
+                        exist_ok=True)
+            _journal = VoteJournal(settings.VOTE_JOURNAL_PATH)
+    return _journal
+
+
+def start_worker(journal):
+    """Start the worker of this process on its first queued vote, if enabled."""
+    global _worker
+    with _setup_lock:
+        if settings.VOTE_INGESTION_WORKER and _worker is None:
+            _worker = IngestWorker(journal)
+            _worker.start()
+
+
+def queue_enabled():
+    """Return True when the votes are queued instead of written by the request."""
+    return settings.VOTE_INGESTION == "queue"
+
+
+def enqueue_vote(user, question, choice):
+    """Queue the vote of user for choice, choice None withdraws the vote."""
+    journal = get_journal()
+    journal.append(user.id, question.id, choice.id if choice else None)
+    start_worker(journal)
+
+
+def current_choice_id(user, question):
+    """Return the id of the choice the user voted, the queued vote first, None if no vote."""
+    if queue_enabled():
+        found, choice_id = get_journal().pending(user.id, question.id)
+        if found:
+            return choice_id
+    return (Vote.objects.filter(user=user, question=question)
+            .values_list("choice_id", flat=True).first())
@@ -0,0 +1,237 @@
+"""
+Provide the lifecycle scheduler of the polls application.
+
+A question is scheduled until its pub_date, open until its end_date and
+closed after it. Question.status is set from the dates when the question is
+saved, the pages only read it. The LifecycleScheduler keeps the upcoming
+pub_date and end_date of the questions in a min-heap, sleeps until the
+nearest one and moves the status when it is reached. Each move sends
+question_status_changed, which invalidates the caches, and a closed question
+is frozen LIFECYCLE_FREEZE_GRACE seconds after its end_date.
+
+With LIFECYCLE_SCHEDULER = "thread" every web process runs a scheduler
+thread, started by its first request. The status is moved by a conditional
+update, so when several processes run one each event is still sent once.
+"""
+import datetime
+import heapq
+import logging
+import threading
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import IntegrityError, close_old_connections
+from django.db.models import Q
+from django.db.models.signals import post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+from polls.models import Question
+from polls.signals import question_status_changed
+from polls.snapshots import freeze_closed_questions, freeze_question
+
+logger = logging.getLogger("polls")
+
+# kinds of the events in the heap
+OPEN, CLOSE, FREEZE = "open", "close", "freeze"
+
+
+def move_status(question_id, now=None):
+    """
+    Store the status of the dates of a question at now, return the new status.
+
+    None is returned when the status did not move, or was moved by another
+    scheduler first, only the one that moved it sends question_status_changed.
+    """
+    now = now or timezone.now()
+    question = Question.objects.filter(pk=question_id).only(
+        "pub_date", "end_date", "status").first()
+    if question is None:
+        return None
+    status = question.status_at(now)
+    if status == question.status:
+        return None
+    if not Question.objects.filter(pk=question_id, status=question.status).update(status=status):
+        return None
+    question_status_changed.send(sender=Question, question_id=question_id, status=status,
+                                 old_status=question.status)
+    logger.info("Question %s is %s", question_id, status,
+                extra={"event": "question_status", "question_id": question_id,
+                       "status": status, "old_status": question.status})
+    return status
+
+
+class LifecycleScheduler:
+    """
+    Min-heap of the (time, question id, kind) events of the next questions to open or close.
+
+    Only the events of the next 2 * reload_interval seconds are loaded, the
+    heap is loaded again every reload_interval seconds. Loading also moves the
+    status of the questions whose event was missed, e.g. while no scheduler
+    was running. freeze_grace None does not freeze the closed questions.
+    """
+
+    def __init__(self, reload_interval=300, freeze_grace=60):
+        """Create a scheduler with an empty heap."""
+        self.reload_interval = datetime.timedelta(seconds=reload_interval)
+        self.freeze_grace = freeze_grace
+        self.heap = []
+        self.queued = set()
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopped = threading.Event()
+
+    def __len__(self):
+        """Return the number of events in the heap."""
+        with self.lock:
+            return len(self.heap)
+
+    def push(self, when, question_id, kind):
+        """Add an event, the same event is only kept once."""
+        entry = (when, question_id, kind)
+        with self.lock:
+            if entry in self.queued:
+                return
+            self.queued.add(entry)
+            heapq.heappush(self.heap, entry)
+        self.wakeup.set()
+
+    def next_due(self):
+        """Return the time of the nearest event, None if the heap is empty."""
+        with self.lock:
+            return self.heap[0][0] if self.heap else None
+
+    def schedule(self, question, now=None):
+        """Add the events of a question that happen before the next load."""
+        now = now or timezone.now()
+        until = now + 2 * self.reload_interval
+        events = [(question.pub_date, OPEN)]
+        if question.end_date is not None:
+            events.append((question.end_date, CLOSE))
+            if self.freeze_grace is not None:
+                events.append((question.end_date
+                               + datetime.timedelta(seconds=self.freeze_grace), FREEZE))
+        for when, kind in events:
+            if now < when <= until:
+                self.push(when, question.id, kind)
+
+    def load(self, now=None):
+        """Move the missed statuses, add the next events and freeze the missed questions."""
+        now = now or timezone.now()
+        for question_id in Question.objects.status_mismatch(now).values_list("id", flat=True):
+            move_status(question_id, now)
+        grace = datetime.timedelta(seconds=self.freeze_grace or 0)
+        until = now + 2 * self.reload_interval
+        upcoming = Question.objects.filter(
+            Q(pub_date__gt=now, pub_date__lte=until)
+            | Q(end_date__gt=now - grace, end_date__lte=until)
+        ).only("pub_date", "end_date")
+        for question in upcoming:
+            self.schedule(question, now)
+        # last, a failed freeze can not skip the openings and closings
+        if self.freeze_grace is not None:
+            freeze_closed_questions(self.freeze_grace)
+
+    def freeze(self, question_id, now):
+        """Freeze a question closed for freeze_grace seconds, return True if it was frozen."""
+        closed_before = now - datetime.timedelta(seconds=self.freeze_grace)
+        question = Question.objects.filter(
+            pk=question_id, status=Question.Status.CLOSED, end_date__lt=closed_before,
+            snapshot__isnull=True).first()
+        if question is None:
+            return False
+        try:
+            freeze_question(question)
+        except IntegrityError:
+            # frozen by another scheduler in the meantime
+            return False
+        logger.info("Froze the results of question %s", question_id,
+                    extra={"event": "results_frozen", "question_id": question_id})
+        return True
+
+    def run_due(self, now=None):
+        """Handle the events before now, return how many changed a question."""
+        now = now or timezone.now()
+        changed = 0
+        while True:
+            with self.lock:
+                if not self.heap or self.heap[0][0] >= now:
+                    return changed
+                entry = heapq.heappop(self.heap)
+                self.queued.discard(entry)
+            when, question_id, kind = entry
+            if kind == FREEZE:
+                changed += self.freeze(question_id, now)
+            else:
+                changed += move_status(question_id, now) is not None
+
+    def run(self):
+        """Handle the events on time until stop() is called."""
+        next_load = timezone.now()
+        while not self.stopped.is_set():
+            self.wakeup.clear()
+            now = timezone.now()
+            try:
+                if now >= next_load:
+                    next_load = now + self.reload_interval
+                    self.load(now)
+                self.run_due(now)
+            except Exception:
+                logger.exception("Lifecycle scheduler failed, retrying",
+                                 extra={"event": "lifecycle_error"})
+            finally:
+                close_old_connections()
+            due = self.next_due()
+            wake_at = next_load if due is None else min(due, next_load)
+            # wake just after the event, it is handled once its time has passed
+            timeout = (wake_at - timezone.now()).total_seconds() + 0.01
+            self.wakeup.wait(max(timeout, 0.01))
+
+    def stop(self):
+        """Make run() return."""
+        self.stopped.set()
+        self.wakeup.set()
+
+
+_scheduler = None
+_setup_lock = threading.Lock()
+
+
+def scheduler_options():
+    """Return the LifecycleScheduler arguments of the settings."""
+    grace = settings.LIFECYCLE_FREEZE_GRACE
+    return {"reload_interval": settings.LIFECYCLE_RELOAD_INTERVAL,
+            "freeze_grace": grace if grace >= 0 else None}
+
+
+def get_scheduler():
+    """Return the scheduler running in this process, None if there is none."""
+    return _scheduler
+
+
+def start_scheduler():
+    """Start the scheduler thread of this process, return its scheduler."""
+    global _scheduler
+    with _setup_lock:
+        if _scheduler is None:
+            _scheduler = LifecycleScheduler(**scheduler_options())
+            threading.Thread(target=_scheduler.run, name="poll-lifecycle", daemon=True).start()
+    return _scheduler
+
+
+@receiver(request_started)
+def request_started_scheduler(sender, **kwargs):
+    """Start the scheduler thread with the first request, if enabled."""
+    if _scheduler is None and settings.LIFECYCLE_SCHEDULER == "thread":
+        start_scheduler()
+
+
+@receiver(pre_save, sender=Question)
+def store_status(sender, instance, **kwargs):
+    """Store the status of the dates of a question saved, also by loaddata."""
+    instance.status = instance.status_at()
+
+
+@receiver(post_save, sender=Question)
+def schedule_question(sender, instance, raw=False, **kwargs):
+    """Add the events of a saved question to the scheduler of this process."""
+    if _scheduler is not None and not raw:
+        _scheduler.schedule(instance)
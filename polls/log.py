@@ -0,0 +1,173 @@
+"""
+Provide the logging handlers of the polls application.
+
+With LOGGING_MODE = "queue" the polls logger only puts its records on a
+bounded in-memory queue. A listener thread writes them as JSON lines to a
+size-rotated file, flushing once per batch instead of once per record. A full
+queue drops the record instead of blocking the request.
+
+SampleFilter keeps one of every N records of high-volume events in both modes.
+"""
+import atexit
+import copy
+import datetime
+import json
+import logging
+import queue
+import threading
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+# attributes of every LogRecord, the other ones come from extra= and are kept in the JSON
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName"}
+
+
+class JsonFormatter(logging.Formatter):
+    """Format a record as one JSON object, with the fields passed in extra=."""
+
+    def format(self, record):
+        """Return the JSON line of the record."""
+        data = {
+            "time": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc)
+            .isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        data.update((key, value) for key, value in vars(record).items()
+                    if key not in _RECORD_ATTRIBUTES)
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            data["exc"] = record.exc_text
+        return json.dumps(data, default=str)
+
+
+class SampleFilter(logging.Filter):
+    """
+    Keep one of every N records of an event, the event is given by extra={"event": ...}.
+
+    The kept records have sample_rate = N, so the real count can be estimated.
+    """
+
+    def __init__(self, every=None):
+        """Sample the events of every, a dict of event => N."""
+        super().__init__()
+        self.every = {event: n for event, n in (every or {}).items() if n > 1}
+        self.seen = {}
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        """Return True if the record is kept."""
+        event = getattr(record, "event", None)
+        every = self.every.get(event)
+        if every is None:
+            return True
+        with self.lock:
+            seen = self.seen.get(event, 0)
+            self.seen[event] = seen + 1
+        if seen % every:
+            return False
+        record.sample_rate = every
+        return True
+
+
+class BatchRotatingFileHandler(RotatingFileHandler):
+    """
+    Rotating file handler that leaves the flush to its caller.
+
+    The size of the file is tracked instead of read back before every record,
+    so the writes stay in the file buffer until flush().
+    """
+
+    def __init__(self, filename, maxBytes=0, backupCount=0, encoding="utf-8"):
+        """Open the file in append mode."""
+        super().__init__(filename, maxBytes=maxBytes, backupCount=backupCount,
+                         encoding=encoding)
+        self.size = self.stream.seek(0, 2)
+
+    def emit(self, record):
+        """Write the record, rotate the file first when it would get too large."""
+        try:
+            line = self.format(record) + self.terminator
+            if self.maxBytes and self.size and self.size + len(line) > self.maxBytes:
+                self.doRollover()
+                self.size = 0
+            self.stream.write(line)
+            self.size += len(line)
+        except Exception:
+            self.handleError(record)
+
+
+class BatchQueueListener(QueueListener):
+    """Queue listener handling the queued records in batches, one flush per batch."""
+
+    def __init__(self, record_queue, *handlers, batch_size=100):
+        """Listen to record_queue, handle at most batch_size records per flush."""
+        super().__init__(record_queue, *handlers, respect_handler_level=True)
+        self.batch_size = batch_size
+
+    def _monitor(self):
+        """Take the waiting records in batches until the sentinel."""
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size and batch[-1] is not self._sentinel:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            for record in batch:
+                if record is not self._sentinel:
+                    self.handle(record)
+            for handler in self.handlers:
+                handler.flush()
+            for _ in batch:
+                self.queue.task_done()
+            if batch[-1] is self._sentinel:
+                break
+
+
+class QueueFileHandler(QueueHandler):
+    """
+    Handler queueing the records for a BatchRotatingFileHandler run by a listener thread.
+
+    The formatter set on this handler is used by the file handler, so the
+    records are formatted by the listener, not in the request.
+    """
+
+    def __init__(self, filename, max_bytes=0, backup_count=0, batch_size=100, queue_size=10000):
+        """Create the queue, the file handler and start the listener."""
+        super().__init__(queue.Queue(queue_size))
+        self.file_handler = BatchRotatingFileHandler(filename, maxBytes=max_bytes,
+                                                     backupCount=backup_count)
+        self.listener = BatchQueueListener(self.queue, self.file_handler, batch_size=batch_size)
+        self.dropped = 0
+        self.listener.start()
+        atexit.register(self.close)
+
+    def setFormatter(self, fmt):
+        """Give the formatter to the file handler."""
+        self.file_handler.setFormatter(fmt)
+
+    def prepare(self, record):
+        """Return a copy of the record with its message merged, the listener formats it."""
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        """Queue the record, drop it when the queue is full."""
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        """Write the queued records and close the file."""
+        if self.listener._thread is not None:
+            self.listener.stop()
+            self.file_handler.close()
+        super().close()
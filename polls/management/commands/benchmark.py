@@ -0,0 +1,130 @@
+"""Provide command to benchmark the polls request paths on generated data."""
+import json
+import random
+import tempfile
+from pathlib import Path
+from django.conf import settings
+from django.contrib.auth.hashers import get_hasher
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import (override_settings, setup_databases, setup_test_environment,
+                               teardown_databases, teardown_test_environment)
+from polls.benchmark import AUTH_FLOWS, FLOWS, Benchmark, compare, login_clients, seed, seed_votes
+from polls.history import flush_history
+
+
+class Command(BaseCommand):
+    """
+    Seed a throw-away test database and run the polls flows with concurrent clients.
+
+    The database is created like the test runner does, from the database
+    configured in the settings (SQLite or PostgreSQL), and destroyed at the
+    end, so the data of the site is not touched. Every flow prints its req/s,
+    latency percentiles and SQL queries per request, the login and signup
+    flows measure the first password hasher of the settings. With --save the numbers
+    are stored as a baseline, with --baseline they are compared to one and
+    the command fails on a regression. The bytes are the mean size of the
+    response bodies, uncompressed.
+    """
+
+    help = "Benchmark the index, detail, results and vote flows on generated data."
+
+    def add_arguments(self, parser):
+        """Add the benchmark options."""
+        parser.add_argument("--questions", type=int, default=300, help="Questions to generate.")
+        parser.add_argument("--users", type=int, default=40, help="Users to generate.")
+        parser.add_argument("--concurrency", type=int, default=8, help="Concurrent clients.")
+        parser.add_argument("--requests", type=int, default=400, help="Requests per flow.")
+        parser.add_argument("--auth-requests", type=int, default=40,
+                            help="Requests of the login and signup flows, each hashes a password.")
+        parser.add_argument("--flows", nargs="+", choices=FLOWS, default=list(FLOWS))
+        parser.add_argument("--conn-max-age", type=int, default=None,
+                            help="CONN_MAX_AGE of the clients, 0 opens a connection per request.")
+        parser.add_argument("--seed", type=int, default=0, help="Seed of the random choices.")
+        parser.add_argument("--save", help="Write the results to this baseline file.")
+        parser.add_argument("--baseline", help="Compare the results with this baseline file.")
+        parser.add_argument("--tolerance", type=float, default=0.25,
+                            help="Allowed req/s drop and p50 growth ratio (default 0.25).")
+
+    def handle(self, *args, **options):
+        """Run the benchmark in a test database and report the results."""
+        if options["users"] < options["concurrency"]:
+            raise CommandError("--users must be at least --concurrency.")
+        hasher = get_hasher().algorithm
+        baseline = None
+        if options["baseline"]:
+            with open(options["baseline"]) as file:
+                baseline = json.load(file)
+            if baseline["vendor"] != connection.vendor:
+                raise CommandError(f"The baseline was measured on {baseline['vendor']}.")
+            if baseline.get("hasher", hasher) != hasher:
+                raise CommandError(f"The baseline was measured with the {baseline['hasher']} "
+                                   f"password hasher.")
+
+        with tempfile.TemporaryDirectory() as directory:
+            if connection.vendor == "sqlite":
+                # the default in-memory test database is locked by concurrent writers
+                test_name = str(Path(directory) / "benchmark.sqlite3")
+                connection.settings_dict["TEST"]["NAME"] = test_name
+            if options["conn_max_age"] is not None:
+                connection.settings_dict["CONN_MAX_AGE"] = options["conn_max_age"]
+            setup_test_environment()
+            old_config = setup_databases(verbosity=0, interactive=False)
+            try:
+                # the scheduler would freeze the generated closed questions during the flows,
+                # the rate limits would reject the flows of clients sharing one address,
+                # and the purges of the test database questions would reach the live proxy
+                with override_settings(LIFECYCLE_SCHEDULER="off", RATE_LIMIT_ENABLED=False,
+                                       PAGE_PURGE_URL=""):
+                    results = self.run_benchmark(options)
+            finally:
+                # the vote history left in the buffer belongs to the test database
+                flush_history()
+                teardown_databases(old_config, verbosity=0)
+                teardown_test_environment()
+
+        pool = connection.settings_dict["OPTIONS"].get("pool")
+        connections = (f"pool {pool}" if pool
+                       else f"CONN_MAX_AGE {connection.settings_dict['CONN_MAX_AGE']}")
+        self.stdout.write(f"Password hasher: {hasher}, session engine: {settings.SESSION_ENGINE}, "
+                          f"connections: {connections}.")
+        for flow, stats in results.items():
+            self.stdout.write(
+                f"{flow:>12}: {stats['rps']:8.1f} req/s, p50 {stats['p50']:6.1f} ms, "
+                f"p95 {stats['p95']:6.1f} ms, p99 {stats['p99']:6.1f} ms, "
+                f"{stats['queries']:5.2f} queries/request, {stats['bytes']:7.0f} bytes, "
+                f"{stats['errors']} errors")
+
+        if options["save"]:
+            options_used = {key: options[key] for key in
+                            ("questions", "users", "concurrency", "requests", "auth_requests",
+                             "conn_max_age", "seed")}
+            with open(options["save"], "w") as file:
+                json.dump({"vendor": connection.vendor, "hasher": hasher,
+                           "options": options_used, "flows": results}, file, indent=2)
+                file.write("\n")
+            self.stdout.write(f"Saved the baseline to {options['save']}.")
+        if baseline is not None:
+            regressions = compare(results, baseline["flows"], options["tolerance"])
+            for regression in regressions:
+                self.stdout.write(self.style.ERROR(regression))
+            if regressions:
+                raise CommandError(f"{len(regressions)} regressions against the baseline.")
+            self.stdout.write(self.style.SUCCESS("No regression against the baseline."))
+
+    def run_benchmark(self, options):
+        """Seed the data and run every flow, return the statistics of each flow."""
+        rng = random.Random(options["seed"])
+        open_questions = seed(options["questions"], options["users"])
+        if not open_questions:
+            raise CommandError("No open question was generated, use more --questions.")
+        users = list(User.objects.order_by("id"))
+        clients, voters = users[:options["concurrency"]], users[options["concurrency"]:]
+        votes = seed_votes(voters, rng)
+        self.stdout.write(f"Seeded {options['questions']} questions, {len(users)} users "
+                          f"and {votes} votes on {connection.vendor}.")
+        benchmark = Benchmark(login_clients(clients), open_questions)
+        return {flow: benchmark.run(flow, options["auth_requests"] if flow in AUTH_FLOWS
+                                    else options["requests"])
+                for flow in options["flows"]}
@@ -0,0 +1,95 @@
+"""Provide command to compare single and sharded vote counters under concurrent writers."""
+import random
+import tempfile
+import threading
+import time
+from pathlib import Path
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection, transaction
+from django.test.utils import (override_settings, setup_databases, setup_test_environment,
+                               teardown_databases, teardown_test_environment)
+from polls.models import Choice, Question, add_vote_count
+
+
+class Command(BaseCommand):
+    """
+    Run concurrent writers adding votes to the tallies of a throw-away question.
+
+    The benchmark runs once with a single counter per choice and once with
+    --shards counter shards, in a throw-away test database created from the
+    database configured in the settings (SQLite or PostgreSQL) like the
+    benchmark command does, and prints the votes per second of each mode.
+    """
+
+    help = "Benchmark the throughput of single and sharded vote counters."
+
+    def add_arguments(self, parser):
+        """Add the benchmark options."""
+        parser.add_argument("--writers", type=int, default=8, help="Concurrent writer threads.")
+        parser.add_argument("--votes", type=int, default=200, help="Votes added by each writer.")
+        parser.add_argument("--choices", type=int, default=2, help="Choices of the question.")
+        parser.add_argument("--shards", type=int, default=16, help="Shards of the sharded mode.")
+
+    def handle(self, *args, **options):
+        """Run both modes in a test database and print the results."""
+        with tempfile.TemporaryDirectory() as directory:
+            if connection.vendor == "sqlite":
+                # the default in-memory test database is locked by concurrent writers
+                test_name = str(Path(directory) / "benchmark_counters.sqlite3")
+                connection.settings_dict["TEST"]["NAME"] = test_name
+            setup_test_environment()
+            old_config = setup_databases(verbosity=0, interactive=False)
+            try:
+                # the questions are not in the site, nothing to purge from the proxy
+                with override_settings(LIFECYCLE_SCHEDULER="off", PAGE_PURGE_URL=""):
+                    self.run_modes(options)
+            finally:
+                teardown_databases(old_config, verbosity=0)
+                teardown_test_environment()
+
+    def run_modes(self, options):
+        """Run the single counter and the sharded mode, print the votes per second of each."""
+        for shards in (0, options["shards"]):
+            question = Question.objects.create(question_text="benchmark_counters",
+                                               counter_shards=shards)
+            for n in range(options["choices"]):
+                question.choice_set.create(choice_text=f"Choice {n}")
+            try:
+                elapsed, retries = self.run_writers(question, options["writers"], options["votes"])
+                total = sum(choice.votes for choice in Question.objects.with_results()
+                            .get(pk=question.id).results)
+            finally:
+                question.delete()
+            mode = f"{shards} shards" if shards else "single counter"
+            self.stdout.write(f"{mode:>16}: {total / elapsed:10.1f} votes/s, "
+                              f"{total} votes in {elapsed:.2f}s, {retries} lock retries")
+
+    def run_writers(self, question, writers, votes):
+        """Add votes from concurrent threads, return the elapsed seconds and lock retries."""
+        choice_ids = list(Choice.objects.filter(question=question).values_list("id", flat=True))
+        retries = []
+        start = threading.Barrier(writers + 1)
+
+        def write():
+            retry = 0
+            start.wait()
+            for _ in range(votes):
+                while True:
+                    try:
+                        with transaction.atomic():
+                            add_vote_count(question, random.choice(choice_ids), 1)
+                        break
+                    except OperationalError:
+                        # SQLite reports "database is locked" under contention
+                        retry += 1
+            retries.append(retry)
+            connection.close()
+
+        threads = [threading.Thread(target=write) for _ in range(writers)]
+        for thread in threads:
+            thread.start()
+        start.wait()
+        began = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - began, sum(retries)
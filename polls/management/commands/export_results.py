@@ -0,0 +1,117 @@
+"""Provide command to stream the poll results, the votes or their history to JSON Lines or CSV."""
+import csv
+import json
+import time
+from django.core.management.base import BaseCommand
+from polls.history import timeline
+from polls.models import Question, Vote, VoteEvent
+
+
+class Command(BaseCommand):
+    """
+    Write the results of every question, or every vote, as they are read.
+
+    The rows are read with a server side cursor (or in chunks on SQLite) so
+    the memory used does not grow with the table. The exported votes are
+    fixture objects (JSON Lines) or user,question,choice rows (CSV), both can
+    be loaded again with import_polls. The history is the vote changes in
+    time order, of every question or of the --question timeline.
+    """
+
+    help = "Export the poll results, the votes or the vote history as JSON Lines or CSV."
+
+    def add_arguments(self, parser):
+        """Add the export options."""
+        parser.add_argument("--output", default="-", help="File to write, - for stdout.")
+        parser.add_argument("--format", choices=("jsonl", "csv"), default="jsonl")
+        parser.add_argument("--votes", action="store_true",
+                            help="Export the votes instead of the results.")
+        parser.add_argument("--history", action="store_true",
+                            help="Export the vote changes instead of the results.")
+        parser.add_argument("--question", type=int,
+                            help="Question of the exported history, all by default.")
+        parser.add_argument("--chunk-size", type=int, default=2000, help="Rows read per fetch.")
+
+    def handle(self, *args, **options):
+        """Write the rows and report the rows per second."""
+        began = time.perf_counter()
+        if options["history"]:
+            rows = self.history(options)
+        elif options["votes"]:
+            rows = self.votes(options)
+        else:
+            rows = self.results(options)
+        if options["output"] == "-":
+            count = self.write(self.stdout, rows, options["format"])
+        else:
+            with open(options["output"], "w", newline="") as output:
+                count = self.write(output, rows, options["format"])
+        elapsed = time.perf_counter() - began
+        # the report does not go to stdout when it carries the rows
+        report = self.stderr if options["output"] == "-" else self.stdout
+        report.write(f"Exported {count} rows in {elapsed:.1f}s, {count / elapsed:.0f} rows/s.")
+
+    def results(self, options):
+        """Yield one row per question (JSON Lines) or per choice (CSV)."""
+        questions = Question.objects.order_by("id").with_results().iterator(
+            chunk_size=options["chunk_size"])
+        for question in questions:
+            if options["format"] == "csv":
+                for choice in question.results:
+                    yield {
+                        "question_id": question.id, "question_text": question.question_text,
+                        "choice_id": choice.id, "choice_text": choice.choice_text,
+                        "votes": choice.num_votes, "percentage": round(choice.percentage, 2),
+                    }
+                continue
+            yield {
+                "id": question.id,
+                "question_text": question.question_text,
+                "pub_date": question.pub_date.isoformat(),
+                "end_date": question.end_date.isoformat() if question.end_date else None,
+                "total_votes": sum(choice.num_votes for choice in question.results),
+                "results": [
+                    {"id": choice.id, "choice_text": choice.choice_text,
+                     "votes": choice.num_votes, "percentage": round(choice.percentage, 2)}
+                    for choice in question.results
+                ],
+            }
+
+    def votes(self, options):
+        """Yield every vote as a fixture object (JSON Lines) or a user,question,choice row."""
+        votes = Vote.objects.order_by("id").values_list("id", "user_id", "question_id",
+                                                        "choice_id")
+        for pk, user_id, question_id, choice_id in votes.iterator(
+                chunk_size=options["chunk_size"]):
+            if options["format"] == "csv":
+                yield {"user": user_id, "question": question_id, "choice": choice_id}
+            else:
+                yield {"model": "polls.vote", "pk": pk,
+                       "fields": {"user": user_id, "question": question_id, "choice": choice_id}}
+
+    def history(self, options):
+        """Yield every vote change as a time,question,user,choice,old_choice row."""
+        if options["question"] is not None:
+            events = timeline(options["question"])
+        else:
+            events = VoteEvent.objects.order_by("time", "id")
+        rows = events.values_list("time", "question_id", "user_id", "choice_id", "old_choice_id")
+        for row in rows.iterator(chunk_size=options["chunk_size"]):
+            yield dict(zip(("time", "question", "user", "choice", "old_choice"), row))
+
+    def write(self, output, rows, file_format):
+        """Write the rows in the format, return how many were written."""
+        count = 0
+        if file_format == "csv":
+            writer = None
+            for row in rows:
+                if writer is None:
+                    writer = csv.DictWriter(output, fieldnames=list(row))
+                    writer.writeheader()
+                writer.writerow(row)
+                count += 1
+            return count
+        for row in rows:
+            output.write(json.dumps(row) + "\n")
+            count += 1
+        return count
@@ -0,0 +1,25 @@
+"""Provide command to write the queued votes to the database."""
+import time
+from django.core.management.base import BaseCommand
+from polls.ingest import flush_journal, get_journal
+
+
+class Command(BaseCommand):
+    """Drain the vote journal of VOTE_INGESTION = "queue" and report the rate."""
+
+    help = "Write the votes queued in the vote journal to the database."
+
+    def add_arguments(self, parser):
+        """Add the --batch-size option."""
+        parser.add_argument("--batch-size", type=int, default=None,
+                            help="Entries written per transaction (default VOTE_BATCH_SIZE).")
+
+    def handle(self, *args, **options):
+        """Flush the journal until it is empty."""
+        journal = get_journal()
+        queued = len(journal)
+        start = time.perf_counter()
+        written = flush_journal(journal, options["batch_size"])
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {queued} queued entries ({written} vote changes) in {elapsed:.2f}s."))
@@ -0,0 +1,33 @@
+"""Provide command to freeze the results of the closed questions."""
+from django.core.management.base import BaseCommand
+from polls.lifecycle import move_status
+from polls.models import Question
+from polls.snapshots import freeze_closed_questions
+
+
+class Command(BaseCommand):
+    """
+    Store the results of every closed question in a snapshot.
+
+    Run it on a schedule (e.g. every few minutes from cron), each question is
+    frozen once. The statuses missed by the lifecycle scheduler are moved
+    first, so a question is closed before it is frozen. With --archive-votes
+    the votes of the frozen questions are moved to the archived votes table.
+    """
+
+    help = "Freeze the results of the closed questions, optionally archive their votes."
+
+    def add_arguments(self, parser):
+        """Add the freeze options."""
+        parser.add_argument("--grace", type=int, default=60,
+                            help="Seconds after end_date before a question is frozen.")
+        parser.add_argument("--archive-votes", action="store_true",
+                            help="Move the votes of the frozen questions to the archive.")
+
+    def handle(self, *args, **options):
+        """Close the ended questions, freeze them and print what was done."""
+        for question_id in Question.objects.status_mismatch().values_list("id", flat=True):
+            move_status(question_id)
+        frozen, archived = freeze_closed_questions(options["grace"], options["archive_votes"])
+        self.stdout.write(self.style.SUCCESS(
+            f"Froze {frozen} questions, archived {archived} votes."))
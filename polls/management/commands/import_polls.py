@@ -0,0 +1,152 @@
+"""Provide command to bulk load users, polls and votes from JSON Lines, CSV or fixtures."""
+import csv
+import json
+import sys
+import time
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from polls.cache import invalidate_index, invalidate_results
+from polls.models import Choice, recount_votes
+
+# models are written in this order, so a row is never inserted before the row it refers to
+MODELS = ("auth.user", "polls.question", "polls.choice", "polls.vote")
+
+
+def read_records(path, model=None):
+    """
+    Yield the (model, pk, fields) records of a file, one at a time.
+
+    A .jsonl file has one fixture object per line, a .csv file has one row of
+    the fields of `model` per line (an "id" column is the pk), any other file
+    is a fixture read whole, like the ones in data/.
+    """
+    with (sys.stdin if path == "-" else open(path, newline="")) as file:
+        if path.endswith(".csv"):
+            if model is None:
+                raise CommandError("--model is needed to import a CSV file.")
+            for row in csv.DictReader(file):
+                pk = row.pop("id", None) or None
+                yield model, pk, {key: value for key, value in row.items() if value != ""}
+        elif path.endswith(".jsonl") or path == "-":
+            for line in file:
+                if line.strip():
+                    obj = json.loads(line)
+                    yield obj["model"], obj.get("pk"), obj["fields"]
+        else:
+            for obj in json.load(file):
+                yield obj["model"], obj.get("pk"), obj["fields"]
+
+
+class Command(BaseCommand):
+    """
+    Load users, questions, choices and votes with bulk inserts.
+
+    The records are read as a stream and collected per model, every
+    --batch-size rows of a model are inserted by one bulk_create in their own
+    transaction, so the memory used does not grow with the file. The question
+    of a vote is filled from its choice when missing. At the end the vote
+    tallies of the questions that got votes are recounted and the caches
+    invalidated.
+    """
+
+    help = "Bulk load users, polls and votes from JSON Lines, CSV or fixture files."
+
+    def add_arguments(self, parser):
+        """Add the import options."""
+        parser.add_argument("files", nargs="+",
+                            help="Files to load, - reads JSON Lines from stdin.")
+        parser.add_argument("--model", choices=MODELS, help="Model of the rows of CSV files.")
+        parser.add_argument("--batch-size", type=int, default=5000, help="Rows per insert.")
+        parser.add_argument("--ignore-conflicts", action="store_true",
+                            help="Skip the rows that already exist, e.g. a second vote of a user.")
+
+    def handle(self, *args, **options):
+        """Load every file and print the rows per second."""
+        self.batch_size = options["batch_size"]
+        self.ignore_conflicts = options["ignore_conflicts"]
+        self.pending = {label: [] for label in MODELS}
+        self.loaded = dict.fromkeys(MODELS, 0)
+        self.voted_questions = set()
+        self.choice_questions = {}
+        began = time.perf_counter()
+
+        for path in options["files"]:
+            for label, pk, fields in read_records(path, options["model"]):
+                if label not in self.pending:
+                    raise CommandError(f"{path}: can not import {label} objects.")
+                self.pending[label].append(self.build(label, pk, fields))
+                if len(self.pending[label]) >= self.batch_size:
+                    self.flush(label)
+        for label in MODELS:
+            self.flush(label)
+
+        with transaction.atomic():
+            voted = sorted(self.voted_questions)
+            for start in range(0, len(voted), 500):
+                recount_votes(voted[start:start + 500])
+            # the next rows created by the site must not reuse the imported ids
+            models = [apps.get_model(label) for label in MODELS if self.loaded[label]]
+            with connection.cursor() as cursor:
+                for sql in connection.ops.sequence_reset_sql(no_style(), models):
+                    cursor.execute(sql)
+        for question_id in self.voted_questions:
+            invalidate_results(question_id)
+        invalidate_index()
+
+        elapsed = time.perf_counter() - began
+        total = sum(self.loaded.values())
+        for label, count in self.loaded.items():
+            if count:
+                self.stdout.write(f"{label}: {count} rows")
+        self.stdout.write(self.style.SUCCESS(
+            f"Loaded {total} rows in {elapsed:.1f}s, {total / elapsed:.0f} rows/s."))
+
+    def build(self, label, pk, fields):
+        """Return the unsaved object of a record, the related objects given by their id."""
+        model = apps.get_model(label)
+        values = {}
+        for name, value in fields.items():
+            field = model._meta.get_field(name)
+            if field.many_to_many:
+                continue
+            values[field.attname] = None if value is None else field.to_python(value)
+        if pk is not None:
+            values[model._meta.pk.attname] = model._meta.pk.to_python(pk)
+        return model(**values)
+
+    def flush(self, label):
+        """Insert the collected rows of a model, after the rows of the models it refers to."""
+        for before in MODELS[:MODELS.index(label)]:
+            if self.pending[before]:
+                self.flush(before)
+        objects = self.pending[label]
+        if not objects:
+            return
+        self.pending[label] = []
+        if label == "polls.vote":
+            self.fill_questions(objects)
+        if label == "polls.question":
+            # bulk_create does not send pre_save, which stores the status
+            for question in objects:
+                question.status = question.status_at()
+        if label == "polls.choice":
+            self.choice_questions.update((choice.id, choice.question_id) for choice in objects
+                                         if choice.id is not None)
+        with transaction.atomic():
+            apps.get_model(label).objects.bulk_create(
+                objects, batch_size=self.batch_size, ignore_conflicts=self.ignore_conflicts)
+        self.loaded[label] += len(objects)
+
+    def fill_questions(self, votes):
+        """Set the question of the votes from their choice, looked up once per choice."""
+        missing = sorted({vote.choice_id for vote in votes
+                          if vote.choice_id not in self.choice_questions})
+        for start in range(0, len(missing), 500):
+            self.choice_questions.update(Choice.objects.filter(
+                pk__in=missing[start:start + 500]).values_list("id", "question_id"))
+        for vote in votes:
+            if vote.question_id is None:
+                vote.question_id = self.choice_questions.get(vote.choice_id)
+            self.voted_questions.add(vote.question_id)
@@ -0,0 +1,85 @@
+"""Provide command to measure the throughput and latency of a running polls server."""
+import http.client
+import statistics
+import threading
+import time
+from urllib.parse import urlsplit
+from django.core.management.base import BaseCommand, CommandError
+from polls.benchmark import percentile
+
+
+class Command(BaseCommand):
+    """
+    Send GET requests from concurrent keep-alive clients to a running server.
+
+    Compare deployments by running it against each of them, e.g. gunicorn with
+    mysite.wsgi and with mysite.asgi (see gunicorn.conf.py).
+    """
+
+    help = "Load test the given paths of a running polls server."
+
+    def add_arguments(self, parser):
+        """Add the load test options."""
+        parser.add_argument("paths", nargs="+", help="Paths to request, e.g. /polls/1/results/")
+        parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+        parser.add_argument("--concurrency", type=int, default=16, help="Concurrent clients.")
+        parser.add_argument("--requests", type=int, default=1000, help="Requests per path.")
+
+    def handle(self, *args, **options):
+        """Load test every path and print req/s and latency percentiles."""
+        url = urlsplit(options["base_url"])
+        if url.scheme != "http":
+            raise CommandError("Only http:// base URLs are supported.")
+        for path in options["paths"]:
+            stats = self.run(url.hostname, url.port or 80, path,
+                             options["concurrency"], options["requests"])
+            self.stdout.write(
+                f"{path}: {stats['rps']:.1f} req/s, p50 {stats['p50']:.1f} ms, "
+                f"p99 {stats['p99']:.1f} ms, mean {stats['mean']:.1f} ms, "
+                f"{stats['errors']} errors")
+
+    def run(self, host, port, path, concurrency, requests):
+        """Send requests to path from concurrency clients, return the statistics in ms."""
+        latencies, errors = [], []
+        lock = threading.Lock()
+        remaining = iter(range(requests))
+
+        def client():
+            connection = http.client.HTTPConnection(host, port, timeout=30)
+            own, failed = [], 0
+            while True:
+                with lock:
+                    if next(remaining, None) is None:
+                        break
+                start = time.perf_counter()
+                try:
+                    connection.request("GET", path)
+                    response = connection.getresponse()
+                    response.read()
+                    if response.status >= 400:
+                        failed += 1
+                except (OSError, http.client.HTTPException):
+                    failed += 1
+                    connection.close()
+                    connection = http.client.HTTPConnection(host, port, timeout=30)
+                own.append((time.perf_counter() - start) * 1000)
+            connection.close()
+            with lock:
+                latencies.extend(own)
+                errors.append(failed)
+
+        threads = [threading.Thread(target=client) for _ in range(concurrency)]
+        began = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - began
+        latencies.sort()
+        return {
+            "rps": len(latencies) / elapsed,
+            "p50": percentile(latencies, 50),
+            "p99": percentile(latencies, 99),
+            "mean": statistics.fmean(latencies) if latencies else 0.0,
+            "errors": sum(errors),
+        }
@@ -0,0 +1,62 @@
+"""Provide command to rebuild the stored vote tallies from the Vote table."""
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Q
+from polls.cache import invalidate_results
+from polls.models import Choice, Question, recount_votes, shard_votes
+
+
+class Command(BaseCommand):
+    """
+    Compare Choice.vote_count and Question.total_votes with the Vote table.
+
+    The counter shards are added to the stored tallies, the questions whose
+    votes were archived are skipped. Every drifted tally is reported and the
+    tallies of its question are recounted with the shards removed,
+    with --check the tallies are only verified and the command fails on drift.
+    """
+
+    help = "Rebuild or verify the stored vote tallies from the Vote table."
+
+    def add_arguments(self, parser):
+        """Add the --check option."""
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Only report drifted tallies, exit with an error if any is found.",
+        )
+
+    def handle(self, *args, **options):
+        """Find the drifted tallies and repair their questions."""
+        # the votes of these questions were archived, their tallies are final
+        archived = Q(question__snapshot__votes_archived=True)
+        with transaction.atomic():
+            drifted = [
+                (f"Choice {choice.id}", choice.stored, choice.num_votes, choice.question_id)
+                for choice in Choice.objects.exclude(archived).annotate(
+                    num_votes=Count("vote"),
+                    stored=F("vote_count") + shard_votes(choice=OuterRef("pk")))
+                if choice.stored != choice.num_votes
+            ] + [
+                (f"Question {question.id}", question.stored, question.num_votes, question.id)
+                for question in Question.objects.exclude(snapshot__votes_archived=True).annotate(
+                    num_votes=Count("choice__vote"),
+                    stored=F("total_votes") + shard_votes(choice__question=OuterRef("pk")))
+                if question.stored != question.num_votes
+            ]
+            for name, stored, counted, _ in drifted:
+                self.stdout.write(f"{name}: stored {stored}, counted {counted}")
+
+            if options["check"]:
+                if drifted:
+                    raise CommandError(f"{len(drifted)} vote tallies are out of sync.")
+                self.stdout.write(self.style.SUCCESS("All vote tallies are in sync."))
+                return
+
+            # recount every choice of a drifted question and fold its shards away
+            question_ids = {question_id for *_, question_id in drifted}
+            recount_votes(question_ids)
+            for question_id in question_ids:
+                invalidate_results(question_id)
+        self.stdout.write(self.style.SUCCESS(f"Repaired {len(drifted)} vote tallies "
+                                             f"in {len(question_ids)} questions."))
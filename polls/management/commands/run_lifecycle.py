@@ -0,0 +1,35 @@
+"""Provide command to open and close the polls on time."""
+from django.core.management.base import BaseCommand
+from polls.lifecycle import LifecycleScheduler, scheduler_options
+
+
+class Command(BaseCommand):
+    """
+    Run the lifecycle scheduler in the foreground.
+
+    Use it with LIFECYCLE_SCHEDULER = "off", when the web processes do not run
+    the scheduler. With --once the missed openings and closings are applied
+    and the command exits, to run it from cron instead.
+    """
+
+    help = "Move the status of the polls when they open or close, freeze the closed ones."
+
+    def add_arguments(self, parser):
+        """Add the --once option."""
+        parser.add_argument("--once", action="store_true",
+                            help="Apply the missed transitions and exit.")
+
+    def handle(self, *args, **options):
+        """Run the scheduler until interrupted, or once."""
+        scheduler = LifecycleScheduler(**scheduler_options())
+        if options["once"]:
+            scheduler.load()
+            changed = scheduler.run_due()
+            self.stdout.write(self.style.SUCCESS(
+                f"Applied {changed} due events, {len(scheduler)} upcoming."))
+            return
+        self.stdout.write("Running the lifecycle scheduler, CTRL-C to stop.")
+        try:
+            scheduler.run()
+        except KeyboardInterrupt:
+            scheduler.stop()
@@ -0,0 +1,275 @@
+"""
+Provide the request metrics of the polls application.
+
+The RequestMetricsMiddleware records, for every view, the number of requests,
+SQL queries, database time, template render time and total latency. The
+metrics of this process are rendered in the Prometheus text format by
+metrics_text(), together with the cache and rate limit statistics.
+
+A view declares how many queries it may send with query_budget(). When a
+request goes over, a warning is logged and, with QUERY_BUDGET_RAISE (on in
+the test runs), QueryBudgetExceeded is raised so the test fails.
+"""
+import contextvars
+import logging
+import threading
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.template.backends.django import DjangoTemplates, Template
+from polls.cache import cache_stats
+from polls.ratelimit import rate_limit_stats
+
+logger = logging.getLogger("polls")
+
+# upper bounds of the latency histogram, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# the RequestMetrics of the running request, copied into sync_to_async threads
+_current = contextvars.ContextVar("polls_request_metrics", default=None)
+
+
+class QueryBudgetExceeded(Exception):
+    """Raised when a view sends more SQL queries than its query budget."""
+
+
+def query_budget(queries):
+    """Declare the most SQL queries a view may send per request."""
+    def decorator(view):
+        view.query_budget = queries
+        return view
+    return decorator
+
+
+class RequestMetrics:
+    """Queries and timings of one request."""
+
+    def __init__(self):
+        """Start with nothing recorded."""
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+
+
+def record_query(execute, sql, params, many, context):
+    """Database execute wrapper, count the query and its time in the running request."""
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.queries += 1
+        metrics.db_time += time.perf_counter() - start
+
+
+@receiver(connection_created)
+def instrument_connection(sender, connection, **kwargs):
+    """Count the queries of every new database connection."""
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class InstrumentedTemplate:
+    """Django template timing its render in the running request."""
+
+    def __init__(self, template):
+        """Wrap a template of the Django backend."""
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        """Render the template and add the time to the request metrics."""
+        metrics = _current.get()
+        start = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            if metrics is not None:
+                metrics.template_time += time.perf_counter() - start
+
+
+class InstrumentedDjangoTemplates(DjangoTemplates):
+    """The Django template backend with render time metrics."""
+
+    def from_string(self, template_code):
+        """Return the template of the code, timed."""
+        return InstrumentedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        """Return the template of the name, timed."""
+        template = super().get_template(template_name)
+        return InstrumentedTemplate(template) if isinstance(template, Template) else template
+
+
+class MetricsRegistry:
+    """Metrics of the views served by this process."""
+
+    def __init__(self):
+        """Create an empty registry."""
+        self.lock = threading.Lock()
+        self.views = {}
+
+    def observe(self, view, status, duration, metrics, over_budget):
+        """Add one request of a view."""
+        with self.lock:
+            stats = self.views.setdefault(view, {
+                "statuses": {}, "buckets": [0] * len(LATENCY_BUCKETS), "count": 0,
+                "duration": 0.0, "queries": 0, "db_time": 0.0, "template_time": 0.0,
+                "over_budget": 0,
+            })
+            stats["statuses"][status] = stats["statuses"].get(status, 0) + 1
+            for n, bound in enumerate(LATENCY_BUCKETS):
+                if duration <= bound:
+                    stats["buckets"][n] += 1
+            stats["count"] += 1
+            stats["duration"] += duration
+            stats["queries"] += metrics.queries
+            stats["db_time"] += metrics.db_time
+            stats["template_time"] += metrics.template_time
+            stats["over_budget"] += over_budget
+
+    def snapshot(self):
+        """Return a copy of the metrics of every view."""
+        with self.lock:
+            return {view: {key: value.copy() if isinstance(value, (dict, list)) else value
+                           for key, value in stats.items()}
+                    for view, stats in self.views.items()}
+
+    def reset(self):
+        """Remove every metric."""
+        with self.lock:
+            self.views.clear()
+
+
+registry = MetricsRegistry()
+
+
+def view_budget(match):
+    """Return the query budget of the view of a resolver match, None if not declared."""
+    view = match.func
+    budget = getattr(view, "query_budget", None)
+    if budget is None:
+        budget = getattr(getattr(view, "view_class", None), "query_budget", None)
+    return budget
+
+
+def finish(request, response, metrics, start):
+    """Record the metrics of a served request and enforce the query budget of its view."""
+    duration = time.perf_counter() - start
+    match = request.resolver_match
+    view = match.view_name if match else "unresolved"
+    budget = view_budget(match) if match else None
+    over_budget = budget is not None and metrics.queries > budget
+    registry.observe(view, response.status_code, duration, metrics, over_budget)
+    if over_budget:
+        message = f"View {view} sent {metrics.queries} queries, its budget is {budget}"
+        logger.warning(message)
+        if settings.QUERY_BUDGET_RAISE:
+            raise QueryBudgetExceeded(message)
+    return response
+
+
+class RequestMetricsMiddleware:
+    """Record the queries, database time, template time and latency of every view."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        """Wrap the next handler, sync or async."""
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        """Serve the request with its metrics recorded."""
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return finish(request, response, metrics, start)
+
+    async def __acall__(self, request):
+        """Serve the request of an async handler with its metrics recorded."""
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return finish(request, response, metrics, start)
+
+
+def _labels(**labels):
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels.items()) + "}"
+
+
+def metrics_text():
+    """Return the metrics of this process in the Prometheus text format."""
+    views = registry.snapshot()
+    lines = []
+
+    def family(name, kind, description, samples):
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {kind}")
+        lines.extend(samples)
+
+    family("polls_requests_total", "counter", "Requests served, by view and status.", [
+        f"polls_requests_total{_labels(view=view, status=status)} {count}"
+        for view, stats in views.items() for status, count in sorted(stats["statuses"].items())
+    ])
+    histogram = []
+    for view, stats in views.items():
+        for bound, count in zip(LATENCY_BUCKETS, stats["buckets"]):
+            histogram.append(f"polls_request_duration_seconds_bucket"
+                             f"{_labels(view=view, le=bound)} {count}")
+        histogram += [
+            f'polls_request_duration_seconds_bucket{_labels(view=view, le="+Inf")} '
+            f'{stats["count"]}',
+            f"polls_request_duration_seconds_sum{_labels(view=view)} {stats['duration']}",
+            f"polls_request_duration_seconds_count{_labels(view=view)} {stats['count']}",
+        ]
+    family("polls_request_duration_seconds", "histogram",
+           "Time to serve the response, by view.", histogram)
+    for name, key, description in (
+        ("polls_db_queries_total", "queries", "SQL queries sent, by view."),
+        ("polls_db_duration_seconds_total", "db_time", "Time spent in SQL queries, by view."),
+        ("polls_template_duration_seconds_total", "template_time",
+         "Time spent rendering templates, by view."),
+        ("polls_query_budget_exceeded_total", "over_budget",
+         "Requests over the query budget of their view."),
+    ):
+        family(name, "counter", description, [
+            f"{name}{_labels(view=view)} {stats[key]}" for view, stats in views.items()
+        ])
+
+    stats = cache_stats()
+    family("polls_cache_requests_total", "counter", "Cache lookups, by cache and result.", [
+        f"polls_cache_requests_total{_labels(cache=cache, result=result)} "
+        f"{stats[f'{cache}_{plural}']}"
+        for cache in ("results", "index")
+        for result, plural in (("hit", "hits"), ("miss", "misses"))
+    ])
+    family("polls_cache_invalidations_total", "counter", "Cache invalidations, by cache.", [
+        f"polls_cache_invalidations_total{_labels(cache='results')} "
+        f"{stats['results_invalidations']}",
+    ])
+    family("polls_rate_limit_requests_total", "counter",
+           "Requests checked by a rate limit, by scope, key and result.", [
+               f"polls_rate_limit_requests_total{_labels(scope=scope, key=kind, result=result)} "
+               f"{count}"
+               for (scope, kind, result), count in sorted(rate_limit_stats().items())
+           ])
+    return "\n".join(lines) + "\n"
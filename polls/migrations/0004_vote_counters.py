@@ -0,0 +1,37 @@
+# Generated by Django 5.1 on 2026-10-18 19:31
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def fill_vote_counts(apps, schema_editor):
+    """Count the existing votes into the new tally columns."""
+    Question = apps.get_model('polls', 'Question')
+    Choice = apps.get_model('polls', 'Choice')
+    for choice in Choice.objects.annotate(num_votes=Count('vote')):
+        choice.vote_count = choice.num_votes
+        choice.save(update_fields=['vote_count'])
+    for question in Question.objects.annotate(num_votes=Count('choice__vote')):
+        question.total_votes = question.num_votes
+        question.save(update_fields=['total_votes'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0003_remove_choice_votes_vote'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='choice',
+            name='vote_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='total_votes',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_vote_counts, migrations.RunPython.noop),
+    ]
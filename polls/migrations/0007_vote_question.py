@@ -0,0 +1,48 @@
+# Generated by Django 5.1 on 2026-10-18 21:02
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max, OuterRef, Subquery
+import django.db.models.deletion
+
+
+def fill_vote_question(apps, schema_editor):
+    """Copy the question of each vote's choice and keep only the newest vote per question."""
+    Question = apps.get_model('polls', 'Question')
+    Choice = apps.get_model('polls', 'Choice')
+    Vote = apps.get_model('polls', 'Vote')
+    Vote.objects.update(question=Subquery(
+        Choice.objects.filter(pk=OuterRef('choice')).values('question')[:1]))
+    duplicates = (Vote.objects.values('user', 'question')
+                  .annotate(num_votes=Count('id'), newest=Max('id'))
+                  .filter(num_votes__gt=1))
+    question_ids = set()
+    for duplicate in duplicates:
+        Vote.objects.filter(user=duplicate['user'], question=duplicate['question'],
+                            id__lt=duplicate['newest']).delete()
+        question_ids.add(duplicate['question'])
+    # recount the tallies of the questions that lost votes
+    for choice in Choice.objects.filter(question__in=question_ids).annotate(num_votes=Count('vote')):
+        choice.vote_count = choice.num_votes
+        choice.save(update_fields=['vote_count'])
+    for question in Question.objects.filter(pk__in=question_ids).annotate(
+            num_votes=Count('choice__vote')):
+        question.total_votes = question.num_votes
+        question.save(update_fields=['total_votes'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0006_question_pub_date_id_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vote',
+            name='question',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, to='polls.question'),
+        ),
+        migrations.RunPython(fill_vote_question, migrations.RunPython.noop),
+    ]
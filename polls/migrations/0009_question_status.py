@@ -0,0 +1,32 @@
+# Generated by Django 5.1 on 2026-10-18 21:02
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def fill_status(apps, schema_editor):
+    """Store the status of the existing questions from their dates."""
+    Question = apps.get_model("polls", "Question")
+    now = timezone.now()
+    Question.objects.filter(pub_date__lte=now).update(status="open")
+    Question.objects.filter(pub_date__lte=now, end_date__lt=now).update(status="closed")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0008_resultssnapshot_archivedvote'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='status',
+            field=models.CharField(choices=[('scheduled', 'Scheduled'), ('open', 'Open'), ('closed', 'Closed')], default='scheduled', editable=False, max_length=10),
+        ),
+        migrations.RunPython(fill_status, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(fields=['status', '-pub_date', '-id'], name='question_status_pub_date_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.1 on 2026-10-18 20:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0009_question_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VoteEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('time', models.BigIntegerField()),
+                ('question_id', models.IntegerField()),
+                ('user_id', models.IntegerField()),
+                ('choice_id', models.IntegerField(null=True)),
+                ('old_choice_id', models.IntegerField(null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['question_id', 'time'], name='voteevent_question_time_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.1 on 2026-10-18 20:38
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0010_voteevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vote',
+            name='voted_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.CreateModel(
+            name='VoteBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('question_id', models.IntegerField()),
+                ('choice_id', models.IntegerField()),
+                ('size', models.IntegerField()),
+                ('start', models.BigIntegerField()),
+                ('votes', models.IntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['question_id', 'size', 'start'], name='votebucket_question_idx')],
+                'constraints': [models.UniqueConstraint(fields=('choice_id', 'size', 'start'), name='unique_choice_bucket')],
+            },
+        ),
+    ]
@@ -1,8 +1,73 @@
 """Provide model using in polls application."""
 import datetime
+import random
 from django.utils import timezone
-from django.db import models
+from django.db import IntegrityError, connection, models, transaction
+from django.db.models import (Case, F, FloatField, OuterRef, Prefetch, Q, Subquery, Sum,
+                              Value, When)
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
+from polls.signals import vote_changed
+
+
+def open_filter(now):
+    """Return the condition of Question.can_vote() as a Q object for the database."""
+    return Q(pub_date__lte=now) & (Q(end_date__isnull=True) | Q(end_date__gte=now))
+
+
+class QuestionQuerySet(models.QuerySet):
+    """QuerySet of Question with the queries used by the polls pages."""
+
+    def published(self):
+        """Return the published questions, newest first."""
+        return self.exclude(status=Question.Status.SCHEDULED).order_by("-pub_date", "-id")
+
+    def open(self):
+        """Return the published questions that can be voted."""
+        return self.filter(status=Question.Status.OPEN).order_by("-pub_date", "-id")
+
+    def closed(self):
+        """Return the published questions whose voting has ended."""
+        return self.filter(status=Question.Status.CLOSED).order_by("-pub_date", "-id")
+
+    def status_mismatch(self, now=None):
+        """Return the questions whose stored status is not the status of their dates at now."""
+        now = now or timezone.now()
+        return self.filter(
+            (Q(pub_date__gt=now) & ~Q(status=Question.Status.SCHEDULED))
+            | (open_filter(now) & ~Q(status=Question.Status.OPEN))
+            | (Q(end_date__lt=now) & ~Q(status=Question.Status.CLOSED))
+        )
+
+    def after(self, pub_date, question_id):
+        """Return the questions after the (pub_date, id) cursor in newest first order."""
+        return self.filter(Q(pub_date__lt=pub_date) | Q(pub_date=pub_date, id__lt=question_id))
+
+    def with_results(self):
+        """
+        Load the choices of each question with their votes and percentage.
+
+        The choices are fetched by one extra query for the whole queryset, the
+        votes (num_votes) and percentage are computed by the database from the
+        stored tallies and counter shards.
+        They are available as question.results, ordered by id.
+        """
+        return self.prefetch_related(results_prefetch())
+
+
+def results_prefetch():
+    """Return the Prefetch of QuestionQuerySet.with_results(), also usable on fetched questions."""
+    num_votes = F("vote_count") + shard_votes(choice=OuterRef("pk"))
+    question_votes = (F("question__total_votes")
+                      + shard_votes(choice__question=OuterRef("question")))
+    percentage = Case(
+        When(question_votes=0, then=Value(0.0)),
+        default=F("num_votes") * 100.0 / F("question_votes"),
+        output_field=FloatField(),
+    )
+    choices = (Choice.objects.annotate(num_votes=num_votes, question_votes=question_votes)
+               .annotate(percentage=percentage).order_by("id"))
+    return Prefetch("choice_set", queryset=choices, to_attr="results")
 
 
 class Question(models.Model):
@@ -10,11 +75,39 @@ class Question(models.Model):
     Question model contain two columns, question_text and pub_date.
 
     Question will be published after pub_date and can not vote after end_date.
+    status is the stage of the question stored when it is saved and moved by
+    the lifecycle scheduler when pub_date or end_date is reached, so the
+    pages filter and check it without comparing dates.
     """
 
+    class Status(models.TextChoices):
+        """Stage of a question, given by its pub_date and end_date."""
+
+        SCHEDULED = "scheduled", "Scheduled"
+        OPEN = "open", "Open"
+        CLOSED = "closed", "Closed"
+
     question_text = models.CharField(max_length=200)
     pub_date = models.DateTimeField("date published", default=timezone.now)
     end_date = models.DateTimeField(null=True, default=None)
+    # denormalized number of votes over all choices, kept in sync with Vote
+    total_votes = models.PositiveIntegerField(default=0)
+    # spread the tallies over this many ChoiceCounterShard rows (0 = single counter)
+    counter_shards = models.PositiveSmallIntegerField(
+        default=0, help_text="Use sharded vote counters for a poll with many concurrent voters.")
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.SCHEDULED,
+                              editable=False)
+
+    objects = QuestionQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # keyset pagination of the index page walks (pub_date, id) newest first
+            models.Index(fields=["-pub_date", "-id"], name="question_pub_date_id_idx"),
+            # and the open and closed filters walk it within one status
+            models.Index(fields=["status", "-pub_date", "-id"],
+                         name="question_status_pub_date_idx"),
+        ]
 
     def __str__(self):
         """Return text of Question."""
@@ -29,13 +122,34 @@ class Question(models.Model):
         one_day_ago = (timezone.now() - datetime.timedelta(days=1))
         return one_day_ago <= self.pub_date <= timezone.now()
 
+    def status_at(self, now=None):
+        """Return the status given by the pub_date and end_date at now."""
+        now = now or timezone.now()
+        if self.pub_date > now:
+            return self.Status.SCHEDULED
+        if self.end_date is not None and self.end_date < now:
+            return self.Status.CLOSED
+        return self.Status.OPEN
+
+    @property
+    def current_status(self):
+        """Return the stored status, or the status of the dates for an unsaved question."""
+        if self._state.adding:
+            return self.status_at()
+        return self.status
+
+    @property
+    def is_open(self):
+        """Return True if the question can be voted, from the stored status."""
+        return self.current_status == self.Status.OPEN
+
     def is_published(self):
         """
         Check whether the current date-time is on or after question’s publication date.
 
         If the question was not published yet, return False.
         """
-        return self.pub_date <= timezone.now()
+        return self.current_status != self.Status.SCHEDULED
 
     def can_vote(self):
         """
@@ -45,26 +159,30 @@ class Question(models.Model):
         the current date-time past the end_date, return False.
             (the end_date is null => the question is opened forever)
         """
-        return self.pub_date <= timezone.now() and (self.end_date is None or
-                                                    self.end_date >= timezone.now())
+        return self.is_open
 
 
 class Choice(models.Model):
     """
-    Choice model contain three columns, question, choice_text and votes.
+    Choice model contain three columns, question, choice_text and vote_count.
 
     Choice links with question within Question.
     If that question was deleted, this choice will be deleted too.
+    vote_count is a stored tally of the Vote rows for this choice, so reading
+    the result does not need to count the Vote table.
     """
 
     question = models.ForeignKey(Question, on_delete=models.CASCADE)
     choice_text = models.CharField(max_length=200)
-    # votes = models.IntegerField(default=0)
+    vote_count = models.PositiveIntegerField(default=0)
 
     @property
     def votes(self):
         """Return number of votes for this choice."""
-        return self.vote_set.count()
+        if hasattr(self, "num_votes"):
+            return self.num_votes
+        shards = self.shards.aggregate(total=Sum("count"))["total"]
+        return self.vote_count + (shards or 0)
 
     def __str__(self):
         """Return text of Choice."""
@@ -72,7 +190,294 @@ class Choice(models.Model):
 
 
 class Vote(models.Model):
-    """A vote by a user for a choice in a poll."""
+    """
+    A vote by a user for a choice in a poll.
+
+    question is a copy of choice.question, so the vote of a user for a question
+    is found by one index lookup and a user can only have one vote per question.
+    """
+
+    choice = models.ForeignKey(Choice, on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    # indexed by the (question, choice) index below
+    question = models.ForeignKey(Question, on_delete=models.CASCADE, db_index=False)
+    # when the current choice was voted
+    voted_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            # also the index of the (user, question) lookup
+            models.UniqueConstraint(fields=["user", "question"], name="unique_user_question_vote"),
+        ]
+        indexes = [
+            models.Index(fields=["question", "choice"], name="vote_question_choice_idx"),
+        ]
+
+    def save(self, *args, **kwargs):
+        """Copy the question of the choice before saving."""
+        if self.choice_id is not None:
+            self.question_id = self.choice.question_id
+        super().save(*args, **kwargs)
+
+
+class ChoiceCounterShard(models.Model):
+    """
+    One part of the vote tally of a choice.
+
+    A question with counter_shards spreads the tally writes of each choice over
+    that many rows, so concurrent voters do not wait for the lock on a single row.
+    The votes of the choice are its vote_count plus the count of all its shards.
+    """
+
+    choice = models.ForeignKey(Choice, on_delete=models.CASCADE, related_name="shards")
+    shard = models.PositiveSmallIntegerField()
+    # can be negative, a vote may be removed from another shard than it was added
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["choice", "shard"], name="unique_choice_shard"),
+        ]
+
+
+class ResultsSnapshot(models.Model):
+    """
+    The frozen results of a closed question.
+
+    payload is the dict served by the results page, built once when the
+    question was frozen, so the results of a closed poll are read from one row.
+    votes_archived tells the Vote rows of the question were moved to ArchivedVote.
+    """
+
+    question = models.OneToOneField(Question, on_delete=models.CASCADE, primary_key=True,
+                                    related_name="snapshot")
+    payload = models.JSONField()
+    created_at = models.DateTimeField(default=timezone.now)
+    votes_archived = models.BooleanField(default=False)
+
+
+class ArchivedVote(models.Model):
+    """A vote of a closed question, moved out of the Vote table."""
 
     choice = models.ForeignKey(Choice, on_delete=models.CASCADE)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
+    question = models.ForeignKey(Question, on_delete=models.CASCADE)
+    archived_at = models.DateTimeField(default=timezone.now)
+
+
+class VoteEvent(models.Model):
+    """
+    One change of the vote of a user for a question, appended and never updated.
+
+    The rows only hold integers: time is a Unix time in seconds, the ids are
+    not foreign keys so the history stays when a question, choice or user is
+    removed. choice_id is None for a withdrawn vote, old_choice_id None for a
+    first vote. The timeline of a question is read from one index range.
+    """
+
+    time = models.BigIntegerField()
+    question_id = models.IntegerField()
+    user_id = models.IntegerField()
+    choice_id = models.IntegerField(null=True)
+    old_choice_id = models.IntegerField(null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["question_id", "time"], name="voteevent_question_time_idx"),
+        ]
+
+
+class VoteBucket(models.Model):
+    """
+    The net votes a choice got in one minute or one hour.
+
+    start is the Unix time the bucket starts at and size its length in
+    seconds. The buckets are added up from the vote history when it is
+    written, so the results over time are read from them instead of the votes.
+    Like VoteEvent the rows only hold integers.
+    """
+
+    question_id = models.IntegerField()
+    choice_id = models.IntegerField()
+    size = models.IntegerField()
+    start = models.BigIntegerField()
+    votes = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["choice_id", "size", "start"],
+                                    name="unique_choice_bucket"),
+        ]
+        indexes = [
+            models.Index(fields=["question_id", "size", "start"],
+                         name="votebucket_question_idx"),
+        ]
+
+
+def shard_votes(**filters):
+    """Return an expression summing the count of the shards matching filters, 0 if none."""
+    shards = (ChoiceCounterShard.objects.filter(**filters).order_by()
+              .values(*filters).annotate(total=Sum("count")).values("total"))
+    return Coalesce(Subquery(shards), 0)
+
+
+def add_shard_count(question, choice_id, delta):
+    """Add delta to a random counter shard of the choice, create the shard if needed."""
+    shard = random.randrange(question.counter_shards)
+    shards = ChoiceCounterShard.objects.filter(choice_id=choice_id, shard=shard)
+    if shards.update(count=F("count") + delta):
+        return
+    try:
+        with transaction.atomic():
+            ChoiceCounterShard.objects.create(choice_id=choice_id, shard=shard, count=delta)
+    except IntegrityError:
+        # another voter created the shard first
+        shards.update(count=F("count") + delta)
+
+
+def add_vote_count(question, choice_id, delta):
+    """
+    Add delta to the stored tally of a choice and the total of its question.
+
+    Use F() expressions so the update happens in the database and concurrent
+    voters do not overwrite each other. Call it inside the same transaction
+    that creates, changes or deletes the Vote row.
+    A question with counter_shards only writes to a counter shard.
+    """
+    if question.counter_shards:
+        add_shard_count(question, choice_id, delta)
+        return
+    Choice.objects.filter(pk=choice_id).update(vote_count=F("vote_count") + delta)
+    Question.objects.filter(pk=question.id).update(total_votes=F("total_votes") + delta)
+
+
+def move_vote_count(question, old_choice_id, new_choice_id):
+    """Move one vote from a choice to another, the question total does not change."""
+    if question.counter_shards:
+        add_shard_count(question, old_choice_id, -1)
+        add_shard_count(question, new_choice_id, 1)
+        return
+    Choice.objects.filter(pk=old_choice_id).update(vote_count=F("vote_count") - 1)
+    Choice.objects.filter(pk=new_choice_id).update(vote_count=F("vote_count") + 1)
+
+
+def cast_vote(user, question, choice):
+    """
+    Record the vote of user for choice and update the tallies in one transaction.
+
+    The vote is inserted with INSERT ... ON CONFLICT DO NOTHING (PostgreSQL and
+    SQLite 3.35+), so a new vote costs one statement and a concurrent double
+    submit can not insert twice. When the user already voted, the existing row
+    is locked and changed only if the choice differs.
+    Return the id of the previous choice, None for a new vote.
+    """
+    table = connection.ops.quote_name(Vote._meta.db_table)
+    votes = Vote.objects.select_for_update().filter(user=user, question=question)
+    now = timezone.now()
+    voted_at = connection.ops.adapt_datetimefield_value(now)
+    with transaction.atomic():
+        while True:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"INSERT INTO {table} (user_id, question_id, choice_id, voted_at) "
+                    f"VALUES (%s, %s, %s, %s) "
+                    f"ON CONFLICT (user_id, question_id) DO NOTHING RETURNING id",
+                    [user.id, question.id, choice.id, voted_at])
+                if cursor.fetchone() is not None:
+                    old_choice_id = None
+                    add_vote_count(question, choice.id, 1)
+                    break
+            try:
+                old_choice_id = votes.values_list("choice_id", flat=True).get()
+            except Vote.DoesNotExist:
+                # withdrawn by a concurrent request, insert again
+                continue
+            if old_choice_id != choice.id:
+                votes.update(choice=choice, voted_at=now)
+                move_vote_count(question, old_choice_id, choice.id)
+            break
+        if old_choice_id != choice.id:
+            vote_changed.send(sender=Vote, question_id=question.id, user_id=user.id,
+                              choice_id=choice.id, old_choice_id=old_choice_id)
+    return old_choice_id
+
+
+def withdraw_vote(user, question):
+    """
+    Delete the vote of user for question and update the tallies in one transaction.
+
+    The row is removed with DELETE ... RETURNING, so only the request that
+    really deleted it lowers the tally.
+    Return the id of the deleted choice, None if the user had not voted.
+    """
+    table = connection.ops.quote_name(Vote._meta.db_table)
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {table} WHERE user_id = %s AND question_id = %s "
+                           f"RETURNING choice_id", [user.id, question.id])
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        add_vote_count(question, row[0], -1)
+        vote_changed.send(sender=Vote, question_id=question.id, user_id=user.id,
+                          choice_id=None, old_choice_id=row[0])
+    return row[0]
+
+
+def archive_votes(question):
+    """
+    Move the votes of a question to ArchivedVote, return how many were moved.
+
+    The rows are copied by one INSERT ... SELECT and removed by one DELETE, the
+    stored tallies are left as they are. Call it inside a transaction.
+    """
+    vote_table = connection.ops.quote_name(Vote._meta.db_table)
+    archive_table = connection.ops.quote_name(ArchivedVote._meta.db_table)
+    archived_at = connection.ops.adapt_datetimefield_value(timezone.now())
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {archive_table} (user_id, question_id, choice_id, archived_at) "
+            f"SELECT user_id, question_id, choice_id, %s FROM {vote_table} WHERE question_id = %s",
+            [archived_at, question.id])
+        moved = cursor.rowcount
+        cursor.execute(f"DELETE FROM {vote_table} WHERE question_id = %s", [question.id])
+    return moved
+
+
+def restore_votes(question):
+    """
+    Move the archived votes of a question back to Vote, return how many were moved.
+
+    The votes are back as of when they were archived, the stored tallies
+    still count them. Call it inside a transaction.
+    """
+    vote_table = connection.ops.quote_name(Vote._meta.db_table)
+    archive_table = connection.ops.quote_name(ArchivedVote._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {vote_table} (user_id, question_id, choice_id, voted_at) "
+            f"SELECT user_id, question_id, choice_id, archived_at FROM {archive_table} "
+            f"WHERE question_id = %s",
+            [question.id])
+        moved = cursor.rowcount
+        cursor.execute(f"DELETE FROM {archive_table} WHERE question_id = %s", [question.id])
+    return moved
+
+
+def recount_votes(question_ids):
+    """
+    Set the stored tallies of the questions from the Vote table.
+
+    Their counter shards are folded away. Call it inside a transaction.
+    """
+    choices = list(Choice.objects.filter(question__in=question_ids)
+                   .annotate(num_votes=models.Count("vote")))
+    for choice in choices:
+        choice.vote_count = choice.num_votes
+    questions = list(Question.objects.filter(pk__in=question_ids)
+                     .annotate(num_votes=models.Count("choice__vote")))
+    for question in questions:
+        question.total_votes = question.num_votes
+    Choice.objects.bulk_update(choices, ["vote_count"], batch_size=500)
+    Question.objects.bulk_update(questions, ["total_votes"], batch_size=500)
+    ChoiceCounterShard.objects.filter(choice__question__in=question_ids).delete()
@@ -0,0 +1,172 @@
+"""
+Provide the reverse proxy caching of the poll pages.
+
+A GET without a session cookie and without pending messages is the same for
+every anonymous visitor. public_page() renders it without the messages and
+the CSRF token, which the detail page loads from session_state() instead, so
+that a reverse proxy or a CDN can keep it: Cache-Control is public with
+s-maxage=PAGE_CACHE_S_MAXAGE and Surrogate-Key tags the page with its
+question. Every other response of the pages is private. All of them vary on
+Cookie, the proxy serves the cached page only to the requests without one.
+
+When a question, its choices or its votes change, purge_pages is sent with
+the keys of the pages to drop once the transaction commits. With
+PAGE_PURGE_URL a background thread sends them to the proxy, the keys of the
+purges of PAGE_PURGE_DELAY seconds in one PURGE request.
+"""
+import functools
+import logging
+import threading
+import time
+import urllib.request
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from polls.models import Choice, Question, Vote
+from polls.signals import purge_pages, question_status_changed, vote_changed
+
+logger = logging.getLogger("polls")
+
+# every cached page has this key, purging it drops them all
+ALL_PAGES = "polls"
+
+
+def anonymous_request(request):
+    """Return True for a GET with no session and no messages, the same for every visitor."""
+    return (request.method in ("GET", "HEAD")
+            and settings.SESSION_COOKIE_NAME not in request.COOKIES
+            and CookieStorage.cookie_name not in request.COOKIES)
+
+
+def patch_page_headers(request, response, keys):
+    """Make a page response public with its surrogate keys, or private."""
+    patch_vary_headers(response, ("Cookie",))
+    if request.anonymous_page and response.status_code == 200:
+        patch_cache_control(response, public=True, max_age=settings.PAGE_CACHE_MAX_AGE,
+                            s_maxage=settings.PAGE_CACHE_S_MAXAGE)
+        response["Surrogate-Key"] = " ".join([ALL_PAGES, *keys])
+    else:
+        patch_cache_control(response, private=True)
+    return response
+
+
+def public_page(*keys):
+    """
+    Let a reverse proxy cache the page of a view for the anonymous visitors.
+
+    keys are the surrogate keys of the page, formatted with the arguments of
+    the view, e.g. "question-{question_id}".
+    """
+    def decorator(view):
+        if iscoroutinefunction(view):
+            async def wrapper(request, *args, **kwargs):
+                request.anonymous_page = anonymous_request(request)
+                response = await view(request, *args, **kwargs)
+                return patch_page_headers(request, response,
+                                          [key.format(**kwargs) for key in keys])
+            markcoroutinefunction(wrapper)
+        else:
+            def wrapper(request, *args, **kwargs):
+                request.anonymous_page = anonymous_request(request)
+                response = view(request, *args, **kwargs)
+                return patch_page_headers(request, response,
+                                          [key.format(**kwargs) for key in keys])
+        return functools.wraps(view)(wrapper)
+    return decorator
+
+
+def purge(*keys):
+    """Send purge_pages for the pages of keys when the transaction commits."""
+    transaction.on_commit(lambda: purge_pages.send(sender=None, keys=keys))
+
+
+def send_purge(keys):
+    """Ask the reverse proxy at PAGE_PURGE_URL to drop the pages tagged with keys."""
+    request = urllib.request.Request(settings.PAGE_PURGE_URL, method="PURGE",
+                                     headers={"Surrogate-Key": " ".join(sorted(keys))})
+    with urllib.request.urlopen(request, timeout=5):
+        pass
+    logger.info("Purged pages %s", " ".join(sorted(keys)),
+                extra={"event": "pages_purged", "keys": sorted(keys)})
+
+
+class Purger(threading.Thread):
+    """Background thread sending the purges, the ones of PAGE_PURGE_DELAY seconds together."""
+
+    def __init__(self):
+        """Create the purger with no pending key."""
+        super().__init__(name="page-purge", daemon=True)
+        self.keys = set()
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+
+    def add(self, keys):
+        """Add keys to the next purge."""
+        with self.lock:
+            self.keys.update(keys)
+        self.wakeup.set()
+
+    def run(self):
+        """Send the pending keys until the process exits."""
+        while True:
+            self.wakeup.wait()
+            time.sleep(settings.PAGE_PURGE_DELAY)
+            self.wakeup.clear()
+            with self.lock:
+                keys, self.keys = self.keys, set()
+            try:
+                send_purge(keys)
+            except Exception:
+                logger.exception("Failed to purge pages %s", " ".join(sorted(keys)),
+                                 extra={"event": "purge_failed"})
+
+
+_purger = None
+_purger_lock = threading.Lock()
+
+
+@receiver(purge_pages)
+def queue_purge(sender, keys, **kwargs):
+    """Pass the keys to the purger of this process, if there is a proxy to purge."""
+    global _purger
+    if not settings.PAGE_PURGE_URL:
+        return
+    with _purger_lock:
+        if _purger is None:
+            _purger = Purger()
+            _purger.start()
+    _purger.add(keys)
+
+
+@receiver([post_save, post_delete], sender=Vote)
+def vote_saved(sender, instance, **kwargs):
+    """Purge the results page when a vote is saved or deleted."""
+    purge(f"results-{instance.question_id}")
+
+
+@receiver(vote_changed)
+def vote_cast(sender, question_id, **kwargs):
+    """Purge the results page when a vote is cast, changed or withdrawn."""
+    purge(f"results-{question_id}")
+
+
+@receiver([post_save, post_delete], sender=Choice)
+def choice_changed(sender, instance, **kwargs):
+    """Purge the detail and results pages when a choice is added, edited or removed."""
+    purge(f"question-{instance.question_id}")
+
+
+@receiver([post_save, post_delete], sender=Question)
+def question_changed(sender, instance, **kwargs):
+    """Purge the pages of a question and the index when it is edited or removed."""
+    purge(f"question-{instance.id}", "index")
+
+
+@receiver(question_status_changed)
+def question_status_moved(sender, question_id, **kwargs):
+    """Purge the pages of a question and the index when it opens or closes."""
+    purge(f"question-{question_id}", "index")
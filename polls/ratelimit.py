@@ -0,0 +1,178 @@
+"""
+Provide the rate limits of the polls application.
+
+A POST to a view decorated by rate_limit(scope) takes one token from the
+bucket of the client address, then from the bucket of the user, before it
+runs. The pages read by GET are not limited. A bucket
+holds up to N tokens and refills at N per period for a rate "N/period" of
+settings.RATE_LIMITS[scope]. A request finding a bucket empty gets a 429
+response without any query of the view, the address is checked before the
+session and its user are read.
+
+The buckets are kept in the memory of each process. With RATE_LIMIT_CACHE
+they are kept in that cache instead, e.g. on Redis to share them between the
+processes. Two processes may then take the same token, the limit is loose by
+the number of concurrent requests.
+"""
+import functools
+import logging
+import threading
+import time
+from collections import OrderedDict
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+
+logger = logging.getLogger("polls")
+
+PERIODS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+_stats_lock = threading.Lock()
+_stats = {}
+
+
+def parse_rate(rate):
+    """Return the (tokens, seconds) of a rate like "30/m", None for an empty rate."""
+    if not rate:
+        return None
+    tokens, period = rate.split("/")
+    return int(tokens), PERIODS[period]
+
+
+def take(tokens, updated, now, capacity, per_second):
+    """
+    Take one token from a bucket left with tokens at updated.
+
+    Return (allowed, tokens left, seconds until the next token).
+    """
+    tokens = min(capacity, tokens + (now - updated) * per_second)
+    if tokens >= 1:
+        return True, tokens - 1, 0.0
+    return False, tokens, (1 - tokens) / per_second
+
+
+class LocalBuckets:
+    """Token buckets in the memory of this process, the least recently used ones dropped."""
+
+    def __init__(self, max_buckets=100000):
+        """Create an empty store of at most max_buckets buckets."""
+        self.max_buckets = max_buckets
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def hit(self, key, capacity, period):
+        """Take a token of the bucket at key, return (allowed, seconds until the next token)."""
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated = self.buckets.pop(key, (capacity, now))
+            allowed, tokens, retry = take(tokens, updated, now, capacity, capacity / period)
+            self.buckets[key] = (tokens, now)
+            if len(self.buckets) > self.max_buckets:
+                self.buckets.popitem(last=False)
+        return allowed, retry
+
+    def clear(self):
+        """Refill every bucket."""
+        with self.lock:
+            self.buckets.clear()
+
+
+class CacheBuckets:
+    """Token buckets in a Django cache, shared by the processes using it."""
+
+    def __init__(self, alias):
+        """Keep the buckets in the cache of alias."""
+        self.alias = alias
+
+    def hit(self, key, capacity, period):
+        """Take a token of the bucket at key, return (allowed, seconds until the next token)."""
+        cache = caches[self.alias]
+        now = time.time()
+        tokens, updated = cache.get(f"ratelimit:{key}", (capacity, now))
+        allowed, tokens, retry = take(tokens, updated, now, capacity, capacity / period)
+        # a bucket left alone for a period is full again, like a missing one
+        cache.set(f"ratelimit:{key}", (tokens, now), period)
+        return allowed, retry
+
+    def clear(self):
+        """Nothing to do, the buckets expire in the cache."""
+
+
+_local = LocalBuckets()
+
+
+def get_buckets():
+    """Return the bucket store of the settings."""
+    if settings.RATE_LIMIT_CACHE:
+        return CacheBuckets(settings.RATE_LIMIT_CACHE)
+    return _local
+
+
+def _count(scope, kind, result):
+    with _stats_lock:
+        _stats[scope, kind, result] = _stats.get((scope, kind, result), 0) + 1
+
+
+def rate_limit_stats():
+    """Return the {(scope, "ip" or "user", "allowed" or "limited"): requests} of this process."""
+    with _stats_lock:
+        return dict(_stats)
+
+
+def check(scope, kind, identity):
+    """Take a token of the identity for a scope, return the seconds to wait, 0 if allowed."""
+    rate = parse_rate(settings.RATE_LIMITS[scope].get(kind))
+    if rate is None:
+        return 0
+    allowed, retry = get_buckets().hit(f"{scope}:{kind}:{identity}", *rate)
+    _count(scope, kind, "allowed" if allowed else "limited")
+    return 0 if allowed else retry
+
+
+def limited(scope, kind, identity, retry):
+    """Return the 429 response of a request over its rate."""
+    logger.warning("Rate limit of %s exceeded by %s %s", scope, kind, identity,
+                   extra={"event": "rate_limited", "scope": scope, kind: identity})
+    response = HttpResponse("Too many requests, please try again later.", status=429,
+                            content_type="text/plain")
+    response["Retry-After"] = str(max(1, round(retry)))
+    return response
+
+
+def rate_limit(scope, client_ip):
+    """
+    Limit the requests to a view by the rates of settings.RATE_LIMITS[scope].
+
+    Only the POST requests are counted. client_ip(request) gives the address,
+    the rate "ip" applies to it and the rate "user" to the logged in user.
+    Nothing is limited without RATE_LIMIT_ENABLED.
+    """
+    def decorator(view):
+        if iscoroutinefunction(view):
+            async def wrapper(request, *args, **kwargs):
+                if settings.RATE_LIMIT_ENABLED and request.method == "POST":
+                    ip = client_ip(request)
+                    if retry := check(scope, "ip", ip):
+                        return limited(scope, "ip", ip, retry)
+                    # the session and the user are only read for a user rate
+                    if settings.RATE_LIMITS[scope].get("user"):
+                        user = await request.auser()
+                        if user.is_authenticated and (retry := check(scope, "user", user.pk)):
+                            return limited(scope, "user", user.pk, retry)
+                return await view(request, *args, **kwargs)
+            markcoroutinefunction(wrapper)
+        else:
+            def wrapper(request, *args, **kwargs):
+                if settings.RATE_LIMIT_ENABLED and request.method == "POST":
+                    ip = client_ip(request)
+                    if retry := check(scope, "ip", ip):
+                        return limited(scope, "ip", ip, retry)
+                    # the session and the user are only read for a user rate
+                    if settings.RATE_LIMITS[scope].get("user"):
+                        user = request.user
+                        if user.is_authenticated and (retry := check(scope, "user", user.pk)):
+                            return limited(scope, "user", user.pk, retry)
+                return view(request, *args, **kwargs)
+        return functools.wraps(view)(wrapper)
+    return decorator
@@ -0,0 +1,16 @@
+"""Provide signals of the polls application."""
+from django.dispatch import Signal
+
+# Sent after the vote of a user for a question is cast, changed or withdrawn
+# without saving a Vote instance. Arguments: question_id, user_id,
+# choice_id (the new choice, None when withdrawn), old_choice_id (None when new).
+vote_changed = Signal()
+
+# Sent by the lifecycle scheduler after the stored status of a question moved
+# because its pub_date or end_date was reached. Arguments: question_id,
+# status (the new Question.Status), old_status.
+question_status_changed = Signal()
+
+# Sent after a transaction changed what the cached pages show, by the
+# proxy module. Arguments: keys, the surrogate keys of the pages to purge.
+purge_pages = Signal()
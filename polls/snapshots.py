@@ -0,0 +1,70 @@
+"""
+Provide the results snapshots of the closed questions.
+
+The results of a question can not change once its end_date has passed. The
+freeze_results command stores them in a ResultsSnapshot, the results page
+then reads that one row. The votes of a frozen question can also be moved to
+the ArchivedVote table, to keep the Vote table to the open polls. A reopened
+question drops its snapshot and gets its archived votes back.
+"""
+import datetime
+import logging
+from django.db import IntegrityError, transaction
+from django.db.models import prefetch_related_objects
+from django.utils import timezone
+from polls.cache import invalidate_results, results_payload
+from polls.models import (Question, ResultsSnapshot, archive_votes, recount_votes,
+                          results_prefetch)
+
+logger = logging.getLogger("polls")
+
+
+def freeze_question(question):
+    """Store the results of a closed question in its snapshot, from a recount of its votes."""
+    with transaction.atomic():
+        # the last tallies are counted again, the counter shards folded away
+        recount_votes([question.id])
+        question = Question.objects.get(pk=question.id)
+        prefetch_related_objects([question], results_prefetch())
+        snapshot = ResultsSnapshot.objects.create(question=question,
+                                                  payload=results_payload(question))
+        invalidate_results(question.id)
+    return snapshot
+
+
+def archive_question_votes(snapshot):
+    """Move the votes of a frozen question to ArchivedVote, return how many were moved."""
+    with transaction.atomic():
+        moved = archive_votes(snapshot.question)
+        snapshot.votes_archived = True
+        snapshot.save(update_fields=["votes_archived"])
+    return moved
+
+
+def freeze_closed_questions(grace=60, archive=False):
+    """
+    Freeze every question closed for more than grace seconds.
+
+    A vote accepted just before end_date may still be written, so a question
+    is only frozen grace seconds after it closed, and only once its stored
+    status is closed so it can not be voted anymore. With archive the votes of
+    the frozen questions are archived too. Return (frozen questions, archived votes).
+    """
+    closed_before = timezone.now() - datetime.timedelta(seconds=grace)
+    frozen = 0
+    for question in Question.objects.filter(status=Question.Status.CLOSED,
+                                            end_date__lt=closed_before, snapshot__isnull=True):
+        try:
+            freeze_question(question)
+        except IntegrityError:
+            # frozen by another scheduler in the meantime
+            continue
+        frozen += 1
+        logger.info("Froze the results of question %s", question.id,
+                    extra={"event": "results_frozen", "question_id": question.id})
+    archived = 0
+    if archive:
+        for snapshot in ResultsSnapshot.objects.filter(votes_archived=False).select_related(
+                "question"):
+            archived += archive_question_votes(snapshot)
+    return frozen, archived
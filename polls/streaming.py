@@ -0,0 +1,159 @@
+"""
+Provide the live results stream of the polls application.
+
+Every question watched in this process has one ResultsBroadcaster. It reads
+the results once per RESULTS_STREAM_INTERVAL and sends the changed tallies to
+all its subscribers, so N watchers cost one aggregation per tick. Once the
+question is closed the streams send a "closed" event and end, and a new
+stream of a closed question is refused with 204 so the browser stops
+reconnecting.
+"""
+import asyncio
+import json
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from polls.cache import get_results
+
+# a comment line is sent after this many silent ticks, to keep proxies from closing
+HEARTBEAT_TICKS = 15
+
+
+def is_live(results):
+    """Return True if the results of a question can still change, it is open."""
+    # the snapshots frozen before the status was cached are closed questions
+    return results.get("status") == "open"
+
+
+def results_delta(old, new):
+    """Return the tallies of new that changed since old, None if nothing changed."""
+    old_choices = {choice["id"]: choice for choice in old["results"]} if old else {}
+    changed = {
+        choice["id"]: {"votes": choice["votes"], "percentage": choice["percentage"]}
+        for choice in new["results"]
+        if old_choices.get(choice["id"]) != choice
+    }
+    if not changed and old and old["total_votes"] == new["total_votes"]:
+        return None
+    return {"total_votes": new["total_votes"], "choices": changed}
+
+
+def sse_event(event, data):
+    """Return a Server-Sent Event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class Subscriber:
+    """One stream, the deltas it has not sent yet are merged into one."""
+
+    def __init__(self):
+        """Create a subscriber without pending delta."""
+        self.pending = None
+        self.closed = False
+        self.ready = asyncio.Event()
+
+    def push(self, delta):
+        """Merge delta into the pending one and wake the stream up."""
+        if self.pending is None:
+            self.pending = {"total_votes": delta["total_votes"], "choices": {}}
+        self.pending["total_votes"] = delta["total_votes"]
+        self.pending["choices"].update(delta["choices"])
+        self.ready.set()
+
+    def close(self):
+        """End the stream after its pending delta, the question is closed."""
+        self.closed = True
+        self.ready.set()
+
+    def take(self):
+        """Return the pending delta and clear it."""
+        delta, self.pending = self.pending, None
+        self.ready.clear()
+        return delta
+
+
+class ResultsBroadcaster:
+    """Read the results of a question while it has subscribers and fan the changes out."""
+
+    def __init__(self, question_id):
+        """Create the broadcaster of a question, it starts with its first subscriber."""
+        self.question_id = question_id
+        self.subscribers = set()
+        self.results = None
+        self.task = None
+        self.reads = 0
+
+    async def read(self):
+        """Read the results of the question, None if it was deleted."""
+        self.reads += 1
+        return await sync_to_async(get_results)(self.question_id)
+
+    async def subscribe(self):
+        """Add a subscriber, return it with the current results."""
+        if self.results is None:
+            self.results = await self.read()
+        subscriber = Subscriber()
+        self.subscribers.add(subscriber)
+        if self.task is None or self.task.done():
+            _broadcasters.setdefault(self.question_id, self)
+            self.task = asyncio.ensure_future(self.run())
+        return subscriber, self.results
+
+    def unsubscribe(self, subscriber):
+        """Remove a subscriber, the broadcaster stops after the last one."""
+        self.subscribers.discard(subscriber)
+
+    async def run(self):
+        """Read the results every tick and push the delta to every subscriber."""
+        while self.subscribers:
+            await asyncio.sleep(settings.RESULTS_STREAM_INTERVAL)
+            results = await self.read()
+            if results is None:
+                continue
+            delta = results_delta(self.results, results)
+            self.results = results
+            if delta is not None:
+                for subscriber in self.subscribers:
+                    subscriber.push(delta)
+            if not is_live(results):
+                for subscriber in self.subscribers:
+                    subscriber.close()
+                self.subscribers.clear()
+        if _broadcasters.get(self.question_id) is self:
+            del _broadcasters[self.question_id]
+        self.results = None
+
+
+_broadcasters = {}
+
+
+def get_broadcaster(question_id):
+    """Return the broadcaster of a question in this process."""
+    if question_id not in _broadcasters:
+        _broadcasters[question_id] = ResultsBroadcaster(question_id)
+    return _broadcasters[question_id]
+
+
+async def event_stream(results, subscriber, broadcaster):
+    """Yield the results then their deltas as Server-Sent Events until the client leaves."""
+    try:
+        yield sse_event("results", results)
+        silent = 0
+        while True:
+            try:
+                await asyncio.wait_for(subscriber.ready.wait(),
+                                       settings.RESULTS_STREAM_INTERVAL)
+            except asyncio.TimeoutError:
+                silent += 1
+                if silent >= HEARTBEAT_TICKS:
+                    silent = 0
+                    yield ": keepalive\n\n"
+                continue
+            silent = 0
+            delta = subscriber.take()
+            if delta is not None:
+                yield sse_event("delta", delta)
+            if subscriber.closed:
+                yield sse_event("closed", {})
+                return
+    finally:
+        broadcaster.unsubscribe(subscriber)
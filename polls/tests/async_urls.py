@@ -0,0 +1,9 @@
+"""URL configuration serving the async poll views in tests."""
+from django.urls import include, path
+from polls import async_views
+from polls.urls import app_name, poll_patterns
+
+urlpatterns = [
+    path('accounts/', include('django.contrib.auth.urls')),
+    path('polls/', include((poll_patterns(async_views), app_name))),
+]
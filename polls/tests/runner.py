@@ -0,0 +1,34 @@
+"""Provide the test runner of the polls application."""
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+# settings of every test run, whatever the environment sets
+TEST_SETTINGS = {
+    # a view over its query budget fails the test
+    "QUERY_BUDGET_RAISE": True,
+    # the tests open and close the polls themselves
+    "LIFECYCLE_SCHEDULER": "off",
+    # the tests send many requests from one address
+    "RATE_LIMIT_ENABLED": False,
+    # the tests flush the vote history themselves
+    "VOTE_HISTORY_WORKER": False,
+}
+
+
+class PollsTestRunner(DiscoverRunner):
+    """Run the tests with TEST_SETTINGS, the tests of a setting override it again."""
+
+    def setup_test_environment(self, **kwargs):
+        """Apply TEST_SETTINGS for the whole run."""
+        super().setup_test_environment(**kwargs)
+        # the tests do not run collectstatic, the manifest of PRODUCTION_ASSETS is missing
+        storages = {**settings.STORAGES, "staticfiles": {
+            "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"}}
+        self.test_settings = override_settings(**TEST_SETTINGS, STORAGES=storages)
+        self.test_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        """Restore the settings of the environment."""
+        self.test_settings.disable()
+        super().teardown_test_environment(**kwargs)
@@ -0,0 +1,181 @@
+"""Provide test for the JSON API."""
+import datetime
+from django.core.cache import caches
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from django.contrib.auth.models import User
+from polls.history import flush_history
+from polls.models import Question, cast_vote, withdraw_vote
+
+
+def create_question(question_text, days=-1):
+    """Create a question published `days` from now."""
+    return Question.objects.create(question_text=question_text,
+                                   pub_date=timezone.now() + datetime.timedelta(days=days))
+
+
+def create_choice(question, choice_num):
+    """
+    Create choice_num choices in question.
+
+    choice_text = 1, 2, 3, ... , choice_num
+    """
+    for choice_text in range(1, choice_num+1):
+        question.choice_set.create(choice_text=choice_text)
+
+
+class QuestionApiTest(TestCase):
+    """Test the JSON API answers with ETags and 304 Not Modified."""
+
+    def setUp(self):
+        """Create a question with two choices, start from empty caches."""
+        caches['results'].clear()
+        caches['default'].clear()
+        self.question = create_question('test_question')
+        create_choice(self.question, 2)
+        self.choice1, self.choice2 = self.question.choice_set.all()
+
+    def test_detail(self):
+        """The detail has the question, its status and choices, with caching headers."""
+        response = self.client.get(reverse('polls:api_question', args=[self.question.id]))
+        data = response.json()
+        self.assertEqual(data['question_text'], 'test_question')
+        self.assertEqual(data['status'], 'open')
+        self.assertTrue(data['can_vote'])
+        self.assertEqual([c['id'] for c in data['choices']], [self.choice1.id, self.choice2.id])
+        self.assertTrue(response['ETag'].startswith('"'))
+        self.assertEqual(response['Cache-Control'], 'public, max-age=5')
+        self.assertNotIn('Cookie', response.get('Vary', ''))
+
+    def test_detail_not_published(self):
+        """A question not published yet is not found."""
+        question = create_question('future', days=1)
+        response = self.client.get(reverse('polls:api_question', args=[question.id]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_results_not_modified(self):
+        """A matching If-None-Match is answered 304, also when the results cache was lost."""
+        url = reverse('polls:api_results', args=[self.question.id])
+        response = self.client.get(url)
+        self.assertEqual(response.json()['total_votes'], 0)
+        etag = response['ETag']
+        # another process, or a restart, has its own cache versions
+        caches['results'].clear()
+        response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['Cache-Control'], 'public, max-age=5')
+
+    def test_vote_changes_etag(self):
+        """A vote moves the ETag of the results, the new tallies are returned."""
+        url = reverse('polls:api_results', args=[self.question.id])
+        etag = self.client.get(url)['ETag']
+        user = User.objects.create_user(username='test', password='1234')
+        cast_vote(user, self.question, self.choice1)
+        response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['results'][0]['votes'], 1)
+
+    def test_results_not_found(self):
+        """The results of a non-existent question are not found."""
+        response = self.client.get(reverse('polls:api_results', args=[1234]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_results_not_published(self):
+        """The results and timeline of a question not published yet are not found."""
+        question = create_question('future', days=1)
+        for name in ('polls:api_results', 'polls:api_timeline'):
+            response = self.client.get(reverse(name, args=[question.id]))
+            self.assertEqual(response.status_code, 404)
+
+    @override_settings(INDEX_PAGE_SIZE=1)
+    def test_list_pages(self):
+        """The list is paged by cursor, newest first."""
+        older = create_question('older', days=-2)
+        response = self.client.get(reverse('polls:api_questions'))
+        data = response.json()
+        self.assertEqual([q['id'] for q in data['questions']], [self.question.id])
+        data = self.client.get(data['next']).json()
+        self.assertEqual([q['id'] for q in data['questions']], [older.id])
+        self.assertIsNone(data['next'])
+
+    def test_list_not_modified(self):
+        """The list is not modified until a question changes."""
+        url = reverse('polls:api_questions') + '?status=open'
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, headers={'If-None-Match': etag}).status_code, 304)
+        self.question.question_text = 'edited'
+        self.question.save()
+        response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.json()['questions'][0]['question_text'], 'edited')
+
+    def test_list_bad_request(self):
+        """An unknown status or an invalid cursor is a bad request."""
+        self.assertEqual(self.client.get(reverse('polls:api_questions') + '?status=x')
+                         .status_code, 400)
+        self.assertEqual(self.client.get(reverse('polls:api_questions') + '?after=x')
+                         .status_code, 400)
+
+
+class TimelineApiTest(TestCase):
+    """Test the results over time are served from the vote buckets."""
+
+    def setUp(self):
+        """Create a question with two choices, start from empty caches and history."""
+        caches['results'].clear()
+        flush_history()
+        self.question = create_question('test_question')
+        create_choice(self.question, 2)
+        self.choice1, self.choice2 = self.question.choice_set.all()
+        self.url = reverse('polls:api_timeline', args=[self.question.id])
+
+    def vote(self, username, choice):
+        """Cast the vote of a new user and write the history."""
+        user = User.objects.create_user(username=username, password='1234')
+        with self.captureOnCommitCallbacks(execute=True):
+            cast_vote(user, self.question, choice)
+        flush_history()
+        return user
+
+    def test_timeline(self):
+        """The buckets have the net votes and the totals of each choice."""
+        self.vote('user1', self.choice1)
+        user = self.vote('user2', self.choice2)
+        with self.captureOnCommitCallbacks(execute=True):
+            cast_vote(user, self.question, self.choice1)
+        flush_history()
+        # the published check, the question results and the buckets
+        with self.assertNumQueries(4):
+            data = self.client.get(self.url).json()
+        self.assertEqual(data['resolution'], 'hour')
+        self.assertEqual([c['id'] for c in data['choices']], [self.choice1.id, self.choice2.id])
+        self.assertEqual(len(data['buckets']), 1)
+        self.assertEqual(data['buckets'][0]['votes'], [2, 0])
+        self.assertEqual(data['buckets'][0]['totals'], [2, 0])
+
+    def test_votes_before_history(self):
+        """The votes older than the buckets are counted before the first bucket."""
+        user = User.objects.create_user(username='early', password='1234')
+        with override_settings(VOTE_HISTORY=False):
+            cast_vote(user, self.question, self.choice2)
+        self.vote('user1', self.choice1)
+        data = self.client.get(self.url + '?resolution=minute').json()
+        self.assertEqual(data['buckets'][0]['votes'], [1, 0])
+        self.assertEqual(data['buckets'][0]['totals'], [1, 1])
+
+    def test_since(self):
+        """Only the buckets from since are returned."""
+        user = self.vote('user1', self.choice1)
+        with self.captureOnCommitCallbacks(execute=True):
+            withdraw_vote(user, self.question)
+        flush_history()
+        data = self.client.get(self.url + '?since=9999999999').json()
+        self.assertEqual(data['buckets'], [])
+
+    def test_bad_request(self):
+        """An unknown resolution or an invalid since is a bad request."""
+        self.assertEqual(self.client.get(self.url + '?resolution=day').status_code, 400)
+        self.assertEqual(self.client.get(self.url + '?since=x').status_code, 400)
+        self.assertEqual(self.client.get(reverse('polls:api_timeline', args=[1234]))
+                         .status_code, 404)
@@ -0,0 +1,71 @@
+"""Provide test for the async poll views."""
+from django.core.cache import caches
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.contrib.auth.models import User
+from polls.models import Question, Vote
+
+
+def create_question(question_text):
+    """Create a question with the given 'question_text'."""
+    return Question.objects.create(question_text=question_text)
+
+
+def create_choice(question, choice_num):
+    """
+    Create choice_num choices in question.
+
+    choice_text = 1, 2, 3, ... , choice_num
+    """
+    for choice_text in range(1, choice_num+1):
+        question.choice_set.create(choice_text=choice_text)
+
+
+@override_settings(ROOT_URLCONF="polls.tests.async_urls")
+class AsyncViewsTest(TestCase):
+    """Test the async views behave like the sync views."""
+
+    def setUp(self):
+        """Create a user and a question with two choices."""
+        caches['results'].clear()
+        self.user = User.objects.create_user(username='test', password='1234')
+        self.question = create_question('test_question')
+        create_choice(self.question, 2)
+        self.choice1, self.choice2 = self.question.choice_set.all()
+
+    async def test_detail(self):
+        """The detail page shows the question and the choice of the user."""
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(reverse('polls:detail', args=[self.question.id]))
+        self.assertContains(response, self.question.question_text)
+        self.assertIsNone(response.context['selected_choice'])
+
+    async def test_detail_non_existent_question(self):
+        """The detail page of a non-existent question redirects to the index."""
+        response = await self.async_client.get(reverse('polls:detail', args=[1234]))
+        self.assertRedirects(response, reverse('polls:index'), fetch_redirect_response=False)
+
+    async def test_vote_and_delete(self):
+        """A user can vote, change the vote and delete it."""
+        url = reverse('polls:vote', args=[self.question.id])
+        response = await self.async_client.post(url, {'choice': self.choice1.id})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(await Vote.objects.acount(), 0)
+
+        await self.async_client.aforce_login(self.user)
+        await self.async_client.post(url, {'choice': self.choice1.id})
+        response = await self.async_client.post(url, {'choice': self.choice2.id})
+        self.assertRedirects(response, reverse('polls:results', args=[self.question.id]),
+                             fetch_redirect_response=False)
+        vote = await Vote.objects.aget(user=self.user)
+        self.assertEqual(vote.choice_id, self.choice2.id)
+
+        await self.async_client.post(reverse('polls:delete_vote', args=[self.question.id]))
+        self.assertEqual(await Vote.objects.acount(), 0)
+
+    async def test_results(self):
+        """The results page shows the votes of each choice."""
+        response = await self.async_client.get(reverse('polls:results', args=[self.question.id]))
+        self.assertContains(response, self.choice1.choice_text)
+        response = await self.async_client.get(reverse('polls:results', args=[1234]))
+        self.assertEqual(response.status_code, 404)
@@ -1,6 +1,11 @@
 """Provide test for authentication."""
+from unittest import mock
 import django.test
+from django.core.cache import caches
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
 from django.contrib.auth.models import User
 from polls.models import Question, Choice
 from mysite import settings
@@ -86,3 +91,49 @@ class UserAuthTest(django.test.TestCase):
         self.assertEqual(response.status_code, 302)  # could be 303
         login_with_next = f"{reverse('login')}?next={vote_url}"
         self.assertRedirects(response, login_with_next)
+
+    def test_signup_hashes_once(self):
+        """Signup logs the new user in without checking the password hash again."""
+        form_data = {"username": "new_user", "password1": "kupolls-secret-77",
+                     "password2": "kupolls-secret-77"}
+        with mock.patch.object(PBKDF2PasswordHasher, "verify") as verify:
+            response = self.client.post(reverse("polls:signup"), form_data)
+        self.assertRedirects(response, reverse("polls:index"))
+        verify.assert_not_called()
+        user = User.objects.get(username="new_user")
+        self.assertEqual(self.client.session["_auth_user_id"], str(user.pk))
+
+
+@django.test.override_settings(
+    SESSION_ENGINE="django.contrib.sessions.backends.signed_cookies",
+    AUTHENTICATION_BACKENDS=["polls.auth.CachedModelBackend"],
+    AUTH_USER_CACHE_TIMEOUT=60,
+)
+class SessionFastPathTest(django.test.TestCase):
+    """Test a voter is served without reading the session or the user from the database."""
+
+    def setUp(self):
+        """Log a user in."""
+        caches["sessions"].clear()
+        self.user = User.objects.create_user(username="test", password="1234")
+        self.client.force_login(self.user)
+
+    def user_queries(self):
+        """Return the queries of the session and user tables sent by the index page."""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("polls:index"))
+        self.assertEqual(response.context["user"], self.user)
+        return [query["sql"] for query in queries
+                if "django_session" in query["sql"] or "auth_user" in query["sql"]]
+
+    def test_cached_user(self):
+        """The user is read once, then from the cache."""
+        self.assertEqual(len(self.user_queries()), 1)
+        self.assertEqual(self.user_queries(), [])
+
+    def test_saved_user_dropped(self):
+        """Saving the user drops it from the cache."""
+        self.user_queries()
+        self.user.first_name = "Changed"
+        self.user.save()
+        self.assertEqual(len(self.user_queries()), 1)
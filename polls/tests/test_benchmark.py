@@ -0,0 +1,56 @@
+"""Provide test for the benchmark suite."""
+import random
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from polls.benchmark import Benchmark, FLOWS, compare, login_clients, seed, seed_votes
+from polls.models import Question, Vote
+
+
+class BenchmarkTest(TransactionTestCase):
+    """Test the benchmark data and flows."""
+
+    def test_seed(self):
+        """The fixture questions and users are copied, the voters fill the tallies."""
+        open_questions = seed(6, 4)
+        self.assertEqual(Question.objects.count(), 6)
+        self.assertEqual(User.objects.count(), 4)
+        # one of the three template questions is closed
+        self.assertEqual(len(open_questions), 4)
+        votes = seed_votes(User.objects.all()[:1], random.Random(0))
+        self.assertEqual(votes, 6)
+        self.assertEqual(sum(q.total_votes for q in Question.objects.all()), 6)
+
+    # the login and signup flows hash passwords, a fast hasher keeps the test short
+    @override_settings(PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"])
+    def test_run_flows(self):
+        """Every flow runs without error and counts the queries and bytes of its requests."""
+        # one client, the in-memory test database locks concurrent writers
+        open_questions = seed(6, 1)
+        benchmark = Benchmark(login_clients(User.objects.all()), open_questions)
+        for flow in FLOWS:
+            stats = benchmark.run(flow, 4)
+            self.assertEqual(stats["requests"], 4)
+            self.assertEqual(stats["errors"], 0, flow)
+            self.assertGreater(stats["queries"], 0)
+            if flow in ("index", "detail", "results"):
+                self.assertGreater(stats["bytes"], 0)
+        # vote made the first votes, vote_change moved them
+        self.assertEqual(Vote.objects.count(), 4)
+        # and signup added its users
+        self.assertEqual(User.objects.count(), 5)
+
+
+class CompareTest(SimpleTestCase):
+    """Test the regressions found against a baseline."""
+
+    baseline = {"index": {"rps": 100.0, "p50": 10.0, "queries": 2.0, "errors": 0}}
+
+    def test_within_tolerance(self):
+        """Small differences are not regressions."""
+        results = {"index": {"rps": 80.0, "p50": 12.0, "queries": 2.2, "errors": 0}}
+        self.assertEqual(compare(results, self.baseline, 0.25), [])
+
+    def test_regressions(self):
+        """Slower, more queries and errors are all reported."""
+        results = {"index": {"rps": 50.0, "p50": 20.0, "queries": 3.0, "errors": 1}}
+        self.assertEqual(len(compare(results, self.baseline, 0.25)), 4)
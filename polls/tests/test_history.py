@@ -0,0 +1,119 @@
+"""Provide test for the vote history."""
+import csv
+from io import StringIO
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.contrib.auth.models import User
+from polls.history import bucket_deltas, flush_history, get_buffer, timeline
+from polls.models import Question, VoteBucket, VoteEvent, cast_vote, withdraw_vote
+
+
+def create_question(question_text):
+    """Create a question with the given 'question_text'."""
+    return Question.objects.create(question_text=question_text)
+
+
+def create_choice(question, choice_num):
+    """
+    Create choice_num choices in question.
+
+    choice_text = 1, 2, 3, ... , choice_num
+    """
+    for choice_text in range(1, choice_num+1):
+        question.choice_set.create(choice_text=choice_text)
+
+
+class VoteHistoryTest(TestCase):
+    """Test the vote changes are buffered, then written in batches."""
+
+    def setUp(self):
+        """Create a question with two choices and a user, start from an empty buffer."""
+        flush_history()
+        self.question = create_question('test_question')
+        create_choice(self.question, 2)
+        self.choice1, self.choice2 = self.question.choice_set.all()
+        self.user = User.objects.create_user(username='tester', password='1234')
+
+    def test_vote_sends_no_extra_query(self):
+        """The change is only buffered by the vote."""
+        with CaptureQueriesContext(connection) as without_history:
+            with override_settings(VOTE_HISTORY=False):
+                cast_vote(self.user, self.question, self.choice1)
+        withdraw_vote(self.user, self.question)
+        with CaptureQueriesContext(connection) as with_history:
+            with self.captureOnCommitCallbacks(execute=True):
+                cast_vote(self.user, self.question, self.choice1)
+        self.assertEqual(len(with_history), len(without_history))
+        self.assertEqual(len(get_buffer()), 1)
+        self.assertFalse(VoteEvent.objects.exists())
+
+    def test_timeline(self):
+        """A vote, a change and a withdrawal are written in order, by one insert."""
+        with self.captureOnCommitCallbacks(execute=True):
+            cast_vote(self.user, self.question, self.choice1)
+            cast_vote(self.user, self.question, self.choice2)
+            withdraw_vote(self.user, self.question)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(flush_history(), 3)
+        inserts = [query for query in queries if 'INTO "polls_voteevent"' in query["sql"]]
+        self.assertEqual(len(inserts), 1)
+        events = list(timeline(self.question.id).values_list("choice_id", "old_choice_id"))
+        self.assertEqual(events, [(self.choice1.id, None), (self.choice2.id, self.choice1.id),
+                                  (None, self.choice2.id)])
+        self.assertFalse(timeline(self.question.id + 1).exists())
+
+    def test_buckets(self):
+        """The written events are added to the minute and hour buckets of their choices."""
+        with self.captureOnCommitCallbacks(execute=True):
+            cast_vote(self.user, self.question, self.choice1)
+        flush_history()
+        with self.captureOnCommitCallbacks(execute=True):
+            cast_vote(self.user, self.question, self.choice2)
+        flush_history()
+        buckets = {(choice_id, size): votes for choice_id, size, votes in
+                   VoteBucket.objects.values_list("choice_id", "size", "votes")}
+        for size in (60, 3600):
+            self.assertEqual(buckets.get((self.choice2.id, size)), 1)
+            # the vote moved away in the same bucket
+            self.assertEqual(buckets.get((self.choice1.id, size), 0), 0)
+
+    def test_bucket_deltas(self):
+        """A vote and its change in one minute add up, across minutes they do not."""
+        deltas = bucket_deltas([(120, 1, 1, 10, None), (150, 1, 1, 11, 10),
+                                (200, 1, 2, 10, None)])
+        self.assertEqual(deltas[1, 11, 60, 120], 1)
+        self.assertNotIn((1, 10, 60, 120), deltas)
+        self.assertEqual(deltas[1, 10, 60, 180], 1)
+        self.assertEqual(deltas[1, 10, 3600, 0], 1)
+        self.assertEqual(deltas[1, 11, 3600, 0], 1)
+
+    def test_rolled_back_change_not_recorded(self):
+        """A change is buffered only when its transaction commits."""
+        with self.captureOnCommitCallbacks(execute=False):
+            cast_vote(self.user, self.question, self.choice1)
+        self.assertEqual(flush_history(), 0)
+
+    def test_history_kept_after_question_deleted(self):
+        """The events are not removed with their question."""
+        with self.captureOnCommitCallbacks(execute=True):
+            cast_vote(self.user, self.question, self.choice1)
+        flush_history()
+        question_id = self.question.id
+        self.question.delete()
+        self.assertEqual(timeline(question_id).count(), 1)
+
+    def test_export_history(self):
+        """The timeline of a question is exported as CSV."""
+        with self.captureOnCommitCallbacks(execute=True):
+            cast_vote(self.user, self.question, self.choice1)
+            cast_vote(self.user, self.question, self.choice2)
+        flush_history()
+        out = StringIO()
+        call_command("export_results", history=True, question=self.question.id,
+                     format="csv", stdout=out, stderr=StringIO())
+        rows = list(csv.DictReader(StringIO(out.getvalue())))
+        self.assertEqual([row["choice"] for row in rows],
+                         [str(self.choice1.id), str(self.choice2.id)])
+        self.assertEqual(rows[1]["old_choice"], str(self.choice1.id))
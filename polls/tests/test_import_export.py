@@ -0,0 +1,111 @@
+"""Provide test for the import_polls and export_results commands."""
+import csv
+import json
+import tempfile
+from io import StringIO
+from pathlib import Path
+from django.conf import settings
+from django.core.management import call_command
+from django.test import TestCase
+from django.contrib.auth.models import User
+from polls.models import Choice, Question, Vote
+
+
+def create_question(question_text):
+    """Create a question with the given 'question_text'."""
+    return Question.objects.create(question_text=question_text)
+
+
+def create_choice(question, choice_num):
+    """
+    Create choice_num choices in question.
+
+    choice_text = 1, 2, 3, ... , choice_num
+    """
+    for choice_text in range(1, choice_num+1):
+        question.choice_set.create(choice_text=choice_text)
+
+
+class ImportPollsTest(TestCase):
+    """Test the polls and votes are bulk loaded with their tallies."""
+
+    def setUp(self):
+        """Write the imported files in a temporary directory."""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+
+    def test_import_fixtures(self):
+        """The fixtures in data/ are loaded and the tallies counted."""
+        data = Path(settings.BASE_DIR) / "data"
+        call_command("import_polls", data / "users.json", data / "polls-v4.json",
+                     data / "votes-v4.json", batch_size=10, stdout=StringIO())
+        self.assertEqual(Question.objects.count(), 3)
+        self.assertEqual(User.objects.count(), 4)
+        votes = Vote.objects.count()
+        self.assertGreater(votes, 0)
+        self.assertEqual(sum(Question.objects.values_list("total_votes", flat=True)), votes)
+        for choice in Choice.objects.all():
+            self.assertEqual(choice.vote_count, choice.vote_set.count())
+
+    def test_import_csv_votes(self):
+        """The question of a CSV vote is found from its choice."""
+        question = create_question('test_question')
+        create_choice(question, 2)
+        choice = question.choice_set.last()
+        users = [User.objects.create_user(username=f'user{n}') for n in range(3)]
+        path = self.directory / "votes.csv"
+        with open(path, "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(["user", "choice"])
+            writer.writerows([user.id, choice.id] for user in users)
+        out = StringIO()
+        call_command("import_polls", str(path), model="polls.vote", stdout=out)
+        self.assertIn("polls.vote: 3 rows", out.getvalue())
+        choice.refresh_from_db()
+        self.assertEqual(choice.vote_count, 3)
+        self.assertEqual(Vote.objects.filter(question=question).count(), 3)
+
+    def test_new_rows_after_import(self):
+        """The rows created after an import do not reuse the imported ids."""
+        path = self.directory / "polls.jsonl"
+        path.write_text(json.dumps({"model": "polls.question", "pk": 50,
+                                    "fields": {"question_text": "imported"}}) + "\n")
+        call_command("import_polls", str(path), stdout=StringIO())
+        self.assertGreater(create_question('new').id, 50)
+
+
+class ExportResultsTest(TestCase):
+    """Test the results and votes are exported and can be loaded again."""
+
+    def setUp(self):
+        """Create a question with one vote."""
+        self.question = create_question('test_question')
+        create_choice(self.question, 2)
+        self.choice = self.question.choice_set.first()
+        self.user = User.objects.create_user(username='test')
+        Vote.objects.create(user=self.user, choice=self.choice)
+        call_command("rebuild_vote_counts", stdout=StringIO())
+
+    def test_export_results(self):
+        """Every question is one JSON line with the votes of its choices."""
+        out = StringIO()
+        call_command("export_results", stdout=out, stderr=StringIO())
+        results = json.loads(out.getvalue().splitlines()[0])
+        self.assertEqual(results["total_votes"], 1)
+        self.assertEqual(results["results"][0]["votes"], 1)
+        self.assertEqual(results["results"][0]["percentage"], 100.0)
+
+    def test_export_votes_round_trip(self):
+        """The exported votes are loaded again by import_polls."""
+        out = StringIO()
+        call_command("export_results", votes=True, stdout=out, stderr=StringIO())
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = Path(directory.name) / "votes.jsonl"
+        path.write_text(out.getvalue())
+        Vote.objects.all().delete()
+        call_command("import_polls", str(path), stdout=StringIO())
+        self.assertEqual(Vote.objects.get().choice, self.choice)
+        self.choice.refresh_from_db()
+        self.assertEqual(self.choice.vote_count, 1)
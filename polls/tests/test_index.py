@@ -1,8 +1,14 @@
 """Provide test for index page."""
 import datetime
-from django.test import TestCase
+from django.core.cache import caches
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 from polls.models import Question
+from polls.cache import next_boundary
+from polls.lifecycle import move_status
+from polls.views import encode_cursor
 from django.urls import reverse
 
 
@@ -19,6 +25,10 @@ def create_question(question_text, days):
 class QuestionIndexViewTests(TestCase):
     """Test Index view response correctly."""
 
+    def setUp(self):
+        """Start every test with an empty index cache."""
+        caches['default'].clear()
+
     def test_no_questions(self):
         """If no questions exist, an appropriate message is displayed."""
         response = self.client.get(reverse("polls:index"))
@@ -61,3 +71,84 @@ class QuestionIndexViewTests(TestCase):
             response.context["question_list"],
             [question2, question1],
         )
+
+    def test_index_cached(self):
+        """The question list is served from the cache without querying the questions."""
+        question = create_question(question_text="Past question.", days=-5)
+        self.client.get(reverse("polls:index"))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("polls:index"))
+        self.assertEqual(len(queries), 0)
+        self.assertContains(response, question.question_text)
+
+    def test_index_invalidated_by_edit(self):
+        """Editing a question rebuilds the question list."""
+        question = create_question(question_text="Past question.", days=-5)
+        self.client.get(reverse("polls:index"))
+        question.question_text = "Edited question."
+        question.save()
+        self.assertContains(self.client.get(reverse("polls:index")), "Edited question.")
+
+    def test_next_boundary(self):
+        """The index cache also expires at the nearest upcoming opening or closing."""
+        now = timezone.now()
+        self.assertIsNone(next_boundary(now))
+        question = create_question(question_text="Future question.", days=30)
+        self.assertEqual(next_boundary(now), question.pub_date)
+        question.end_date = now + datetime.timedelta(days=40)
+        question.save()
+        closing = create_question(question_text="Past question.", days=-5)
+        closing.end_date = now + datetime.timedelta(days=2)
+        closing.save()
+        self.assertEqual(next_boundary(now), closing.end_date)
+
+    def test_index_invalidated_by_opening(self):
+        """A question opened by the lifecycle scheduler is shown by the cached index."""
+        question = create_question(question_text="Future question.", days=30)
+        self.assertNotContains(self.client.get(reverse("polls:index")), "Future question.")
+        move_status(question.id, question.pub_date + datetime.timedelta(seconds=1))
+        self.assertContains(self.client.get(reverse("polls:index")), "Future question.")
+
+
+@override_settings(INDEX_PAGE_SIZE=2)
+class QuestionIndexPaginationTests(TestCase):
+    """Test the cursor pages and the status filter of the index."""
+
+    def setUp(self):
+        """Create five published questions, the two newest share their pub_date."""
+        caches['default'].clear()
+        self.questions = [create_question(f"Question {n}.", days=n - 10) for n in range(3)]
+        same_time = self.questions[-1].pub_date + datetime.timedelta(days=1)
+        self.questions += [Question.objects.create(question_text=f"Question {n}.",
+                                                   pub_date=same_time)
+                           for n in range(3, 5)]
+        # newest first, ties broken by the larger id
+        self.questions.reverse()
+
+    def test_cursor_pages(self):
+        """Each page starts after the last question of the page before it, newest first."""
+        response = self.client.get(reverse("polls:index"))
+        self.assertQuerySetEqual(response.context["question_list"], self.questions[:2])
+        self.assertContains(response, f"after={encode_cursor(self.questions[1])}")
+        for start in (2, 4):
+            cursor = encode_cursor(self.questions[start - 1])
+            response = self.client.get(reverse("polls:index") + f"?after={cursor}")
+            self.assertQuerySetEqual(response.context["question_list"],
+                                     self.questions[start:start + 2])
+        self.assertNotContains(response, "after=")
+
+    def test_status_filter(self):
+        """The open and closed filters are applied by the database."""
+        closed = self.questions[0]
+        closed.end_date = timezone.now() - datetime.timedelta(hours=1)
+        closed.save()
+        response = self.client.get(reverse("polls:index") + "?status=closed")
+        self.assertQuerySetEqual(response.context["question_list"], [closed])
+        response = self.client.get(reverse("polls:index") + "?status=open")
+        self.assertNotIn(closed, list(response.context["question_list"]))
+        self.assertTrue(all(q.is_open for q in response.context["question_list"]))
+
+    def test_invalid_cursor(self):
+        """An invalid cursor redirects to the first page."""
+        response = self.client.get(reverse("polls:index") + "?after=invalid")
+        self.assertRedirects(response, reverse("polls:index"))
@@ -0,0 +1,103 @@
+"""Provide test for queued vote ingestion."""
+import tempfile
+from pathlib import Path
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.contrib.auth.models import User
+from polls.models import Question, Vote
+from polls.ingest import flush_journal, get_journal
+
+
+def create_question(question_text):
+    """Create a question with the given 'question_text'."""
+    return Question.objects.create(question_text=question_text)
+
+
+def create_choice(question, choice_num):
+    """
+    Create choice_num choices in question.
+
+    choice_text = 1, 2, 3, ... , choice_num
+    """
+    for choice_text in range(1, choice_num+1):
+        question.choice_set.create(choice_text=choice_text)
+
+
+class QueuedVotingTest(TestCase):
+    """Test votes are queued, read back by their user and written in batches."""
+
+    def setUp(self):
+        """Use an empty journal without background worker."""
+        self.directory = tempfile.TemporaryDirectory()
+        settings = override_settings(
+            VOTE_INGESTION="queue",
+            VOTE_INGESTION_WORKER=False,
+            VOTE_JOURNAL_PATH=str(Path(self.directory.name) / "journal.sqlite3"),
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.addCleanup(self.directory.cleanup)
+        self.user = User.objects.create_user(username='test', password='1234')
+        self.client.force_login(self.user)
+        self.question = create_question('test_question')
+        create_choice(self.question, 2)
+        self.choice1, self.choice2 = self.question.choice_set.all()
+
+    def vote(self, choice):
+        """Submit a vote of the user."""
+        return self.client.post(reverse('polls:vote', args=[self.question.id]),
+                                {'choice': choice.id})
+
+    def test_vote_is_queued(self):
+        """The vote is not written by the request, but its user sees it on the detail page."""
+        self.vote(self.choice1)
+        self.assertFalse(Vote.objects.exists())
+        self.assertEqual(len(get_journal()), 1)
+        response = self.client.get(reverse('polls:detail', args=[self.question.id]))
+        self.assertEqual(response.context['selected_choice'], self.choice1)
+
+    def test_last_vote_wins(self):
+        """Only the last queued vote of a user is written, with the tallies."""
+        self.vote(self.choice1)
+        self.vote(self.choice2)
+        other = User.objects.create_user(username='other')
+        get_journal().append(other.id, self.question.id, self.choice1.id)
+        # the two votes of the user share a batch and are written as one
+        self.assertEqual(flush_journal(batch_size=2), 2)
+        self.assertEqual(len(get_journal()), 0)
+        self.assertEqual(Vote.objects.get(user=self.user).choice, self.choice2)
+        question = Question.objects.with_results().get(pk=self.question.id)
+        self.assertEqual([choice.votes for choice in question.results], [1, 1])
+        self.assertEqual(question.total_votes, 2)
+
+    def test_withdraw_is_queued(self):
+        """A queued withdraw removes the written vote and its tally."""
+        self.vote(self.choice1)
+        flush_journal()
+        self.client.post(reverse('polls:delete_vote', args=[self.question.id]))
+        response = self.client.get(reverse('polls:detail', args=[self.question.id]))
+        self.assertIsNone(response.context['selected_choice'])
+        flush_journal()
+        self.assertFalse(Vote.objects.exists())
+        self.question.refresh_from_db()
+        self.assertEqual(self.question.total_votes, 0)
+
+    def test_vote_of_deleted_user_dropped(self):
+        """A queued vote of a removed user is dropped, the later votes are still written."""
+        other = User.objects.create_user(username='other')
+        get_journal().append(other.id, self.question.id, self.choice1.id)
+        other.delete()
+        self.vote(self.choice2)
+        self.assertEqual(flush_journal(), 1)
+        self.assertEqual(len(get_journal()), 0)
+        self.assertEqual(Vote.objects.get().choice, self.choice2)
+
+    def test_one_writer(self):
+        """Nothing is written while another worker holds the writer lease."""
+        self.vote(self.choice1)
+        journal = get_journal()
+        self.assertTrue(journal.acquire_writer('other-process'))
+        self.assertEqual(flush_journal(), 0)
+        self.assertEqual(len(journal), 1)
+        journal.release_writer('other-process')
+        self.assertEqual(flush_journal(), 1)
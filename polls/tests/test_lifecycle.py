@@ -0,0 +1,156 @@
+"""Provide test for the lifecycle scheduler opening and closing the questions."""
+import datetime
+from io import StringIO
+from unittest import mock
+from django.core.management import call_command
+from django.db import IntegrityError
+from django.test import TestCase
+from django.utils import timezone
+from polls.lifecycle import CLOSE, FREEZE, OPEN, LifecycleScheduler, move_status
+from polls.models import Question, ResultsSnapshot
+from polls.signals import question_status_changed
+
+
+def create_question(question_text, days, end_days=None):
+    """Create a question published `days` from now that ends `end_days` from now."""
+    now = timezone.now()
+    end_date = None if end_days is None else now + datetime.timedelta(days=end_days)
+    return Question.objects.create(question_text=question_text,
+                                   pub_date=now + datetime.timedelta(days=days),
+                                   end_date=end_date)
+
+
+class QuestionStatusTest(TestCase):
+    """Test the status stored when a question is saved."""
+
+    def test_status_of_dates(self):
+        """The status is given by the dates when the question is saved."""
+        self.assertEqual(create_question("future", 1).status, Question.Status.SCHEDULED)
+        self.assertEqual(create_question("open", -1).status, Question.Status.OPEN)
+        self.assertEqual(create_question("closed", -2, -1).status, Question.Status.CLOSED)
+
+    def test_pages_read_status(self):
+        """can_vote() and the filters use the stored status, not the dates."""
+        question = create_question("open", -1)
+        Question.objects.filter(pk=question.pk).update(status=Question.Status.CLOSED)
+        question.refresh_from_db()
+        self.assertFalse(question.can_vote())
+        self.assertTrue(question.is_published())
+        self.assertQuerySetEqual(Question.objects.closed(), [question])
+
+    def test_status_mismatch(self):
+        """status_mismatch() finds the questions whose date was reached."""
+        question = create_question("future", 1)
+        self.assertFalse(Question.objects.status_mismatch().exists())
+        later = timezone.now() + datetime.timedelta(days=2)
+        self.assertQuerySetEqual(Question.objects.status_mismatch(later), [question])
+
+
+class LifecycleSchedulerTest(TestCase):
+    """Test the scheduler moves the status and freezes the closed questions on time."""
+
+    def setUp(self):
+        """Record the status changes sent."""
+        self.changes = []
+        question_status_changed.connect(self.record)
+        self.addCleanup(question_status_changed.disconnect, self.record)
+
+    def record(self, sender, question_id, status, old_status, **kwargs):
+        """Keep a sent status change."""
+        self.changes.append((question_id, status, old_status))
+
+    def test_heap_order(self):
+        """The events are kept in time order, each one once."""
+        now = timezone.now()
+        question = create_question("soon", 1, 2)
+        scheduler = LifecycleScheduler(reload_interval=3 * 24 * 3600)
+        scheduler.schedule(question, now)
+        scheduler.schedule(question, now)
+        self.assertEqual(len(scheduler), 3)
+        self.assertEqual(scheduler.next_due(), question.pub_date)
+        self.assertEqual(scheduler.heap[0][2], OPEN)
+        self.assertEqual(sorted(kind for when, _, kind in scheduler.heap), [CLOSE, FREEZE, OPEN])
+
+    def test_events_outside_horizon(self):
+        """Only the events before the next load are kept."""
+        create_question("far", 30)
+        scheduler = LifecycleScheduler(reload_interval=60)
+        scheduler.load()
+        self.assertEqual(len(scheduler), 0)
+
+    def test_open_and_close(self):
+        """The status moves when pub_date and end_date pass, one signal per move."""
+        question = create_question("soon", 1, 2)
+        scheduler = LifecycleScheduler(reload_interval=3 * 24 * 3600, freeze_grace=None)
+        scheduler.load()
+        self.assertEqual(scheduler.run_due(), 0)
+        self.assertEqual(scheduler.run_due(question.pub_date + datetime.timedelta(seconds=1)), 1)
+        question.refresh_from_db()
+        self.assertTrue(question.can_vote())
+        self.assertEqual(scheduler.run_due(question.end_date + datetime.timedelta(seconds=1)), 1)
+        question.refresh_from_db()
+        self.assertEqual(question.status, Question.Status.CLOSED)
+        self.assertEqual(self.changes, [
+            (question.id, Question.Status.OPEN, Question.Status.SCHEDULED),
+            (question.id, Question.Status.CLOSED, Question.Status.OPEN),
+        ])
+        self.assertEqual(len(scheduler), 0)
+
+    def test_move_once(self):
+        """A status already moved, e.g. by another process, does not send the signal again."""
+        question = create_question("soon", 1)
+        later = question.pub_date + datetime.timedelta(seconds=1)
+        self.assertEqual(move_status(question.id, later), Question.Status.OPEN)
+        self.assertIsNone(move_status(question.id, later))
+        self.assertEqual(len(self.changes), 1)
+
+    def test_catch_up(self):
+        """Loading moves the statuses missed while no scheduler ran."""
+        question = create_question("open", -1)
+        Question.objects.filter(pk=question.pk).update(status=Question.Status.SCHEDULED)
+        LifecycleScheduler(freeze_grace=None).load()
+        question.refresh_from_db()
+        self.assertEqual(question.status, Question.Status.OPEN)
+
+    def test_freeze_after_grace(self):
+        """A closed question is frozen freeze_grace seconds after its end_date."""
+        question = create_question("closing", -1, 1)
+        question.choice_set.create(choice_text="1")
+        scheduler = LifecycleScheduler(reload_interval=3 * 24 * 3600, freeze_grace=60)
+        scheduler.load()
+        scheduler.run_due(question.end_date + datetime.timedelta(seconds=30))
+        self.assertFalse(ResultsSnapshot.objects.filter(question=question).exists())
+        scheduler.run_due(question.end_date + datetime.timedelta(seconds=61))
+        self.assertTrue(ResultsSnapshot.objects.filter(question=question).exists())
+
+    def test_load_survives_concurrent_freeze(self):
+        """A question frozen by another process does not stop the load of the next events."""
+        create_question("closed", -3, -2)
+        upcoming = create_question("soon", 1, 2)
+        scheduler = LifecycleScheduler(reload_interval=3 * 24 * 3600, freeze_grace=60)
+        with mock.patch("polls.snapshots.freeze_question", side_effect=IntegrityError):
+            scheduler.load()
+        self.assertEqual(scheduler.next_due(), upcoming.pub_date)
+
+    def test_saved_question_rescheduled(self):
+        """A stale event of an edited question does not move its status."""
+        question = create_question("soon", 1)
+        scheduler = LifecycleScheduler(reload_interval=3 * 24 * 3600)
+        scheduler.schedule(question)
+        question.pub_date = timezone.now() + datetime.timedelta(days=2)
+        question.save()
+        scheduler.schedule(question)
+        scheduler.run_due(timezone.now() + datetime.timedelta(days=1, hours=1))
+        question.refresh_from_db()
+        self.assertEqual(question.status, Question.Status.SCHEDULED)
+        self.assertEqual(scheduler.next_due(), question.pub_date)
+
+    def test_command_once(self):
+        """run_lifecycle --once applies the missed transitions."""
+        question = create_question("open", -1)
+        Question.objects.filter(pk=question.pk).update(status=Question.Status.SCHEDULED)
+        out = StringIO()
+        call_command("run_lifecycle", "--once", stdout=out)
+        question.refresh_from_db()
+        self.assertEqual(question.status, Question.Status.OPEN)
+        self.assertIn("Applied", out.getvalue())
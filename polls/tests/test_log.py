@@ -0,0 +1,71 @@
+"""Provide test for the logging handlers."""
+import json
+import logging
+import tempfile
+from pathlib import Path
+from django.test import SimpleTestCase
+from polls.log import JsonFormatter, QueueFileHandler, SampleFilter
+
+
+def make_record(message, **extra):
+    """Create a polls log record with the extra fields."""
+    record = logging.makeLogRecord({"name": "polls", "levelno": logging.INFO,
+                                    "levelname": "INFO", "msg": message})
+    record.__dict__.update(extra)
+    return record
+
+
+class JsonFormatterTest(SimpleTestCase):
+    """Test the records are formatted as JSON with their fields."""
+
+    def test_extra_fields(self):
+        """The message and the extra fields are in the JSON object."""
+        record = make_record("User %s voted", event="vote", question_id=3)
+        record.args = ("demo",)
+        data = json.loads(JsonFormatter().format(record))
+        self.assertEqual(data["message"], "User demo voted")
+        self.assertEqual(data["event"], "vote")
+        self.assertEqual(data["question_id"], 3)
+        self.assertEqual(data["level"], "INFO")
+
+
+class SampleFilterTest(SimpleTestCase):
+    """Test the high-volume events are sampled."""
+
+    def test_sample(self):
+        """One of every N records of a sampled event is kept, the other events are all kept."""
+        sample = SampleFilter(every={"login_failed": 10})
+        kept = [sample.filter(make_record("failed", event="login_failed")) for _ in range(25)]
+        self.assertEqual(kept.count(True), 3)
+        self.assertTrue(all(sample.filter(make_record("vote", event="vote")) for _ in range(5)))
+
+
+class QueueFileHandlerTest(SimpleTestCase):
+    """Test the queued records are written and rotated by the listener."""
+
+    def setUp(self):
+        """Log to a file in a temporary directory."""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = Path(directory.name) / "polls.log"
+
+    def test_write_json_lines(self):
+        """The records are written as JSON lines once the handler is closed."""
+        handler = QueueFileHandler(self.path, batch_size=4)
+        handler.setFormatter(JsonFormatter())
+        for n in range(10):
+            handler.handle(make_record(f"vote {n}", event="vote"))
+        handler.close()
+        lines = self.path.read_text().splitlines()
+        self.assertEqual([json.loads(line)["message"] for line in lines],
+                         [f"vote {n}" for n in range(10)])
+
+    def test_rotate(self):
+        """The file is rotated when it would exceed max_bytes."""
+        handler = QueueFileHandler(self.path, max_bytes=200, backup_count=2)
+        handler.setFormatter(JsonFormatter())
+        for n in range(10):
+            handler.handle(make_record(f"vote {n}"))
+        handler.close()
+        self.assertTrue(Path(f"{self.path}.1").exists())
+        self.assertLessEqual(self.path.stat().st_size, 200)
@@ -0,0 +1,115 @@
+"""Provide test for the request metrics."""
+from unittest import mock
+from django.core.cache import caches
+from django.db import DatabaseError
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.contrib.auth.models import User
+from polls import views
+from polls.metrics import QueryBudgetExceeded, registry
+from polls.models import Question
+
+
+def create_question(question_text):
+    """Create a question with the given 'question_text'."""
+    return Question.objects.create(question_text=question_text)
+
+
+def create_choice(question, choice_num):
+    """
+    Create choice_num choices in question.
+
+    choice_text = 1, 2, 3, ... , choice_num
+    """
+    for choice_text in range(1, choice_num+1):
+        question.choice_set.create(choice_text=choice_text)
+
+
+class RequestMetricsTest(TestCase):
+    """Test the queries and timings of each view are recorded."""
+
+    def setUp(self):
+        """Start from empty metrics and caches."""
+        caches['results'].clear()
+        registry.reset()
+        self.question = create_question('test_question')
+        create_choice(self.question, 2)
+
+    def test_view_metrics(self):
+        """The queries, database and template time of a view are recorded."""
+        self.client.get(reverse('polls:results', args=[self.question.id]))
+        stats = registry.snapshot()['polls:results']
+        self.assertEqual(stats['count'], 1)
+        self.assertEqual(stats['statuses'], {200: 1})
+        self.assertEqual(stats['queries'], 2)
+        self.assertGreater(stats['db_time'], 0)
+        self.assertGreater(stats['template_time'], 0)
+        self.assertEqual(stats['over_budget'], 0)
+
+    @override_settings(ROOT_URLCONF="polls.tests.async_urls")
+    async def test_async_view_metrics(self):
+        """The queries of an async view, run in worker threads, are recorded."""
+        await self.async_client.get(reverse('polls:results', args=[self.question.id]))
+        self.assertEqual(registry.snapshot()['polls:results']['queries'], 2)
+
+    @override_settings(METRICS_ALLOWED_IPS=['127.0.0.1'])
+    def test_metrics_endpoint(self):
+        """The metrics are rendered for Prometheus with the cache statistics."""
+        self.client.get(reverse('polls:results', args=[self.question.id]))
+        response = self.client.get(reverse('polls:metrics'))
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4')
+        self.assertContains(response, 'polls_requests_total{view="polls:results",status="200"} 1')
+        self.assertContains(response, 'polls_db_queries_total{view="polls:results"} 2')
+        self.assertContains(response, 'polls_cache_requests_total{cache="results",result="miss"}')
+
+    def test_metrics_endpoint_access(self):
+        """Only the allowed addresses and the staff can read the metrics."""
+        url = reverse('polls:metrics')
+        self.assertEqual(self.client.get(url, REMOTE_ADDR='10.0.0.1').status_code, 403)
+        # a client forwarded by a proxy on the same host is not the host
+        with override_settings(METRICS_ALLOWED_IPS=['127.0.0.1'], TRUSTED_PROXIES=['127.0.0.1']):
+            self.assertEqual(self.client.get(url, HTTP_X_FORWARDED_FOR='1.2.3.4').status_code,
+                             403)
+            self.assertEqual(self.client.get(url).status_code, 200)
+        staff = User.objects.create_user(username='staff', password='1234', is_staff=True)
+        self.client.force_login(staff)
+        self.assertEqual(self.client.get(url, REMOTE_ADDR='10.0.0.1').status_code, 200)
+
+
+class QueryBudgetTest(TestCase):
+    """Test a view over its query budget fails the test or is counted."""
+
+    def setUp(self):
+        """Create a question, the results page sends two queries."""
+        caches['results'].clear()
+        registry.reset()
+        self.url = reverse('polls:results', args=[create_question('test_question').id])
+
+    @mock.patch.object(views.ResultsView, 'query_budget', 1)
+    def test_over_budget_raises(self):
+        """A view over its budget raises in the tests."""
+        with self.assertRaises(QueryBudgetExceeded):
+            self.client.get(self.url)
+
+    @override_settings(QUERY_BUDGET_RAISE=False)
+    @mock.patch.object(views.ResultsView, 'query_budget', 1)
+    def test_over_budget_counted(self):
+        """Without QUERY_BUDGET_RAISE the request is served and counted."""
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        self.assertEqual(registry.snapshot()['polls:results']['over_budget'], 1)
+
+
+class HealthTest(TestCase):
+    """Test the health check of the database."""
+
+    def test_healthy(self):
+        """The health check answers ok with one query."""
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('polls:health'))
+        self.assertContains(response, "ok")
+
+    def test_database_down(self):
+        """The health check answers 503 when the database does not answer."""
+        with mock.patch.object(views.connection, "cursor", side_effect=DatabaseError("down")):
+            response = self.client.get(reverse('polls:health'))
+        self.assertEqual(response.status_code, 503)
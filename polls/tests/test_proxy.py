@@ -0,0 +1,151 @@
+"""Provide test for the reverse proxy caching of the pages."""
+import datetime
+from unittest import mock
+from django.core.cache import caches
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from django.contrib.auth.models import User
+from polls import proxy
+from polls.models import Question, cast_vote
+from polls.signals import purge_pages
+
+
+def create_question(question_text, days=-1):
+    """Create a question published `days` from now."""
+    return Question.objects.create(question_text=question_text,
+                                   pub_date=timezone.now() + datetime.timedelta(days=days))
+
+
+def create_choice(question, choice_num):
+    """
+    Create choice_num choices in question.
+
+    choice_text = 1, 2, 3, ... , choice_num
+    """
+    for choice_text in range(1, choice_num+1):
+        question.choice_set.create(choice_text=choice_text)
+
+
+class AnonymousPageTest(TestCase):
+    """Test the pages of anonymous visitors are public and the others private."""
+
+    def setUp(self):
+        """Create a question with two choices, start from empty caches."""
+        caches['results'].clear()
+        caches['default'].clear()
+        self.question = create_question('test_question')
+        create_choice(self.question, 2)
+        self.user = User.objects.create_user(username='tester', password='Test1234')
+
+    def page_urls(self):
+        """Return the urls of the cached pages."""
+        return [reverse('polls:index'),
+                reverse('polls:detail', args=[self.question.id]),
+                reverse('polls:results', args=[self.question.id])]
+
+    @override_settings(PAGE_CACHE_S_MAXAGE=120)
+    def test_anonymous_pages_public(self):
+        """An anonymous page is public, varies on Cookie and sets no cookie."""
+        for url in self.page_urls():
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('public', response['Cache-Control'])
+            self.assertIn('s-maxage=120', response['Cache-Control'])
+            self.assertIn('Cookie', response['Vary'])
+            self.assertEqual(response.cookies, {})
+
+    def test_surrogate_keys(self):
+        """The pages are tagged with the keys purged when they change."""
+        question_id = self.question.id
+        self.assertEqual(self.client.get(reverse('polls:index'))['Surrogate-Key'],
+                         'polls index')
+        self.assertEqual(self.client.get(reverse('polls:detail', args=[question_id]))
+                         ['Surrogate-Key'], f'polls question-{question_id}')
+        self.assertEqual(self.client.get(reverse('polls:results', args=[question_id]))
+                         ['Surrogate-Key'], f'polls question-{question_id} results-{question_id}')
+
+    def test_anonymous_detail_without_token(self):
+        """The vote form of an anonymous page has an empty token, loaded apart."""
+        response = self.client.get(reverse('polls:detail', args=[self.question.id]))
+        self.assertContains(response, 'name="csrfmiddlewaretoken" value=""')
+        self.assertContains(response, reverse('polls:session'))
+
+    def test_logged_in_pages_private(self):
+        """The pages of a logged in user are private, without surrogate keys."""
+        self.client.force_login(self.user)
+        for url in self.page_urls():
+            response = self.client.get(url)
+            self.assertIn('private', response['Cache-Control'])
+            self.assertNotIn('public', response['Cache-Control'])
+            self.assertFalse(response.has_header('Surrogate-Key'))
+        response = self.client.get(reverse('polls:detail', args=[self.question.id]))
+        self.assertNotContains(response, 'value=""')
+
+    def test_pending_messages_private(self):
+        """A visitor with messages to show gets a private page with the messages."""
+        self.client.get(reverse('polls:detail', args=[9999]))
+        response = self.client.get(reverse('polls:index'))
+        self.assertIn('private', response['Cache-Control'])
+        self.assertContains(response, 'Question not found')
+
+    def test_session_state(self):
+        """The session state has the CSRF token and is never cached."""
+        response = self.client.get(reverse('polls:session'))
+        data = response.json()
+        self.assertFalse(data['authenticated'])
+        self.assertTrue(data['csrf_token'])
+        self.assertEqual(data['messages'], [])
+        self.assertIn('no-cache', response['Cache-Control'])
+
+
+class PurgeTest(TestCase):
+    """Test the changed pages are purged from the reverse proxy."""
+
+    def setUp(self):
+        """Create a question with two choices, collect the purged keys."""
+        self.question = create_question('test_question')
+        create_choice(self.question, 2)
+        self.choice = self.question.choice_set.first()
+        self.user = User.objects.create_user(username='tester', password='Test1234')
+        self.purged = []
+        purge_pages.connect(self.collect)
+        self.addCleanup(purge_pages.disconnect, self.collect)
+
+    def collect(self, sender, keys, **kwargs):
+        """Keep the keys of a purge."""
+        self.purged.extend(keys)
+
+    def test_vote_purges_results(self):
+        """A vote purges the results page when its transaction commits."""
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            cast_vote(self.user, self.question, self.choice)
+        self.assertEqual(self.purged, [])
+        for callback in callbacks:
+            callback()
+        self.assertIn(f'results-{self.question.id}', self.purged)
+        self.assertNotIn('index', self.purged)
+
+    def test_question_change_purges_pages(self):
+        """An edited question purges its pages and the index."""
+        with self.captureOnCommitCallbacks(execute=True):
+            self.question.question_text = 'edited'
+            self.question.save()
+        self.assertIn(f'question-{self.question.id}', self.purged)
+        self.assertIn('index', self.purged)
+
+    @override_settings(PAGE_PURGE_URL='http://proxy.local/')
+    def test_send_purge(self):
+        """The keys are sent to the proxy in one PURGE request."""
+        with mock.patch('urllib.request.urlopen') as urlopen:
+            proxy.send_purge({'question-2', 'index'})
+        request = urlopen.call_args.args[0]
+        self.assertEqual(request.full_url, 'http://proxy.local/')
+        self.assertEqual(request.get_method(), 'PURGE')
+        self.assertEqual(request.get_header('Surrogate-key'), 'index question-2')
+
+    def test_no_purge_url(self):
+        """Without PAGE_PURGE_URL no purger is started."""
+        with mock.patch.object(proxy, 'Purger') as purger:
+            proxy.queue_purge(None, keys=('index',))
+        purger.assert_not_called()
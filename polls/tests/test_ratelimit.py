@@ -0,0 +1,152 @@
+"""Provide test for the rate limits of the vote and signup views."""
+from unittest import mock
+from django.core.cache import caches
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.contrib.auth.models import User
+from polls.metrics import metrics_text
+from polls.models import Question, Vote
+from polls.ratelimit import LocalBuckets, get_buckets, parse_rate, rate_limit_stats
+from polls.views import get_client_ip
+
+
+def create_question(question_text):
+    """Create a question with the given 'question_text'."""
+    return Question.objects.create(question_text=question_text)
+
+
+def create_choice(question, choice_num):
+    """
+    Create choice_num choices in question.
+
+    choice_text = 1, 2, 3, ... , choice_num
+    """
+    for choice_text in range(1, choice_num+1):
+        question.choice_set.create(choice_text=choice_text)
+
+
+RATE_LIMITS = {"vote": {"ip": "", "user": "2/m"}, "signup": {"ip": "1/h"}}
+
+
+class TokenBucketTest(SimpleTestCase):
+    """Test the token buckets."""
+
+    def test_parse_rate(self):
+        """A rate is a number of tokens per period."""
+        self.assertEqual(parse_rate("30/m"), (30, 60))
+        self.assertEqual(parse_rate("10/h"), (10, 3600))
+        self.assertIsNone(parse_rate(""))
+
+    @mock.patch("polls.ratelimit.time.monotonic")
+    def test_burst_and_refill(self, monotonic):
+        """A bucket allows a burst of its size, then one token per refill interval."""
+        buckets = LocalBuckets()
+        monotonic.return_value = 100.0
+        self.assertEqual([buckets.hit("a", 2, 60)[0] for _ in range(3)], [True, True, False])
+        allowed, retry = buckets.hit("a", 2, 60)
+        self.assertFalse(allowed)
+        self.assertAlmostEqual(retry, 30.0)
+        # another key has its own bucket
+        self.assertTrue(buckets.hit("b", 2, 60)[0])
+        monotonic.return_value = 130.0
+        self.assertTrue(buckets.hit("a", 2, 60)[0])
+        self.assertFalse(buckets.hit("a", 2, 60)[0])
+
+    def test_least_recently_used_dropped(self):
+        """The store keeps at most max_buckets buckets."""
+        buckets = LocalBuckets(max_buckets=2)
+        for key in "abc":
+            buckets.hit(key, 1, 60)
+        self.assertEqual(list(buckets.buckets), ["b", "c"])
+
+
+@override_settings(RATE_LIMIT_ENABLED=True, RATE_LIMITS=RATE_LIMITS)
+class RateLimitViewTest(TestCase):
+    """Test the vote and signup views reject the requests over their rate."""
+
+    def setUp(self):
+        """Refill the buckets, create a user and a question with two choices."""
+        get_buckets().clear()
+        caches['results'].clear()
+        self.user = User.objects.create_user(username='test', password='1234')
+        self.question = create_question('test_question')
+        create_choice(self.question, 2)
+        self.choice = self.question.choice_set.first()
+        self.url = reverse('polls:vote', args=[self.question.id])
+
+    def test_vote_user_rate(self):
+        """The third vote within a minute is rejected before the view reads the question."""
+        self.client.force_login(self.user)
+        limited = rate_limit_stats().get(("vote", "user", "limited"), 0)
+        for _ in range(2):
+            response = self.client.post(self.url, {'choice': self.choice.id})
+            self.assertEqual(response.status_code, 302)
+        # the session and the user only
+        with self.assertNumQueries(2):
+            response = self.client.post(self.url, {'choice': self.choice.id})
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Retry-After"], "30")
+        self.assertEqual(Vote.objects.count(), 1)
+        self.assertEqual(rate_limit_stats()[("vote", "user", "limited")], limited + 1)
+        self.assertIn('polls_rate_limit_requests_total{scope="vote",key="user",'
+                      f'result="limited"}} {limited + 1}', metrics_text())
+
+    def test_other_user_not_limited(self):
+        """The bucket of a user does not limit another user."""
+        self.client.force_login(self.user)
+        for _ in range(3):
+            self.client.post(self.url, {'choice': self.choice.id})
+        other = User.objects.create_user(username='other', password='1234')
+        self.client.force_login(other)
+        response = self.client.post(self.url, {'choice': self.choice.id})
+        self.assertEqual(response.status_code, 302)
+
+    def test_signup_ip_rate(self):
+        """A second signup from the same address is rejected without a query."""
+        form_data = {"username": "new_user", "password1": "kupolls-secret-77",
+                     "password2": "kupolls-secret-77"}
+        self.client.post(reverse("polls:signup"), form_data)
+        self.client.logout()
+        form_data["username"] = "another_user"
+        with self.assertNumQueries(0):
+            response = self.client.post(reverse("polls:signup"), form_data,
+                                        REMOTE_ADDR="127.0.0.1")
+        self.assertEqual(response.status_code, 429)
+        # another address has its own bucket
+        response = self.client.post(reverse("polls:signup"), form_data, REMOTE_ADDR="10.0.0.2")
+        self.assertRedirects(response, reverse("polls:index"))
+
+    def test_forwarded_for_not_trusted(self):
+        """A client can not pick its bucket with X-Forwarded-For."""
+        form_data = {"username": "new_user", "password1": "kupolls-secret-77",
+                     "password2": "kupolls-secret-77"}
+        self.client.post(reverse("polls:signup"), form_data, HTTP_X_FORWARDED_FOR="10.0.0.3")
+        self.client.logout()
+        form_data["username"] = "another_user"
+        response = self.client.post(reverse("polls:signup"), form_data,
+                                    HTTP_X_FORWARDED_FOR="10.0.0.4")
+        self.assertEqual(response.status_code, 429)
+
+    @override_settings(TRUSTED_PROXIES=["10.0.0.1"])
+    def test_forwarded_for_of_trusted_proxy(self):
+        """Behind a trusted proxy the address added by the proxy is the client."""
+        request = RequestFactory().get("/", REMOTE_ADDR="10.0.0.1",
+                                       HTTP_X_FORWARDED_FOR="1.2.3.4, 10.0.0.5, 10.0.0.1")
+        self.assertEqual(get_client_ip(request), "10.0.0.5")
+        request = RequestFactory().get("/", REMOTE_ADDR="10.0.0.9",
+                                       HTTP_X_FORWARDED_FOR="10.0.0.5")
+        self.assertEqual(get_client_ip(request), "10.0.0.9")
+
+    def test_get_not_limited(self):
+        """The pages read by GET do not take tokens."""
+        for _ in range(3):
+            response = self.client.get(reverse("polls:signup"))
+            self.assertEqual(response.status_code, 200)
+
+    @override_settings(ROOT_URLCONF="polls.tests.async_urls")
+    async def test_async_vote_user_rate(self):
+        """The async vote view has the same limits."""
+        await self.async_client.aforce_login(self.user)
+        statuses = [(await self.async_client.post(self.url, {'choice': self.choice.id}))
+                    .status_code for _ in range(3)]
+        self.assertEqual(statuses, [302, 302, 429])
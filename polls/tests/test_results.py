@@ -0,0 +1,87 @@
+"""Provide test for results page."""
+from django.core.cache import caches
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.contrib.auth.models import User
+from polls.models import Question
+from polls.cache import cache_stats
+
+
+def create_question(question_text):
+    """Create a question with the given 'question_text'."""
+    return Question.objects.create(question_text=question_text)
+
+
+def create_choice(question, choice_num):
+    """
+    Create choice_num choices in question.
+
+    choice_text = 1, 2, 3, ... , choice_num
+    """
+    for choice_text in range(1, choice_num+1):
+        question.choice_set.create(choice_text=choice_text)
+
+
+class QuestionResultsViewTests(TestCase):
+    """Test Results view response correctly."""
+
+    def setUp(self):
+        """Start every test with an empty results cache."""
+        caches['results'].clear()
+
+    def count_queries(self, url):
+        """Return the number of queries used to render the url."""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_results_percentage(self):
+        """The results page shows the votes and percentage of each choice."""
+        question = create_question('test_question')
+        create_choice(question, 2)
+        user = User.objects.create_user(username='test', password='1234')
+        self.client.force_login(user)
+        self.client.post(reverse('polls:vote', args=[question.id]),
+                         {'choice': question.choice_set.first().id})
+        response = self.client.get(reverse('polls:results', args=[question.id]))
+        self.assertEqual([c['percentage'] for c in response.context['question']['results']],
+                         [100.0, 0.0])
+        self.assertContains(response, '100.0%')
+
+    def test_constant_query_count(self):
+        """The number of queries for results and detail pages does not grow with the choices."""
+        small = create_question('small question')
+        create_choice(small, 2)
+        large = create_question('large question')
+        create_choice(large, 25)
+        for name in ('polls:results', 'polls:detail'):
+            self.assertEqual(self.count_queries(reverse(name, args=[small.id])),
+                             self.count_queries(reverse(name, args=[large.id])))
+
+    def test_non_existent_question(self):
+        """The results page of a non-existent question returns 404."""
+        response = self.client.get(reverse('polls:results', args=[1234]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_results_cached_until_vote(self):
+        """The results are served from the cache until a vote changes them."""
+        question = create_question('test_question')
+        create_choice(question, 2)
+        url = reverse('polls:results', args=[question.id])
+        before = cache_stats()
+        self.client.get(url)
+        self.assertEqual(self.count_queries(url), 0)
+        after = cache_stats()
+        self.assertEqual(after['results_misses'] - before['results_misses'], 1)
+        self.assertEqual(after['results_hits'] - before['results_hits'], 1)
+
+        user = User.objects.create_user(username='test', password='1234')
+        self.client.force_login(user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('polls:vote', args=[question.id]),
+                             {'choice': question.choice_set.first().id})
+        response = self.client.get(url)
+        self.assertEqual(response.context['question']['total_votes'], 1)
@@ -0,0 +1,118 @@
+"""Provide test for the results snapshots of closed questions."""
+import datetime
+from io import StringIO
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.contrib.auth.models import User
+from polls.cache import get_results
+from polls.models import ArchivedVote, Question, ResultsSnapshot, Vote, cast_vote
+from polls.snapshots import freeze_closed_questions
+
+
+def create_question(question_text, days):
+    """Create a question published 10 days ago that ends in `days` days."""
+    now = timezone.now()
+    return Question.objects.create(question_text=question_text,
+                                   pub_date=now - datetime.timedelta(days=10),
+                                   end_date=now + datetime.timedelta(days=days))
+
+
+def create_choice(question, choice_num):
+    """
+    Create choice_num choices in question.
+
+    choice_text = 1, 2, 3, ... , choice_num
+    """
+    for choice_text in range(1, choice_num+1):
+        question.choice_set.create(choice_text=choice_text)
+
+
+class ResultsSnapshotTest(TestCase):
+    """Test the results of closed questions are frozen and archived."""
+
+    def setUp(self):
+        """Create a question with two votes, then close it."""
+        caches['results'].clear()
+        self.question = create_question('closed', days=1)
+        create_choice(self.question, 2)
+        self.choice = self.question.choice_set.first()
+        for n in range(2):
+            cast_vote(User.objects.create_user(username=f'user{n}'), self.question, self.choice)
+        self.question.end_date = timezone.now() - datetime.timedelta(days=1)
+        self.question.save()
+        self.open_question = create_question('open', days=1)
+
+    def freeze(self, *args):
+        """Run the freeze_results command."""
+        call_command("freeze_results", *args, stdout=StringIO())
+
+    def test_freeze_closed_questions(self):
+        """Only the closed question gets a snapshot of its results."""
+        self.freeze()
+        snapshot = ResultsSnapshot.objects.get()
+        self.assertEqual(snapshot.question, self.question)
+        self.assertEqual(snapshot.payload['total_votes'], 2)
+        self.assertEqual(snapshot.payload['results'][0]['percentage'], 100.0)
+
+    def test_freeze_moves_status_first(self):
+        """A question still stored open, with no scheduler, is closed before it is frozen."""
+        Question.objects.filter(pk=self.question.pk).update(status=Question.Status.OPEN)
+        self.assertEqual(freeze_closed_questions(), (0, 0))
+        self.freeze()
+        self.question.refresh_from_db()
+        self.assertFalse(self.question.can_vote())
+        self.assertEqual(ResultsSnapshot.objects.get().payload['status'], 'closed')
+
+    def test_results_from_snapshot(self):
+        """The results of a frozen question are read without the choices and votes."""
+        self.freeze()
+        url = reverse('polls:results', args=[self.question.id])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.context['question']['total_votes'], 2)
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('polls_choice', queries[0]['sql'])
+
+    def test_archive_votes(self):
+        """The votes move to the archive, the results and tallies stay."""
+        self.freeze('--archive-votes')
+        self.assertFalse(Vote.objects.filter(question=self.question).exists())
+        self.assertEqual(ArchivedVote.objects.filter(question=self.question).count(), 2)
+        self.assertTrue(ResultsSnapshot.objects.get().votes_archived)
+        self.choice.refresh_from_db()
+        self.assertEqual(self.choice.vote_count, 2)
+        # the archived questions are not reported as drifted
+        call_command("rebuild_vote_counts", "--check", stdout=StringIO())
+
+    def test_reopen_drops_snapshot(self):
+        """A reopened question is served from its tallies again."""
+        self.freeze()
+        self.question.end_date = None
+        self.question.save()
+        self.assertFalse(ResultsSnapshot.objects.exists())
+
+    def test_reopen_restores_archived_votes(self):
+        """The archived votes of a reopened question are votes again, counted once."""
+        self.freeze('--archive-votes')
+        self.question.refresh_from_db()
+        self.question.end_date = None
+        self.question.save()
+        self.assertEqual(Vote.objects.filter(question=self.question).count(), 2)
+        self.assertFalse(ArchivedVote.objects.exists())
+        # a voter changing the restored vote is not counted twice
+        cast_vote(User.objects.get(username='user0'), self.question,
+                  self.question.choice_set.last())
+        self.assertEqual(get_results(self.question.id)['total_votes'], 2)
+        call_command("rebuild_vote_counts", "--check", stdout=StringIO())
+
+    def test_delete_vote_of_closed_question(self):
+        """A vote of a closed question can not be deleted."""
+        self.client.force_login(User.objects.get(username='user0'))
+        response = self.client.post(reverse('polls:delete_vote', args=[self.question.id]))
+        self.assertRedirects(response, reverse('polls:index'))
+        self.assertEqual(Vote.objects.filter(question=self.question).count(), 2)
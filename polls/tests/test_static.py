@@ -0,0 +1,41 @@
+"""Provide test for the static files of the production mode."""
+import tempfile
+from django.conf import settings
+from django.core.management import call_command
+from django.templatetags.static import static
+from django.test import TestCase, override_settings
+
+
+class ProductionAssetsTest(TestCase):
+    """Test the hashed, compressed static files are served with far-future caching."""
+
+    def setUp(self):
+        """Collect the static files of the production storage in a temporary root."""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        storages = {**settings.STORAGES, "staticfiles": {
+            "BACKEND": "whitenoise.storage.CompressedManifestStaticFilesStorage"}}
+        middleware = list(settings.MIDDLEWARE)
+        middleware.insert(middleware.index("django.middleware.security.SecurityMiddleware") + 1,
+                          "whitenoise.middleware.WhiteNoiseMiddleware")
+        production = override_settings(STATIC_ROOT=directory.name, STORAGES=storages,
+                                       MIDDLEWARE=middleware,
+                                       WHITENOISE_AUTOREFRESH=False,
+                                       WHITENOISE_USE_FINDERS=False)
+        production.enable()
+        self.addCleanup(production.disable)
+        call_command("collectstatic", "--noinput", verbosity=0)
+
+    def test_hashed_name(self):
+        """The url of a static file has the hash of its content."""
+        url = static("polls/style.css")
+        self.assertRegex(url, r"^/static/polls/style\.[0-9a-f]{12}\.css$")
+
+    def test_far_future_caching(self):
+        """A hashed file is cached for a year, compressed when the client accepts it."""
+        response = self.client.get(static("polls/style.css"), HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("immutable", response["Cache-Control"])
+        self.assertIn("max-age=315360000", response["Cache-Control"])
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        response.close()
@@ -0,0 +1,95 @@
+"""Provide test for the live results stream."""
+import asyncio
+import datetime
+from asgiref.sync import sync_to_async
+from django.core.cache import caches
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from django.contrib.auth.models import User
+from polls.models import Question, cast_vote
+from polls.streaming import get_broadcaster, results_delta
+
+
+def create_question(question_text):
+    """Create a question with the given 'question_text'."""
+    return Question.objects.create(question_text=question_text)
+
+
+def create_choice(question, choice_num):
+    """
+    Create choice_num choices in question.
+
+    choice_text = 1, 2, 3, ... , choice_num
+    """
+    for choice_text in range(1, choice_num+1):
+        question.choice_set.create(choice_text=choice_text)
+
+
+class ResultsDeltaTest(TestCase):
+    """Test only the changed tallies are sent."""
+
+    def test_results_delta(self):
+        """The delta has the changed choices, None when nothing changed."""
+        old = {"total_votes": 1, "results": [
+            {"id": 1, "choice_text": "a", "votes": 1, "percentage": 100.0},
+            {"id": 2, "choice_text": "b", "votes": 0, "percentage": 0.0},
+        ]}
+        self.assertIsNone(results_delta(old, old))
+        new = {"total_votes": 2, "results": [
+            old["results"][0] | {"percentage": 50.0},
+            old["results"][1] | {"votes": 1, "percentage": 50.0},
+        ]}
+        self.assertEqual(results_delta(old, new), {"total_votes": 2, "choices": {
+            1: {"votes": 1, "percentage": 50.0},
+            2: {"votes": 1, "percentage": 50.0},
+        }})
+
+
+@override_settings(RESULTS_STREAM_INTERVAL=0.05)
+class ResultsBroadcasterTest(TestCase):
+    """Test the watchers of a question share one reader."""
+
+    def setUp(self):
+        """Create a user and a question with two choices."""
+        caches['results'].clear()
+        self.user = User.objects.create_user(username='test')
+        self.question = create_question('test_question')
+        create_choice(self.question, 2)
+        self.choice = self.question.choice_set.first()
+
+    async def test_fan_out(self):
+        """Every subscriber gets the delta, the results are read once per tick."""
+        broadcaster = get_broadcaster(self.question.id)
+        subscribers = [(await broadcaster.subscribe())[0] for _ in range(10)]
+        await sync_to_async(cast_vote)(self.user, self.question, self.choice)
+        await asyncio.wait_for(asyncio.gather(*(s.ready.wait() for s in subscribers)), 2)
+        for subscriber in subscribers:
+            self.assertEqual(subscriber.take()["choices"][self.choice.id]["votes"], 1)
+        # one read to subscribe and a few ticks, not one per subscriber and tick
+        self.assertLess(broadcaster.reads, len(subscribers))
+        for subscriber in subscribers:
+            broadcaster.unsubscribe(subscriber)
+        broadcaster.task.cancel()
+
+    def test_stream_under_wsgi(self):
+        """Without async views one results event is sent with a retry interval."""
+        response = self.client.get(reverse('polls:results_stream', args=[self.question.id]))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertContains(response, 'retry: 50')
+        self.assertContains(response, 'event: results')
+
+    def test_no_stream_of_closed_question(self):
+        """A closed question has no stream, the browser does not reconnect."""
+        self.question.end_date = timezone.now() - datetime.timedelta(seconds=1)
+        self.question.save()
+        response = self.client.get(reverse('polls:results_stream', args=[self.question.id]))
+        self.assertEqual(response.status_code, 204)
+
+    def test_results_page_without_stream_under_wsgi(self):
+        """The results page opens the stream only with async views."""
+        url = reverse('polls:results', args=[self.question.id])
+        with override_settings(ASYNC_VIEWS=False):
+            self.assertNotContains(self.client.get(url), 'EventSource')
+        with override_settings(ASYNC_VIEWS=True):
+            self.assertContains(self.client.get(url), 'EventSource')
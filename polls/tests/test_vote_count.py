@@ -0,0 +1,102 @@
+"""Provide test for the stored vote tallies."""
+from io import StringIO
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+from django.urls import reverse
+from django.contrib.auth.models import User
+from polls.models import Question, ChoiceCounterShard, Vote
+
+
+def create_question(question_text):
+    """Create a question with the given 'question_text'."""
+    return Question.objects.create(question_text=question_text)
+
+
+def create_choice(question, choice_num):
+    """
+    Create choice_num choices in question.
+
+    choice_text = 1, 2, 3, ... , choice_num
+    """
+    for choice_text in range(1, choice_num+1):
+        question.choice_set.create(choice_text=choice_text)
+
+
+class VoteCountTest(TestCase):
+    """Test the tallies follow the votes of the users."""
+
+    def setUp(self):
+        """Create a user and a question with two choices."""
+        self.user = User.objects.create_user(username='test', password='1234')
+        self.question = create_question('test_question')
+        create_choice(self.question, 2)
+        self.choice1, self.choice2 = self.question.choice_set.all()
+        self.client.login(username='test', password='1234')
+
+    def assert_tallies(self, first, second):
+        """Assert the stored tallies of both choices and the question total."""
+        self.choice1.refresh_from_db()
+        self.choice2.refresh_from_db()
+        self.question.refresh_from_db()
+        self.assertEqual(self.choice1.votes, first)
+        self.assertEqual(self.choice2.votes, second)
+        self.assertEqual(self.question.total_votes, first + second)
+
+    def test_vote_increase_tally(self):
+        """A new vote adds one to the choice and the question."""
+        self.client.post(reverse('polls:vote', args=[self.question.id]),
+                         {'choice': self.choice1.id})
+        self.assert_tallies(1, 0)
+
+    def test_change_vote_move_tally(self):
+        """Changing the vote moves the tally, voting the same choice again changes nothing."""
+        url = reverse('polls:vote', args=[self.question.id])
+        self.client.post(url, {'choice': self.choice1.id})
+        self.client.post(url, {'choice': self.choice2.id})
+        self.assert_tallies(0, 1)
+        self.client.post(url, {'choice': self.choice2.id})
+        self.assert_tallies(0, 1)
+
+    def test_delete_vote_decrease_tally(self):
+        """Deleting the vote removes it from the tallies."""
+        self.client.post(reverse('polls:vote', args=[self.question.id]),
+                         {'choice': self.choice1.id})
+        self.client.post(reverse('polls:delete_vote', args=[self.question.id]))
+        self.assert_tallies(0, 0)
+
+    def test_rebuild_vote_counts(self):
+        """The command finds the drifted tallies with --check and repairs them."""
+        Vote.objects.create(user=self.user, choice=self.choice2)
+        with self.assertRaises(CommandError):
+            call_command('rebuild_vote_counts', '--check', stdout=StringIO())
+        call_command('rebuild_vote_counts', stdout=StringIO())
+        self.assert_tallies(0, 1)
+        call_command('rebuild_vote_counts', '--check', stdout=StringIO())
+
+
+class ShardedVoteCountTest(VoteCountTest):
+    """Run the tally tests again with the question using counter shards."""
+
+    def setUp(self):
+        """Turn on the counter shards of the question."""
+        super().setUp()
+        self.question.counter_shards = 4
+        self.question.save()
+
+    def assert_tallies(self, first, second):
+        """Assert the tallies as they are read by the results page."""
+        question = Question.objects.with_results().get(pk=self.question.id)
+        self.assertEqual([choice.votes for choice in question.results], [first, second])
+        total = first + second
+        self.assertEqual([choice.percentage for choice in question.results],
+                         [first * 100 / total, second * 100 / total] if total else [0, 0])
+
+    def test_rebuild_fold_shards(self):
+        """Rebuilding moves the shard counts back into the stored tallies."""
+        self.client.post(reverse('polls:vote', args=[self.question.id]),
+                         {'choice': self.choice1.id})
+        Vote.objects.create(user=User.objects.create_user(username='other'), choice=self.choice2)
+        call_command('rebuild_vote_counts', stdout=StringIO())
+        self.assertFalse(ChoiceCounterShard.objects.exists())
+        self.assert_tallies(1, 1)
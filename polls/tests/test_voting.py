@@ -1,6 +1,8 @@
 """Provide test for voting."""
-from django.test import TestCase
-from polls.models import Question
+import threading
+from django.db import IntegrityError, OperationalError, connection
+from django.test import TestCase, TransactionTestCase
+from polls.models import Question, Vote, cast_vote
 from django.urls import reverse
 from django.contrib.auth.models import User
 
@@ -60,3 +62,61 @@ class VotingTest(TestCase):
         self.assertEqual(response.status_code, 302)
         self.assertEqual(choice[0].vote_set.count(), 0)
         self.assertEqual(choice[1].vote_set.count(), 1)
+
+    def test_one_vote_per_question(self):
+        """The database refuses a second vote of a user for the same question."""
+        question = create_question('test_question')
+        create_choice(question, 2)
+        first, second = question.choice_set.all()
+        vote = Vote.objects.create(user=self.user, choice=first)
+        self.assertEqual(vote.question, question)
+        with self.assertRaises(IntegrityError):
+            Vote.objects.create(user=self.user, choice=second)
+
+    def test_vote_query_count(self):
+        """
+        A new vote runs a fixed number of queries.
+
+        session, user, choice with its question, the INSERT ... ON CONFLICT of the
+        vote, the two tally updates and the savepoint pair of the transaction.
+        """
+        question = create_question('test_question')
+        create_choice(question, 2)
+        choice = question.choice_set.first()
+        self.client.login(username='test', password='1234')
+        with self.assertNumQueries(8):
+            self.client.post(reverse('polls:vote', args=[question.id]), {'choice': choice.id})
+
+
+class ConcurrentVotingTest(TransactionTestCase):
+    """Test concurrent submissions of the same user record one vote."""
+
+    def test_concurrent_double_submit(self):
+        """Many threads casting the same vote leave one vote and a tally of one."""
+        user = User.objects.create_user(username='test', password='1234')
+        question = create_question('test_question')
+        create_choice(question, 2)
+        choice = question.choice_set.first()
+        start = threading.Barrier(4)
+
+        def submit():
+            start.wait()
+            while True:
+                try:
+                    cast_vote(user, question, choice)
+                    break
+                except OperationalError:
+                    # SQLite reports a locked database under contention
+                    pass
+            connection.close()
+
+        threads = [threading.Thread(target=submit) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        choice.refresh_from_db()
+        question.refresh_from_db()
+        self.assertEqual(Vote.objects.filter(user=user, question=question).count(), 1)
+        self.assertEqual(choice.votes, 1)
+        self.assertEqual(question.total_votes, 1)
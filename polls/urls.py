@@ -1,12 +1,35 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import api, async_views, views
+from .proxy import public_page
 
 app_name = "polls"
-urlpatterns = [
-    path("", views.IndexView.as_view(), name="index"),
-    path("<int:question_id>/", views.detail, name="detail"),
-    path("<int:pk>/results/", views.ResultsView.as_view(), name="results"),
-    path("<int:question_id>/vote/", views.vote, name="vote"),
-    path("<int:question_id>/vote/delete_vote", views.delete_vote, name="delete_vote"),
-    path('signup/', views.signup, name='signup')
-]
+
+
+def poll_patterns(poll_views):
+    """Return the url patterns with the detail, vote and results views of poll_views."""
+    return [
+        path("", public_page("index")(views.IndexView.as_view()), name="index"),
+        path("<int:question_id>/", public_page("question-{question_id}")(poll_views.detail),
+             name="detail"),
+        path("<int:pk>/results/",
+             public_page("question-{pk}", "results-{pk}")(poll_views.ResultsView.as_view()),
+             name="results"),
+        path("<int:pk>/results/stream/", async_views.results_stream, name="results_stream"),
+        path("<int:question_id>/vote/", poll_views.vote, name="vote"),
+        path("<int:question_id>/vote/delete_vote", poll_views.delete_vote, name="delete_vote"),
+        path('signup/', views.signup, name='signup'),
+        path('metrics/', views.metrics, name='metrics'),
+        path('health/', views.health, name='health'),
+        path('session/', views.session_state, name='session'),
+        path('api/questions/', api.question_list, name='api_questions'),
+        path('api/questions/<int:question_id>/', api.question_detail, name='api_question'),
+        path('api/questions/<int:question_id>/results/', api.question_results,
+             name='api_results'),
+        path('api/questions/<int:question_id>/timeline/', api.question_timeline,
+             name='api_timeline'),
+    ]
+
+
+# the vote and result pages run as async views when served by ASGI
+urlpatterns = poll_patterns(async_views if settings.ASYNC_VIEWS else views)
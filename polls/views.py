@@ -1,16 +1,28 @@
 """Provide class to handle the request."""
+import datetime
+from django.conf import settings
 from django.shortcuts import render, get_object_or_404, redirect
-from django.http import HttpResponseRedirect
+from django.template.loader import render_to_string
+from django.core.exceptions import PermissionDenied
+from django.db import DatabaseError, connection
+from django.http import Http404, HttpResponse, HttpResponseRedirect, JsonResponse
 from django.contrib import messages
-from django.contrib.auth import login, authenticate
+from django.contrib.auth import login
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.signals import user_logged_in, user_logged_out, user_login_failed
 from django.contrib.auth.forms import UserCreationForm
 from django.dispatch import receiver
+from django.middleware.csrf import get_token
 from django.urls import reverse
+from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
 from django.views import generic
-from django.utils import timezone
-from polls.models import Choice, Question, Vote
+from django.views.decorators.cache import never_cache
+from polls.models import Choice, Question, cast_vote, withdraw_vote
+from polls.ingest import current_choice_id, enqueue_vote, queue_enabled
+from polls.cache import get_index_fragment, get_results
+from polls.metrics import metrics_text, query_budget
+from polls.ratelimit import rate_limit
+from polls.streaming import is_live
 import logging
 
 
@@ -18,15 +30,22 @@ logger = logging.getLogger("polls")
 
 
 def get_client_ip(request):
-    """Get the visitor’s IP address using request headers."""
-    if request:
-        x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-        if x_forwarded_for:
-            ip = x_forwarded_for.split(',')[0]
-        else:
-            ip = request.META.get('REMOTE_ADDR')
-    else:
-        ip = 'Unknown'
+    """
+    Get the visitor’s IP address.
+
+    X-Forwarded-For is set by the client unless a proxy replaces it, so it is
+    only read from a request sent by one of TRUSTED_PROXIES. The address is
+    then the nearest one of the header not added by a trusted proxy.
+    """
+    if not request:
+        return 'Unknown'
+    ip = request.META.get('REMOTE_ADDR')
+    if ip in settings.TRUSTED_PROXIES:
+        forwarded = request.META.get('HTTP_X_FORWARDED_FOR', '').split(',')
+        for address in reversed([address.strip() for address in forwarded if address.strip()]):
+            ip = address
+            if address not in settings.TRUSTED_PROXIES:
+                break
     return ip
 
 
@@ -34,14 +53,16 @@ def get_client_ip(request):
 def log_user_login(sender, request, user, **kwargs):
     """Log the message when the user login."""
     ip_addr = get_client_ip(request)
-    logger.info(f"{user.username} logged in from {ip_addr}")
+    logger.info("%s logged in from %s", user.username, ip_addr,
+                extra={"event": "login", "user": user.username, "ip": ip_addr})
 
 
 @receiver(user_logged_out)
 def log_user_logout(sender, request, user, **kwargs):
     """Log the message when the user logout."""
     ip_addr = get_client_ip(request)
-    logger.info(f'{user.username} logged out from {ip_addr}')
+    logger.info("%s logged out from %s", user.username, ip_addr,
+                extra={"event": "logout", "user": user.username, "ip": ip_addr})
 
 
 @receiver(user_login_failed)
@@ -49,7 +70,21 @@ def log_login_failed(sender, credentials, request, **kwargs):
     """Log the message when the user login with incorrect username or password."""
     ip_addr = get_client_ip(request)
     username = credentials.get('username', 'Unknown')
-    logger.warning(f"Failed login attempt for {username} from {ip_addr}")
+    # sampled by the logging config, a brute force attack would flood the log
+    logger.warning("Failed login attempt for %s from %s", username, ip_addr,
+                   extra={"event": "login_failed", "user": username, "ip": ip_addr})
+
+
+def encode_cursor(question):
+    """Return the cursor of the index page starting after the question."""
+    position = f"{question.pub_date.isoformat()}|{question.id}"
+    return urlsafe_base64_encode(position.encode())
+
+
+def decode_cursor(cursor):
+    """Return the (pub_date, id) position of a cursor, raise ValueError if it is invalid."""
+    pub_date, question_id = urlsafe_base64_decode(cursor).decode().split("|")
+    return datetime.datetime.fromisoformat(pub_date), int(question_id)
 
 
 class IndexView(generic.ListView):
@@ -57,40 +92,88 @@ class IndexView(generic.ListView):
 
     template_name = "polls/index.html"
     context_object_name = "question_list"
+    query_budget = 4
+    # status filter => QuestionQuerySet method
+    statuses = {"all": "published", "open": "open", "closed": "closed"}
+
+    def get(self, request, *args, **kwargs):
+        """Read the status filter and the page cursor of the request."""
+        self.status = request.GET.get("status", "all")
+        if self.status not in self.statuses:
+            self.status = "all"
+        self.cursor = request.GET.get("after", "")
+        self.position = None
+        if self.cursor:
+            try:
+                self.position = decode_cursor(self.cursor)
+            except ValueError:
+                messages.error(request, "Page not found")
+                logger.error("Invalid index cursor %s", self.cursor,
+                             extra={"event": "invalid_cursor"})
+                return HttpResponseRedirect(reverse('polls:index'))
+        return super().get(request, *args, **kwargs)
 
     def get_queryset(self):
-        """Return the list of published questions."""
-        return Question.objects.filter(pub_date__lte=timezone.now()).order_by("-pub_date")
+        """Return the published questions of the status, newest first after the cursor."""
+        questions = getattr(Question.objects, self.statuses[self.status])()
+        if self.position:
+            questions = questions.after(*self.position)
+        return questions
+
+    def get_context_data(self, **kwargs):
+        """Add the rendered question list, shared by every user until a poll opens or closes."""
+        context = super().get_context_data(**kwargs)
+        page_size = settings.INDEX_PAGE_SIZE
+        context["question_list"] = self.object_list[:page_size]
+
+        def render_page():
+            # one more question tells whether there is a next page
+            questions = list(self.object_list[:page_size + 1])
+            next_cursor = None
+            if len(questions) > page_size:
+                next_cursor = encode_cursor(questions[page_size - 1])
+            return render_to_string("polls/index_questions.html", {
+                "question_list": questions[:page_size],
+                "status": self.status,
+                "cursor": self.cursor,
+                "next_cursor": next_cursor,
+            })
 
+        context["question_list_html"] = get_index_fragment(f"{self.status}:{self.cursor}",
+                                                           render_page)
+        return context
 
+
+@query_budget(6)
 def detail(request, question_id):
     """Display the choice for a poll and allow voting."""
     try:
-        question = Question.objects.get(pk=question_id)
+        question = Question.objects.with_results().get(pk=question_id)
         # Check if the question is published or not
         if not question.is_published():
             messages.error(request, "Question not found")
-            logger.error(f"Non-existent question {question_id}")
+            logger.error("Non-existent question %s", question_id,
+                         extra={"event": "question_not_found", "question_id": question_id})
             return HttpResponseRedirect(reverse('polls:index'))
         # Check if the question is still in vote session
         if not question.can_vote():
             messages.error(request, "Section closed for voting")
-            logger.error(f"Someone try to vote closed question {question_id}")
+            logger.error("Someone try to vote closed question %s", question_id,
+                         extra={"event": "voting_closed", "question_id": question_id})
             return HttpResponseRedirect(reverse('polls:index'))
     except (KeyError, Question.DoesNotExist):
         messages.error(request, "Question not found")
-        logger.error(f"Non-existent question {question_id} %s")
+        logger.error("Non-existent question %s", question_id,
+                     extra={"event": "question_not_found", "question_id": question_id})
         return HttpResponseRedirect(reverse('polls:index'))
 
     # Get user's vote
     current_user = request.user
     choice = None
     if current_user.is_authenticated:
-        try:
-            vote = Vote.objects.get(user=current_user, choice__question=question)
-            choice = vote.choice
-        except (KeyError, Vote.DoesNotExist):
-            pass
+        # one probe of the (user, question) unique index, or the queued vote
+        choice_id = current_choice_id(current_user, question)
+        choice = next((c for c in question.results if c.id == choice_id), None)
     context = {'question': question, "selected_choice": choice}
     return render(request, 'polls/detail.html', context=context)
 
@@ -98,10 +181,58 @@ def detail(request, question_id):
 class ResultsView(generic.DetailView):
     """Result page, contain result vote from user for questionZz."""
 
-    model = Question
     template_name = "polls/results.html"
+    context_object_name = "question"
+    query_budget = 4
+
+    def get_object(self, queryset=None):
+        """Return the cached results of the question."""
+        results = get_results(self.kwargs["pk"])
+        if results is None:
+            raise Http404("Question not found")
+        return results
 
+    def get_context_data(self, **kwargs):
+        """Add whether the page follows the live results, only an open poll under ASGI."""
+        context = super().get_context_data(**kwargs)
+        context["live_results"] = settings.ASYNC_VIEWS and is_live(self.object)
+        return context
 
+
+def metrics(request):
+    """Return the request and cache metrics of this process for Prometheus."""
+    allowed_ip = get_client_ip(request) in settings.METRICS_ALLOWED_IPS
+    if not (allowed_ip or request.user.is_staff):
+        raise PermissionDenied
+    return HttpResponse(metrics_text(), content_type="text/plain; version=0.0.4")
+
+
+@query_budget(1)
+def health(request):
+    """Return 200 when the database answers, 503 when it does not, for the health checks."""
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1")
+    except DatabaseError:
+        logger.exception("Health check failed", extra={"event": "health_failed"})
+        return HttpResponse("database unavailable", status=503, content_type="text/plain")
+    return HttpResponse("ok", content_type="text/plain")
+
+
+@query_budget(2)
+@never_cache
+def session_state(request):
+    """Return the CSRF token and the messages left out of the pages cached for anonymous users."""
+    return JsonResponse({
+        "authenticated": request.user.is_authenticated,
+        "csrf_token": get_token(request),
+        "messages": [str(message) for message in messages.get_messages(request)],
+    })
+
+
+# a vote change on sharded counters sends the most queries
+@query_budget(16)
+@rate_limit("vote", get_client_ip)
 @login_required
 def vote(request, question_id):
     """
@@ -110,38 +241,43 @@ def vote(request, question_id):
     If user does not select any choice, send back detail page with error message.
     Otherwise, add votes for that choice and send back results page.
     """
-    question = get_object_or_404(Question, pk=question_id)
+    # the selected choice and its question are loaded by one query
+    try:
+        selected_choice = Choice.objects.select_related("question").get(
+            pk=request.POST["choice"], question_id=question_id)
+        question = selected_choice.question
+    except (KeyError, ValueError, Choice.DoesNotExist):
+        selected_choice = None
+        question = get_object_or_404(Question, pk=question_id)
     if not question.can_vote():
         messages.error(request, "Section closed for voting")
-        logger.error(f"User try to vote for closed question {question_id}")
+        logger.error("User try to vote for closed question %s", question_id,
+                     extra={"event": "voting_closed", "question_id": question_id})
         return HttpResponseRedirect(reverse('polls:index'))
-    try:
-        selected_choice = question.choice_set.get(pk=request.POST["choice"])
-    except(KeyError, Choice.DoesNotExist):
+    if selected_choice is None:
         messages.error(request, "You did not select a choice.")
-        logger.error("User did not select the choice to vote.")
+        logger.error("User did not select the choice to vote.", extra={"event": "no_choice"})
         return HttpResponseRedirect(reverse('polls:detail', args=(question.id,)))
 
     # Reference to the current user
     this_user = request.user
-    # Get the user's vote
-    try:
-        vote = Vote.objects.get(user=this_user, choice__question=question)
-        vote.choice = selected_choice
-        vote.save()
-        messages.success(request, f'Your vote was changed to {selected_choice.choice_text}')
-    except (KeyError, Vote.DoesNotExist):
-        # does not have a vote yet
-        Vote.objects.create(user=this_user, choice=selected_choice)
+    if queue_enabled():
+        # written later by the ingest worker, detail() reads it back meanwhile
+        enqueue_vote(this_user, question, selected_choice)
+        messages.success(request, f'Your vote for {selected_choice.choice_text} was recorded')
+    elif cast_vote(this_user, question, selected_choice) is None:
         messages.success(request, f'You voted for {selected_choice.choice_text}')
+    else:
+        messages.success(request, f'Your vote was changed to {selected_choice.choice_text}')
 
-    selected_choice.save()
-    logger.info(
-        f'User {this_user.username} submitted a vote for choice '
-        f'{selected_choice.id} on question {question.id}')
+    logger.info("User %s submitted a vote for choice %s on question %s",
+                this_user.username, selected_choice.id, question.id,
+                extra={"event": "vote", "user": this_user.username,
+                       "question_id": question.id, "choice_id": selected_choice.id})
     return HttpResponseRedirect(reverse("polls:results", args=(question.id,)))
 
 
+@query_budget(10)
 def delete_vote(request, question_id):
     """Handle when user delete the choice."""
     this_user = request.user
@@ -149,42 +285,54 @@ def delete_vote(request, question_id):
         question = get_object_or_404(Question, pk=question_id)
     except:
         messages.error(request, "Question not found")
-        logger.error(f"Non-existent question {question_id}")
+        logger.error("Non-existent question %s", question_id,
+                     extra={"event": "question_not_found", "question_id": question_id})
         return HttpResponseRedirect(reverse('polls:index'))
-    try:
-        vote = Vote.objects.get(user=this_user, choice__question=question)
-    except(KeyError, Vote.DoesNotExist):
+    if not question.can_vote():
+        # the results of a closed question are final
+        messages.error(request, "Section closed for voting")
+        logger.error("User try to delete a vote of closed question %s", question_id,
+                     extra={"event": "voting_closed", "question_id": question_id})
+        return HttpResponseRedirect(reverse('polls:index'))
+    if queue_enabled():
+        has_vote = this_user.is_authenticated and current_choice_id(this_user, question)
+        if has_vote:
+            enqueue_vote(this_user, question, None)
+    else:
+        has_vote = withdraw_vote(this_user, question) is not None
+    if not has_vote:
         messages.error(request, "You have not voted for this question")
-        logger.error(f"User try to delete non-existent vote for question {question_id}")
+        logger.error("User try to delete non-existent vote for question %s", question_id,
+                     extra={"event": "no_vote", "question_id": question_id})
         return HttpResponseRedirect(reverse('polls:detail', args=(question_id,)))
-    vote.delete()
     messages.success(request, "Your vote was deleted.")
-    logger.info(f"User {request.user.username} deleted their vote for question {question_id}")
+    logger.info("User %s deleted their vote for question %s", this_user.username, question_id,
+                extra={"event": "vote_deleted", "user": this_user.username,
+                       "question_id": question_id})
     return HttpResponseRedirect(reverse('polls:results', args=(question_id,)))
 
 
+@rate_limit("signup", get_client_ip)
 def signup(request):
     """Register a new user."""
     if request.method == 'POST':
         form = UserCreationForm(request.POST)
         if form.is_valid():
-            form.save()
-            # get named fields from the form data
-            username = form.cleaned_data.get('username')
-            # password input field is named 'password1'
-            raw_passwd = form.cleaned_data.get('password1')
-            user = authenticate(username=username, password=raw_passwd)
-            login(request, user)
+            # the password was hashed by save(), authenticate() would hash it again
+            user = form.save()
+            login(request, user, backend=settings.AUTHENTICATION_BACKENDS[0])
             messages.success(request, 'Registration successful.')
             ip_addr = get_client_ip(request)
-            logger.info(f"{user.username} registers from {ip_addr}")
+            logger.info("%s registers from %s", user.username, ip_addr,
+                        extra={"event": "signup", "user": user.username, "ip": ip_addr})
             return redirect('polls:index')
         else:
             # what if form is not valid?
             # we should display a message in signup.html
             username = form.cleaned_data.get('username')
             ip_addr = get_client_ip(request)
-            logger.warning(f"Authentication failed for user {username} from {ip_addr}")
+            logger.warning("Authentication failed for user %s from %s", username, ip_addr,
+                           extra={"event": "signup_failed", "user": username, "ip": ip_addr})
             messages.error(request, 'Authentication failed. Please try again.')
             return redirect('polls:signup')
     else: